@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+Content-addressed on-disk audio cache
+Files are keyed by a hash of (text, backend, voice, speed, format) and evicted
+least-recently-used first once the cache grows past its size cap
+"""
+
+import os
+import hashlib
+import logging
+import tempfile
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+AUDIO_MIMETYPES = {
+    'mp3': 'audio/mpeg',
+    'wav': 'audio/wav',
+    'ogg': 'audio/ogg',
+    'flac': 'audio/flac'
+}
+
+
+def audio_key(text, voice, speed, fmt, backend=''):
+    text_hash = hashlib.sha256(text.encode('utf-8')).hexdigest()
+    material = f'{text_hash}|{backend}|{voice}|{float(speed):.3f}|{fmt}'
+    return hashlib.sha256(material.encode('utf-8')).hexdigest()[:32]
+
+
+class AudioCache:
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # audio_id -> (path, size), least recently used first
+        self._files = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+
+        # Index whatever a previous run left behind, oldest access first; after
+        # this the size total and LRU order are kept in memory
+        found = []
+        for entry in os.scandir(directory):
+            audio_id, _, fmt = entry.name.partition('.')
+            if fmt in AUDIO_MIMETYPES and entry.is_file():
+                stat = entry.stat()
+                found.append((stat.st_mtime, audio_id, entry.path, stat.st_size))
+        for _, audio_id, path, size in sorted(found):
+            self._files[audio_id] = (path, size)
+            self._bytes += size
+
+    def get(self, audio_id):
+        """Return the cached file path for audio_id, or None"""
+        with self._lock:
+            entry = self._files.get(audio_id)
+            if entry and os.path.exists(entry[0]):
+                # The mtime carries the LRU order over to the next run
+                os.utime(entry[0])
+                self._files.move_to_end(audio_id)
+                self.hits += 1
+                return entry[0]
+            self._forget(audio_id)
+            self.misses += 1
+            return None
+
+    def path(self, audio_id):
+        """Look up a cached file without counting it as a cache access"""
+        entry = self._files.get(audio_id)
+        return entry[0] if entry and os.path.exists(entry[0]) else None
+
+    def store(self, audio_id, fmt, chunks):
+        """Write an iterable of byte chunks to the cache atomically"""
+        final_path = os.path.join(self.directory, f'{audio_id}.{fmt}')
+        temp_path = None
+        size = 0
+        try:
+            fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.part')
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in chunks:
+                    f.write(chunk)
+                    size += len(chunk)
+            os.replace(temp_path, final_path)
+        except BaseException:
+            # Streamed bodies hold an upstream connection until closed
+            close = getattr(chunks, 'close', None)
+            if close is not None:
+                close()
+            if temp_path is not None:
+                os.unlink(temp_path)
+            raise
+
+        with self._lock:
+            self._forget(audio_id)
+            self._files[audio_id] = (final_path, size)
+            self._bytes += size
+            self._evict()
+        return final_path
+
+    def _forget(self, audio_id):
+        entry = self._files.pop(audio_id, None)
+        if entry is not None:
+            self._bytes -= entry[1]
+
+    def _evict(self):
+        skipped = []
+        # Keep at least the newest file even if it alone exceeds the cap
+        while self._bytes > self.max_bytes and len(self._files) > 1:
+            audio_id, (path, size) = self._files.popitem(last=False)
+            self._bytes -= size
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.warning(f"Could not evict {path}: {e}")
+                skipped.append((audio_id, path, size))
+        # Files that could not be removed (e.g. open on Windows) stay oldest
+        for audio_id, path, size in reversed(skipped):
+            self._files[audio_id] = (path, size)
+            self._files.move_to_end(audio_id, last=False)
+            self._bytes += size
+
+    def stats(self):
+        with self._lock:
+            return {
+                'files': len(self._files),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses
+            }
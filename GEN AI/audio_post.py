@@ -0,0 +1,457 @@
+#!/usr/bin/env python3
+"""
+Vectorized audio post-processing
+Loudness normalization, silence trimming, inter-sentence gaps and
+crossfaded joins for 16-bit PCM WAV. Inputs are memory-mapped and processed
+in fixed-size blocks, so a multi-hour book is joined at constant memory:
+
+    python audio_post.py chapter1.wav chapter2.wav -o book.wav
+    python audio_post.py --benchmark --minutes 60
+"""
+
+import os
+import sys
+import json
+import time
+import wave
+import struct
+import argparse
+import tempfile
+
+import numpy as np
+
+
+class PostConfig:
+    def __init__(self):
+        self.enabled = os.getenv('AUDIO_POST_ENABLED', 'true').lower() == 'true'
+        self.target_dbfs = float(os.getenv('AUDIO_POST_TARGET_DBFS', '-20'))
+        self.max_gain_db = float(os.getenv('AUDIO_POST_MAX_GAIN_DB', '20'))
+        self.peak_dbfs = float(os.getenv('AUDIO_POST_PEAK_DBFS', '-1'))
+        self.silence_dbfs = float(os.getenv('AUDIO_POST_SILENCE_DBFS', '-50'))
+        self.trim_pad_ms = float(os.getenv('AUDIO_POST_TRIM_PAD_MS', '20'))
+        self.sentence_gap_ms = float(os.getenv('AUDIO_POST_SENTENCE_GAP_MS', '250'))
+        self.chapter_gap_ms = float(os.getenv('AUDIO_POST_CHAPTER_GAP_MS', '1500'))
+        self.crossfade_ms = float(os.getenv('AUDIO_POST_CROSSFADE_MS', '10'))
+        self.block_frames = int(os.getenv('AUDIO_POST_BLOCK_FRAMES', '65536'))
+
+
+# Loudness is measured like ITU-R BS.1770 (400 ms windows on a 100 ms hop,
+# -70 dBFS absolute and -10 dB relative gates) but without K-weighting
+SUBBLOCK_SECONDS = 0.1
+WINDOW_SUBBLOCKS = 4
+ABSOLUTE_GATE_DBFS = -70.0
+RELATIVE_GATE_DB = -10.0
+HISTOGRAM_STEP_DB = 0.1
+FULL_SCALE = 32768.0
+
+
+def dbfs(mean_square):
+    """Level of a mean square (of samples scaled to +-1) in dBFS"""
+    return 10 * np.log10(np.maximum(mean_square, 1e-20))
+
+
+def db_to_gain(db):
+    return 10 ** (db / 20)
+
+
+def read_wav(path):
+    """Memory-map the PCM payload of a 16-bit WAV file: (frames x channels array, sample_rate)"""
+    with open(path, 'rb') as f:
+        riff, _, wave_id = struct.unpack('<4sI4s', f.read(12))
+        if riff != b'RIFF' or wave_id != b'WAVE':
+            raise ValueError(f"{path} is not a WAV file")
+        fmt = None
+        while True:
+            header = f.read(8)
+            if len(header) < 8:
+                raise ValueError(f"{path} has no data chunk")
+            chunk_id, size = struct.unpack('<4sI', header)
+            if chunk_id == b'fmt ':
+                fmt = struct.unpack('<HHIIHH', f.read(16))
+                f.seek(size - 16 + (size & 1), os.SEEK_CUR)
+            elif chunk_id == b'data':
+                offset = f.tell()
+                break
+            else:
+                f.seek(size + (size & 1), os.SEEK_CUR)
+    if fmt is None or fmt[0] != 1 or fmt[5] != 16:
+        raise ValueError(f"{path} is not 16-bit PCM")
+    channels, sample_rate = fmt[1], fmt[2]
+    # Streamed WAVs carry a placeholder length; the file size is authoritative
+    available = os.path.getsize(path) - offset
+    size = available if size in (0, 0xFFFFFFFF) else min(size, available)
+    frames = size // (2 * channels)
+    if frames == 0:
+        return np.zeros((0, channels), dtype='<i2'), sample_rate
+    samples = np.memmap(path, dtype='<i2', mode='r', offset=offset, shape=(frames * channels,))
+    return samples.reshape(frames, channels), sample_rate
+
+
+class LoudnessMeter:
+    """Gated loudness and peak of audio fed block by block, in constant memory"""
+
+    def __init__(self, sample_rate):
+        self.subblock = max(int(sample_rate * SUBBLOCK_SECONDS), 1)
+        self._remainder = np.zeros(0, dtype=np.float64)
+        self._recent = np.zeros(0, dtype=np.float64)     # last sub-block energies, for window overlap
+        bins = int(-ABSOLUTE_GATE_DBFS / HISTOGRAM_STEP_DB) + 1
+        self._counts = np.zeros(bins, dtype=np.int64)
+        self._energy = np.zeros(bins, dtype=np.float64)
+        self.peak = 0.0
+        self.frames = 0
+
+    def feed(self, block):
+        """Add a (frames x channels) int16 block"""
+        if not len(block):
+            return
+        self.frames += len(block)
+        self.peak = max(self.peak, float(np.abs(block, dtype=np.int32).max()) / FULL_SCALE)
+        power = np.square(block, dtype=np.float64).mean(axis=1) / (FULL_SCALE * FULL_SCALE)
+        power = np.concatenate((self._remainder, power))
+        whole = len(power) - len(power) % self.subblock
+        self._remainder = power[whole:]
+        if not whole:
+            return
+        energies = np.concatenate((self._recent, power[:whole].reshape(-1, self.subblock).mean(axis=1)))
+        if len(energies) >= WINDOW_SUBBLOCKS:
+            windows = np.convolve(energies, np.full(WINDOW_SUBBLOCKS, 1 / WINDOW_SUBBLOCKS), mode='valid')
+            self._add_windows(windows)
+        self._recent = energies[-(WINDOW_SUBBLOCKS - 1):]
+
+    def _add_windows(self, windows):
+        levels = dbfs(windows)
+        gated = levels > ABSOLUTE_GATE_DBFS
+        index = np.minimum(((levels[gated] - ABSOLUTE_GATE_DBFS) / HISTOGRAM_STEP_DB).astype(np.int64),
+                           len(self._counts) - 1)
+        self._counts += np.bincount(index, minlength=len(self._counts))
+        self._energy += np.bincount(index, weights=windows[gated], minlength=len(self._counts))
+
+    def loudness(self):
+        """Gated level in dBFS, or None for silence"""
+        if not self._counts.any() and self.frames:
+            # Shorter than one window: fall back to the plain mean of what was seen
+            energies = np.concatenate((self._recent, [self._remainder.mean()] if len(self._remainder) else []))
+            if not len(energies) or dbfs(energies.mean()) <= ABSOLUTE_GATE_DBFS:
+                return None
+            return float(dbfs(energies.mean()))
+        total = self._counts.sum()
+        if not total:
+            return None
+        ungated = dbfs(self._energy.sum() / total)
+        first = max(int((ungated + RELATIVE_GATE_DB - ABSOLUTE_GATE_DBFS) / HISTOGRAM_STEP_DB), 0)
+        counts, energy = self._counts[first:].sum(), self._energy[first:].sum()
+        return float(dbfs(energy / counts)) if counts else float(ungated)
+
+
+def normalization_gain(meter, config):
+    """Gain (dB) bringing the measured loudness to the target without exceeding the peak ceiling"""
+    loudness = meter.loudness()
+    if loudness is None:
+        return 0.0
+    gain = min(config.target_dbfs - loudness, config.max_gain_db)
+    if meter.peak > 0:
+        gain = min(gain, config.peak_dbfs - 20 * np.log10(meter.peak))
+    return float(gain)
+
+
+def trim_bounds(samples, sample_rate, config):
+    """(start, end) frames without leading and trailing silence, scanning blocks from each end"""
+    threshold = FULL_SCALE * db_to_gain(config.silence_dbfs)
+    pad = int(sample_rate * config.trim_pad_ms / 1000)
+    block = config.block_frames
+    frames = len(samples)
+
+    start = None
+    for offset in range(0, frames, block):
+        loud = np.flatnonzero(np.abs(samples[offset:offset + block], dtype=np.int32).max(axis=1) > threshold)
+        if len(loud):
+            start = offset + int(loud[0])
+            break
+    if start is None:
+        return 0, 0
+
+    end = start + 1
+    for offset in range(frames, start, -block):
+        lower = max(offset - block, start)
+        loud = np.flatnonzero(np.abs(samples[lower:offset], dtype=np.int32).max(axis=1) > threshold)
+        if len(loud):
+            end = lower + int(loud[-1]) + 1
+            break
+    return max(start - pad, 0), min(end + pad, frames)
+
+
+def fade_curves(length):
+    """Equal-power fade-in and fade-out ramps as column vectors"""
+    position = (np.arange(length, dtype=np.float32) + 0.5) / max(length, 1)
+    return np.sin(position * np.pi / 2)[:, None], np.cos(position * np.pi / 2)[:, None]
+
+
+def to_int16(block):
+    return np.clip(np.rint(block), -32768, 32767).astype('<i2')
+
+
+class JoinedWriter:
+    """Writes gained, faded and gapped pieces to a WAV file, overlapping joins without gaps"""
+
+    def __init__(self, out, sample_rate, channels, config):
+        self.out = out
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.config = config
+        self.frames = 0
+        self._tail = None       # faded-out end of the previous piece, waiting for the next head
+
+    def _write(self, block):
+        self.out.writeframesraw(to_int16(block).tobytes())
+        self.frames += len(block)
+
+    def silence(self, ms):
+        remaining = int(self.sample_rate * ms / 1000)
+        block = np.zeros((min(remaining, self.config.block_frames), self.channels), dtype=np.float32)
+        while remaining > 0:
+            self._write(block[:remaining])
+            remaining -= len(block)
+
+    def pending(self):
+        return len(self._tail) if self._tail is not None else 0
+
+    def position(self):
+        """Output frames including a tail not yet written"""
+        return self.frames + self.pending()
+
+    def piece(self, samples, start, end, gain, fade, overlap):
+        """Write samples[start:end] scaled by gain, returning its first output frame.
+
+        fade frames at each end are faded; with overlap, the head is mixed
+        into the previous piece's faded tail instead of following it.
+        """
+        if not overlap:
+            self.close()
+        length = end - start
+        fade = min(fade, length // 2)
+        fade_in, fade_out = fade_curves(fade)
+        first = self.frames
+        incoming, self._tail = self._tail, None
+
+        block_size = self.config.block_frames
+        for offset in range(start, end, block_size):
+            block = samples[offset:min(offset + block_size, end)].astype(np.float32) * gain
+            head = fade - (offset - start)
+            if head > 0:
+                block[:head] *= fade_in[fade - head:fade - head + len(block)]
+            if incoming is not None and len(incoming):
+                mixed = min(len(incoming), len(block))
+                block[:mixed] += incoming[:mixed]
+                incoming = incoming[mixed:]
+            tail_from = max((end - fade) - offset, 0)
+            if tail_from < len(block):
+                # Hold the faded tail back; it is written (or overlapped) with the next piece
+                done = offset + tail_from - (end - fade)
+                faded = block[tail_from:] * fade_out[done:done + len(block) - tail_from]
+                self._tail = faded if self._tail is None else np.concatenate((self._tail, faded))
+                block = block[:tail_from]
+            self._write(block)
+        return first
+
+    def close(self):
+        if self._tail is not None:
+            self._write(self._tail)
+            self._tail = None
+
+
+def join_wavs(groups, out_path, config=None):
+    """Join groups of WAV files (e.g. chapters of sentence chunks) into one normalized WAV.
+
+    Two passes over memory-mapped inputs: the first measures loudness and
+    trim points, the second writes. Files in a group are separated by
+    sentence_gap_ms, groups by chapter_gap_ms; a zero gap crossfades the
+    join. Returns per-group placements and processing stats.
+    """
+    config = config or PostConfig()
+    started = time.perf_counter()
+    opened = [[read_wav(path) for path in group] for group in groups]
+    rates = {rate for group in opened for _, rate in group}
+    channels = {samples.shape[1] for group in opened for samples, _ in group}
+    if len(rates) > 1 or len(channels) > 1:
+        raise ValueError(f"Inputs differ in sample rate or channels: {sorted(rates)} / {sorted(channels)}")
+    sample_rate = rates.pop() if rates else 16000
+    channel_count = channels.pop() if channels else 1
+
+    meter = LoudnessMeter(sample_rate)
+    bounds, input_frames = [], 0
+    for group in opened:
+        group_bounds = []
+        for samples, _ in group:
+            input_frames += len(samples)
+            start, end = trim_bounds(samples, sample_rate, config)
+            group_bounds.append((start, end))
+            for offset in range(start, end, config.block_frames):
+                meter.feed(samples[offset:min(offset + config.block_frames, end)])
+        bounds.append(group_bounds)
+    measured = time.perf_counter() - started
+    loudness = meter.loudness()
+    gain_db = normalization_gain(meter, config)
+    gain = db_to_gain(gain_db)
+    fade = int(sample_rate * config.crossfade_ms / 1000)
+
+    placements = []
+    with wave.open(out_path, 'wb') as out:
+        out.setnchannels(channel_count)
+        out.setsampwidth(2)
+        out.setframerate(sample_rate)
+        writer = JoinedWriter(out, sample_rate, channel_count, config)
+        written = 0
+        for group, group_bounds in zip(opened, bounds):
+            group_start = None
+            for index, ((samples, _), (start, end)) in enumerate(zip(group, group_bounds)):
+                if end <= start:
+                    continue
+                gap = config.chapter_gap_ms if group_start is None else config.sentence_gap_ms
+                # Without a gap the join is crossfaded, if the piece is long enough to absorb the tail
+                overlap = written > 0 and gap <= 0 and end - start >= writer.pending()
+                if written and not overlap:
+                    writer.close()
+                    writer.silence(gap)
+                first = writer.piece(samples, start, end, gain, fade, overlap)
+                group_start = first if group_start is None else group_start
+                written += 1
+            placements.append({
+                'start_frame': group_start if group_start is not None else writer.position(),
+                'frames': writer.position() - group_start if group_start is not None else 0
+            })
+        writer.close()
+
+    elapsed = time.perf_counter() - started
+    return placements, {
+        'sample_rate': sample_rate,
+        'channels': channel_count,
+        'loudness_dbfs': round(loudness, 2) if loudness is not None else None,
+        'peak_dbfs': round(20 * float(np.log10(meter.peak)), 2) if meter.peak > 0 else None,
+        'gain_db': round(gain_db, 2),
+        'input_frames': input_frames,
+        'output_frames': writer.frames,
+        'elapsed_seconds': round(elapsed, 3),
+        'measure_seconds': round(measured, 3),
+        'samples_per_second': round(input_frames * channel_count / elapsed) if elapsed else None
+    }
+
+
+def process_chunk(samples, sample_rate, config=None, gap_ms=None):
+    """Trim, normalize and fade one chunk (frames x channels int16), returning PCM bytes and a gap.
+
+    For streams, where the whole book cannot be measured first; each chunk
+    is normalized to the target on its own.
+    """
+    config = config or PostConfig()
+    channels = samples.shape[1]
+    start, end = trim_bounds(samples, sample_rate, config)
+    gap = np.zeros((int(sample_rate * (config.sentence_gap_ms if gap_ms is None else gap_ms) / 1000), channels),
+                   dtype='<i2')
+    if end <= start:
+        return gap.tobytes()
+    piece = samples[start:end]
+    meter = LoudnessMeter(sample_rate)
+    meter.feed(piece)
+    block = piece.astype(np.float32) * db_to_gain(normalization_gain(meter, config))
+    fade = min(int(sample_rate * config.crossfade_ms / 1000), len(block) // 2)
+    if fade:
+        fade_in, fade_out = fade_curves(fade)
+        block[:fade] *= fade_in
+        block[len(block) - fade:] *= fade_out
+    return to_int16(block).tobytes() + gap.tobytes()
+
+
+def write_test_wav(path, seconds, sample_rate=16000, block_frames=65536, seed=1):
+    """Speech-like test signal (tone bursts of varying level with pauses), written block by block"""
+    rng = np.random.default_rng(seed)
+    total = int(seconds * sample_rate)
+    with wave.open(path, 'wb') as out:
+        out.setnchannels(1)
+        out.setsampwidth(2)
+        out.setframerate(sample_rate)
+        out.writeframesraw(np.zeros(sample_rate // 2, dtype='<i2').tobytes())
+        for offset in range(0, total, block_frames):
+            t = np.arange(offset, min(offset + block_frames, total)) / sample_rate
+            envelope = (np.sin(2 * np.pi * 0.7 * t) > -0.3) * (0.2 + 0.15 * np.sin(2 * np.pi * 0.05 * t))
+            signal = envelope * np.sin(2 * np.pi * 220 * t) + rng.normal(0, 0.003, len(t))
+            out.writeframesraw(to_int16(signal * 32767).tobytes())
+        out.writeframesraw(np.zeros(sample_rate // 2, dtype='<i2').tobytes())
+
+
+def python_loop_rate(samples, gain):
+    """Samples/sec of the same gain-and-clip stage as a per-sample Python loop, for comparison"""
+    started = time.perf_counter()
+    out = [max(-32768, min(32767, int(round(s * gain)))) for s in samples.tolist()]
+    return len(out) / (time.perf_counter() - started)
+
+
+def benchmark(minutes=10, chunks=20, sample_rate=16000, config=None):
+    """Throughput of each stage, in samples/sec, on a synthetic book"""
+    config = config or PostConfig()
+    workdir = tempfile.mkdtemp(prefix='audio-post-bench-')
+    try:
+        paths = []
+        for index in range(chunks):
+            path = os.path.join(workdir, f'chunk{index}.wav')
+            write_test_wav(path, minutes * 60 / chunks, sample_rate, seed=index)
+            paths.append(path)
+        inputs = [read_wav(path)[0] for path in paths]
+        total = sum(len(samples) for samples in inputs)
+
+        started = time.perf_counter()
+        for samples in inputs:
+            trim_bounds(samples, sample_rate, config)
+        trim_seconds = time.perf_counter() - started
+
+        started = time.perf_counter()
+        meter = LoudnessMeter(sample_rate)
+        for samples in inputs:
+            for offset in range(0, len(samples), config.block_frames):
+                meter.feed(samples[offset:offset + config.block_frames])
+        measure_seconds = time.perf_counter() - started
+
+        output = os.path.join(workdir, 'joined.wav')
+        _, stats = join_wavs([paths[:chunks // 2], paths[chunks // 2:]], output, config)
+
+        started = time.perf_counter()
+        chunk = inputs[0][:sample_rate * 30]
+        process_chunk(chunk, sample_rate, config)
+        chunk_seconds = time.perf_counter() - started
+        chunk_frames = len(chunk)
+
+        return {
+            'audio_minutes': round(total / sample_rate / 60, 2),
+            'input_samples': total,
+            'block_frames': config.block_frames,
+            'samples_per_second': {
+                'trim': round(total / trim_seconds),
+                'measure': round(total / measure_seconds),
+                'join_total': stats['samples_per_second'],
+                'process_chunk': round(chunk_frames / chunk_seconds),
+                'python_loop_gain': round(python_loop_rate(inputs[0][:sample_rate * 2, 0], 1.5))
+            },
+            'realtime_factor': round(total / sample_rate / stats['elapsed_seconds'], 1),
+            'join': stats
+        }
+    finally:
+        for name in os.listdir(workdir):
+            os.remove(os.path.join(workdir, name))
+        os.rmdir(workdir)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Normalize, trim and join 16-bit PCM WAV files')
+    parser.add_argument('inputs', nargs='*', help='WAV files, joined in order with sentence gaps')
+    parser.add_argument('-o', '--output', help='output WAV file')
+    parser.add_argument('--benchmark', action='store_true', help='measure throughput on synthetic audio')
+    parser.add_argument('--minutes', type=float, default=10, help='benchmark audio length')
+    args = parser.parse_args()
+
+    if args.benchmark:
+        print(json.dumps(benchmark(args.minutes), indent=2))
+    elif args.inputs and args.output:
+        _, stats = join_wavs([args.inputs], args.output)
+        print(json.dumps(stats, indent=2))
+    else:
+        parser.print_usage()
+        sys.exit(2)
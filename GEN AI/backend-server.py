@@ -6,15 +6,38 @@ Integrates IBM Watson Text-to-Speech and Watsonx LLM for tone-adaptive audiobook
 
 import os
 import json
-import base64
-from flask import Flask, request, jsonify, send_file
+import wave
+import hashlib
+import logging
+from flask import Flask, Response, request, jsonify, send_file, stream_with_context
 from flask_cors import CORS
-import requests
+from werkzeug.serving import is_running_from_reloader
 from io import BytesIO
+import shutil
 import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+from http_pool import http_pool
+from singleflight import SingleFlight
+from text_chunker import chunk_text, estimate_tokens, map_chunks, stitch
+from audio_cache import AudioCache, AUDIO_MIMETYPES, audio_key
+from job_queue import JobQueue
+from rate_limiter import set_client, upstream_limiter
+from tone_rewriter import ToneRewriter, DEFAULT_TONE_RULES, load_tone_rules
+from project_store import ProjectNotFound, process_chapters, project_store, request_text
+from metrics import instrument_flask, registry, stage
+from static_assets import StaticAssets
+from tts_backends import LocalTTS, TTSRouter, TTSUnavailable, WatsonTTS, available_cores, parse_voice_backends
+import local_tts
+import audio_post
+import ssml
+
+logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 CORS(app)
+instrument_flask(app)
+page_assets = StaticAssets(os.path.dirname(os.path.abspath(__file__)), ['advanced-audiobook.html'])
 
 # Configuration (replace with actual API keys)
 WATSON_TTS_CONFIG = {
@@ -25,7 +48,26 @@ WATSON_TTS_CONFIG = {
 WATSONX_CONFIG = {
     'api_key': os.getenv('WATSONX_API_KEY', 'your_api_key_here'),
     'url': os.getenv('WATSONX_URL', 'https://us-south.ml.cloud.ibm.com'),
-    'project_id': os.getenv('WATSONX_PROJECT_ID', 'your_project_id_here')
+    'project_id': os.getenv('WATSONX_PROJECT_ID', 'your_project_id_here'),
+    'max_new_tokens': int(os.getenv('WATSONX_MAX_NEW_TOKENS', '2048')),
+    'chunk_tokens': int(os.getenv('WATSONX_CHUNK_TOKENS', '1024')),
+    'chunk_concurrency': int(os.getenv('WATSONX_CHUNK_CONCURRENCY', '4'))
+}
+
+AUDIO_CONFIG = {
+    'cache_dir': os.getenv('AUDIO_CACHE_DIR', 'audio_cache'),
+    'max_bytes': int(os.getenv('AUDIO_CACHE_MAX_BYTES', str(2 * 1024 ** 3))),
+    'format': os.getenv('AUDIO_FORMAT', 'mp3'),
+    # Sentence groups synthesized per request when streaming a chapter
+    'stream_chunk_tokens': int(os.getenv('AUDIO_STREAM_CHUNK_TOKENS', '100')),
+    'stream_concurrency': int(os.getenv('AUDIO_STREAM_CONCURRENCY', '4'))
+}
+
+EXPORT_CONFIG = {
+    'export_dir': os.getenv('EXPORT_DIR', 'exports'),
+    'jobs_db': os.getenv('EXPORT_JOBS_DB', 'export_jobs.db'),
+    'workers': int(os.getenv('EXPORT_WORKERS', '2')),
+    'concurrency': int(os.getenv('EXPORT_CONCURRENCY', '4'))
 }
 
 WATSON_VOICES = {
@@ -34,15 +76,91 @@ WATSON_VOICES = {
     'allison': 'en-US_AllisonV3Voice'
 }
 
+# Offline voices: name -> pitch factor of the local tone generator
+LOCAL_VOICES = {
+    'lisa': 1.15,
+    'michael': 0.8,
+    'allison': 1.05,
+    'narrator': 0.9
+}
+
+TTS_CONFIG = {
+    # 'auto' uses Watson when configured and available, else the local engine
+    'backend': os.getenv('TTS_BACKEND', 'auto'),
+    # Per-voice overrides, e.g. "narrator=local,lisa=watson"
+    'voice_backends': parse_voice_backends(os.getenv('TTS_VOICE_BACKENDS')),
+    'local_workers': int(os.getenv('LOCAL_TTS_WORKERS', str(available_cores()))),
+    # Render locally while Watson is throttled, out of quota or unreachable
+    'fallback': os.getenv('TTS_FALLBACK', 'true').lower() == 'true',
+    'cooldown': float(os.getenv('WATSON_TTS_COOLDOWN', '60'))
+}
+
+SSML_CONFIG = {
+    'enabled': os.getenv('SSML_ENABLED', 'true').lower() == 'true',
+    # JSON {phrase: pronunciation} for every request; project lexicons extend it
+    'lexicon_path': os.getenv('LEXICON_PATH'),
+    'dialogue_pause_ms': int(os.getenv('SSML_DIALOGUE_PAUSE_MS', '300')),
+    'paragraph_pause_ms': int(os.getenv('SSML_PARAGRAPH_PAUSE_MS', '700'))
+}
+
+PLACEHOLDER_KEY = 'your_api_key_here'
+
+rewrite_inflight = SingleFlight()
+synthesis_inflight = SingleFlight()
+
+# Offline rewrite dictionaries; TONE_RULES_PATH points at a JSON file of
+# {tone: {phrase: replacement}} that extends or overrides the defaults
+tone_rules = dict(DEFAULT_TONE_RULES)
+if os.getenv('TONE_RULES_PATH'):
+    tone_rules.update(load_tone_rules(os.getenv('TONE_RULES_PATH')))
+tone_rewriter = ToneRewriter(tone_rules)
+audio_cache = AudioCache(AUDIO_CONFIG['cache_dir'], AUDIO_CONFIG['max_bytes'])
+post_config = audio_post.PostConfig()
+base_lexicon = ssml.load_lexicon(SSML_CONFIG['lexicon_path']) if SSML_CONFIG['lexicon_path'] else {}
+tts_router = TTSRouter(
+    [
+        WatsonTTS(WATSON_TTS_CONFIG['api_key'], WATSON_TTS_CONFIG['url'], WATSON_VOICES, http_pool,
+                  TTS_CONFIG['cooldown']),
+        LocalTTS(LOCAL_VOICES, TTS_CONFIG['local_workers'])
+    ],
+    default=TTS_CONFIG['backend'],
+    voice_backends=TTS_CONFIG['voice_backends'],
+    fallback=TTS_CONFIG['fallback']
+)
+
 TONE_PROMPTS = {
     'neutral': "Rewrite the following text in a neutral, factual tone while preserving all key information:",
     'suspenseful': "Rewrite the following text in a suspenseful, dramatic tone that builds tension:",
     'inspiring': "Rewrite the following text in an inspiring, motivational tone that uplifts the reader:"
 }
 
+@app.before_request
+def identify_client():
+    """Queue this request's upstream calls fairly against other clients"""
+    set_client(request.headers.get('X-Client-Id') or request.remote_addr)
+
 @app.route('/')
 def index():
-    return send_file('advanced-audiobook.html')
+    asset = page_assets.get('advanced-audiobook.html')
+    if asset is None:
+        return jsonify({'error': 'Page not found'}), 404
+    # Precompressed body; make_conditional answers If-None-Match/If-Modified-Since with 304
+    body, headers = asset.select(request.headers.get('Accept-Encoding'))
+    return Response(body, headers=headers, content_type=asset.mimetype).make_conditional(request)
+
+@app.route('/health')
+def health_check():
+    """Health check endpoint"""
+    return jsonify({
+        'status': 'healthy',
+        'http_pool': http_pool.stats(),
+        'coalescing': rewrite_inflight.stats(),
+        'audio_cache': audio_cache.stats(),
+        'watson_tts_configured': watson_tts_configured(),
+        'tts': tts_router.stats(),
+        'ssml_cache': ssml.sentence_cache.stats(),
+        'rate_limiter': upstream_limiter.stats()
+    })
 
 @app.route('/api/rewrite-text', methods=['POST'])
 def rewrite_text():
@@ -55,9 +173,14 @@ def rewrite_text():
         if not text:
             return jsonify({'error': 'No text provided'}), 400
             
-        # For demo purposes, use local simulation
-        # In production, replace with actual Watsonx API call
-        rewritten = simulate_watsonx_rewrite(text, tone)
+        if watsonx_configured():
+            # Identical concurrent rewrites share one Watsonx call
+            rewritten = rewrite_inflight.do(
+                (tone, text), lambda: call_watsonx_api(text, tone)
+            )
+        else:
+            # Local simulation when no Watsonx credentials are configured
+            rewritten = simulate_watsonx_rewrite(text, tone)
         
         return jsonify({
             'original_text': text,
@@ -74,153 +197,636 @@ def generate_speech():
     """Generate speech using IBM Watson Text-to-Speech"""
     try:
         data = request.json
-        text = data.get('text', '')
+        text = request_text(project_store, data)
         voice = data.get('voice', 'lisa')
-        speed = data.get('speed', 1.0)
+        speed = float(data.get('speed', 1.0))
         
         if not text:
             return jsonify({'error': 'No text provided'}), 400
-            
-        # For demo purposes, simulate Watson TTS
-        # In production, replace with actual Watson TTS API call
-        audio_url = simulate_watson_tts(text, voice, speed)
+        backend = tts_router.select(voice, data.get('backend'))
+        
+        # An explicitly requested backend is never swapped for another
+        audio = synthesize_text(text, voice, speed, data.get('format'), backend,
+                                fallback=not data.get('backend'), preprocessor=speech_preprocessor(data))
         
         return jsonify({
-            'audio_url': audio_url,
+            'audio_url': f"/api/download-audio/{audio['audio_id']}",
+            'audio_id': audio['audio_id'],
+            'format': audio['format'],
+            'cached': audio['cached'],
+            'backend': audio['backend'],
+            'parts': audio['parts'],
+            'parts_rendered': audio['parts_rendered'],
             'voice': voice,
             'status': 'success'
         })
         
+    except ProjectNotFound:
+        return jsonify({'error': 'Project or chapter not found'}), 404
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/ssml', methods=['POST'])
+def preview_ssml():
+    """SSML that would be sent for text, with the base, project (project_id) and inline lexicons"""
+    try:
+        data = request.get_json() or {}
+        preprocessor = speech_preprocessor(dict(data, ssml=True))
+        return jsonify({
+            'ssml': preprocessor.convert(data.get('text', '')),
+            'version': preprocessor.version,
+            'lexicon_entries': len(preprocessor.lexicon)
+        })
+        
+    except ProjectNotFound:
+        return jsonify({'error': 'Project not found'}), 404
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/projects/<book_id>/lexicon', methods=['GET', 'PUT'])
+def project_lexicon(book_id):
+    """Read or replace a project's pronunciation lexicon {phrase: alias | {ipa|ibm: spelling}}"""
+    try:
+        if request.method == 'PUT':
+            data = request.get_json() or {}
+            entries = data.get('entries', {})
+            ssml.Lexicon(entries)    # validates before storing
+            project_store.put_lexicon(book_id, entries)
+        entries = project_store.get_lexicon(book_id)
+        return jsonify({
+            'entries': entries,
+            'version': ssml.Lexicon(entries).version,
+            'status': 'success'
+        })
+        
+    except ProjectNotFound:
+        return jsonify({'error': 'Project not found'}), 404
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/voices')
+def list_voices():
+    """Voices per TTS backend and which backends can currently be used"""
+    return jsonify({
+        'voices': tts_router.voices(),
+        'default_backend': tts_router.default,
+        'available': [name for name, backend in tts_router.backends.items() if backend.available()]
+    })
+
+@app.route('/api/generate-speech/stream', methods=['GET', 'POST'])
+def generate_speech_stream():
+    """Synthesize a chapter in sentence-group chunks, streaming audio in order as chunks finish"""
+    # GET lets an <audio> element play the stream directly
+    data = request.json if request.method == 'POST' else request.args
+    voice = data.get('voice', 'lisa')
+    speed = float(data.get('speed', 1.0))
+    fmt = data.get('format')
+    
+    try:
+        text = request_text(project_store, data)
+        if not text:
+            return jsonify({'error': 'No text provided'}), 400
+        backend = tts_router.select(voice, data.get('backend'))
+        preprocessor = speech_preprocessor(data)
+    except ProjectNotFound:
+        return jsonify({'error': 'Project or chapter not found'}), 404
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    chunks = chunk_text(text, AUDIO_CONFIG['stream_chunk_tokens'])
+    fmt = output_format(backend, fmt)
+    executor = ThreadPoolExecutor(
+        max_workers=max(1, min(max(AUDIO_CONFIG['stream_concurrency'], backend.workers), len(chunks)))
+    )
+    futures = [
+        executor.submit(synthesize_speech, chunk.text, voice, speed, fmt, backend, preprocessor=preprocessor)
+        for chunk in chunks
+    ]
+    
+    def audio_stream():
+        try:
+            if fmt == 'wav':
+                yield local_tts.streaming_wav_header()
+            for index, future in enumerate(futures):
+                path = audio_cache.path(future.result()['audio_id'])
+                if fmt == 'wav' and post_config.enabled:
+                    # Trimmed, level-matched sentence groups separated by a fixed pause
+                    samples, sample_rate = audio_post.read_wav(path)
+                    yield audio_post.process_chunk(
+                        samples, sample_rate, post_config, gap_ms=0 if index == len(futures) - 1 else None
+                    )
+                elif fmt == 'wav':
+                    yield from local_tts.iter_wav_frames(path)
+                else:
+                    # MP3 frames from consecutive files concatenate into one playable stream
+                    with open(path, 'rb') as f:
+                        while True:
+                            block = f.read(64 * 1024)
+                            if not block:
+                                break
+                            yield block
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+    
+    return Response(
+        stream_with_context(audio_stream()),
+        mimetype=AUDIO_MIMETYPES.get(fmt, 'audio/mpeg'),
+        headers={'X-Audio-Chunks': str(len(chunks)), 'Cache-Control': 'no-cache'}
+    )
+
+@app.route('/api/projects/<book_id>/speech', methods=['POST'])
+def project_speech(book_id):
+    """Synthesize a stored book, re-rendering only chapters edited since their last render.
+    
+    After a lexicon edit every chapter is joined again, but only the sentence
+    groups whose SSML changed are sent to the TTS backend.
+    """
+    try:
+        data = request.get_json() or {}
+        voice = data.get('voice', 'lisa')
+        speed = float(data.get('speed', 1.0))
+        
+        backend = tts_router.select(voice, data.get('backend'))
+        fmt = output_format(backend, data.get('format'))
+        preprocessor = speech_preprocessor(data, book_id)
+        
+        def render(chapter):
+            return synthesize_text(chapter['content'], voice, speed, fmt, backend, preprocessor=preprocessor), True
+        
+        rules = preprocessor.version if preprocessor else 'text'
+        # A render whose file the cache has since evicted is rendered again
+        processed = process_chapters(
+            project_store, book_id, 'audio', f"{backend.name}:{voice}:{speed}:{fmt}:{rules}",
+            render, max(EXPORT_CONFIG['concurrency'], backend.workers), data.get('chapter_ids'),
+            valid=lambda audio: audio_cache.path(audio['audio_id']) is not None
+        )
+        
+        return jsonify({
+            'chapters': [{
+                'id': chapter['id'],
+                'title': chapter['title'],
+                'audio_url': f"/api/download-audio/{audio['audio_id']}",
+                'audio_id': audio['audio_id'],
+                'format': audio['format'],
+                'reused': reused
+            } for chapter, audio, reused in processed],
+            'rendered': sum(1 for _, _, reused in processed if not reused),
+            'parts_rendered': sum(audio.get('parts_rendered', 0) for _, audio, reused in processed if not reused),
+            'voice': voice,
+            'status': 'success'
+        })
+        
+    except ProjectNotFound:
+        return jsonify({'error': 'Project not found'}), 404
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/export-book', methods=['POST'])
+def export_book():
+    """Queue rendering of a whole book into one audio file plus a chapter index"""
+    try:
+        data = request.json
+        chapters = data.get('chapters', [])
+        voice = data.get('voice', 'lisa')
+        speed = float(data.get('speed', 1.0))
+        
+        if not chapters:
+            return jsonify({'error': 'No chapters provided'}), 400
+        backend = tts_router.select(voice, data.get('backend'))
+        
+        chapters = [
+            {'title': c.get('title', f'Chapter {i + 1}'), 'content': c.get('content', '')}
+            if isinstance(c, dict) else {'title': f'Chapter {i + 1}', 'content': str(c)}
+            for i, c in enumerate(chapters)
+        ]
+        fmt = output_format(backend, data.get('format'))
+        preprocessor = speech_preprocessor(data)
+        lexicon = preprocessor.lexicon.entries if preprocessor else None
+        
+        # The export id is derived from the book itself, so resubmitting the
+        # same book resumes from the chapters already in the audio cache
+        export_id = hashlib.sha256(
+            json.dumps([chapters, voice, speed, fmt, backend.name]
+                       + ([preprocessor.version] if preprocessor else [])).encode('utf-8')
+        ).hexdigest()[:32]
+        job_id = export_jobs.submit('export-book', {
+            'export_id': export_id,
+            'title': data.get('title', 'Audiobook'),
+            'chapters': chapters,
+            'voice': voice,
+            'speed': speed,
+            'format': fmt,
+            'backend': backend.name,
+            'lexicon': lexicon
+        })
+        
+        return jsonify({
+            'job_id': job_id,
+            'export_id': export_id,
+            'status_url': f'/api/jobs/{job_id}',
+            'download_url': f'/api/exports/{export_id}',
+            'index_url': f'/api/exports/{export_id}/index'
+        }), 202
+        
+    except ProjectNotFound:
+        return jsonify({'error': 'Project not found'}), 404
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/jobs/<job_id>')
+def get_job(job_id):
+    """Report status and progress of an export job"""
+    job = export_jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    job.pop('params', None)
+    return jsonify(job)
+
+@app.route('/api/exports/<export_id>')
+def download_export(export_id):
+    """Download a finished audiobook export"""
+    index = load_export_index(export_id)
+    if index is None:
+        return jsonify({'error': 'Export not found'}), 404
+    return send_file(
+        os.path.join(EXPORT_CONFIG['export_dir'], index['file']),
+        mimetype=AUDIO_MIMETYPES[index['format']],
+        as_attachment=True,
+        download_name=f"{index['title']}.{index['format']}",
+        conditional=True,
+        etag=export_id
+    )
+
+@app.route('/api/exports/<export_id>/index')
+def export_index(export_id):
+    """Chapter index (titles, offsets, durations) of a finished export"""
+    index = load_export_index(export_id)
+    if index is None:
+        return jsonify({'error': 'Export not found'}), 404
+    return jsonify(index)
+
 @app.route('/api/download-audio/<audio_id>')
 def download_audio(audio_id):
     """Download generated audio file"""
     try:
-        # In production, retrieve actual audio file
-        # For demo, return a placeholder
-        return jsonify({'message': 'Audio download would be implemented here'})
+        path = audio_cache.path(audio_id)
+        if path is None:
+            return jsonify({'error': 'Audio not found'}), 404
+        
+        fmt = path.rsplit('.', 1)[-1]
+        # Content-addressed files never change, so the id doubles as a strong ETag
+        # and conditional=True adds If-None-Match and Range (206) handling
+        return send_file(
+            path,
+            mimetype=AUDIO_MIMETYPES[fmt],
+            as_attachment=request.args.get('download') == '1',
+            download_name=f'{audio_id}.{fmt}',
+            conditional=True,
+            etag=audio_id,
+            max_age=31536000
+        )
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+def watsonx_configured():
+    """True when real Watsonx credentials have been provided"""
+    return WATSONX_CONFIG['api_key'] not in ('', PLACEHOLDER_KEY)
+
 def simulate_watsonx_rewrite(text, tone):
-    """Simulate IBM Watsonx text rewriting (replace with actual API call)"""
-    
-    tone_adjustments = {
-        'neutral': {
-            'replacements': {
-                'majestically': 'prominently',
-                'ancient': 'old',
-                'mysterious': 'unexplained',
-                'emerged': 'appeared',
-                'loomed': 'stood'
-            }
-        },
-        'suspenseful': {
-            'replacements': {
-                'stood majestically': 'loomed ominously',
-                'ancient stones': 'crumbling stones that seemed to whisper dark secrets',
-                'emerged': 'crept out like a shadow',
-                'moved with purpose': 'moved with sinister, calculated intent',
-                'discovery': 'shocking, spine-chilling revelation',
-                'mysterious events': 'dark, terrifying incidents that defy explanation',
-                'brave enough': 'foolish enough to dare venture',
-                'within its walls': 'trapped within its haunted walls',
-                'figure': 'shadowy figure'
-            }
-        },
-        'inspiring': {
-            'replacements': {
-                'stood majestically': 'stood as a magnificent beacon of resilience and hope',
-                'weathered by': 'strengthened and refined by',
-                'countless stories': 'countless tales of triumph, courage, and human spirit',
-                'emerged': 'stepped forth confidently with renewed purpose',
-                'discovery': 'life-changing, magnificent discovery',
-                'change everything': 'transform lives and inspire generations to come',
-                'brave enough': 'courageous and determined enough',
-                'revelations': 'profound, life-changing insights',
-                'mysterious': 'wondrous and awe-inspiring',
-                'ancient': 'timeless and revered'
-            }
-        }
+    """Simulate IBM Watsonx text rewriting with the compiled offline tone rules"""
+    return tone_rewriter.rewrite(text, tone)
+
+def watson_tts_configured():
+    """True when real Watson TTS credentials have been provided"""
+    return WATSON_TTS_CONFIG['api_key'] not in ('', PLACEHOLDER_KEY)
+
+def output_format(backend, fmt=None):
+    """Requested format if the backend can produce it, else its native one"""
+    fmt = fmt or AUDIO_CONFIG['format']
+    return fmt if fmt in backend.formats else backend.formats[0]
+
+def speech_preprocessor(data, book_id=None):
+    """Compiled SSML rules for a request: the base lexicon, then the project's, then an inline one"""
+    if not SSML_CONFIG['enabled'] or str(data.get('ssml', True)).lower() in ('false', '0'):
+        return None
+    entries = dict(base_lexicon)
+    book_id = book_id or data.get('project_id')
+    if book_id:
+        entries.update(project_store.get_lexicon(book_id))
+    if data.get('lexicon'):
+        entries.update(data['lexicon'])
+    return compile_lexicon(entries)
+
+def compile_lexicon(entries):
+    return ssml.get_preprocessor(
+        entries,
+        dialogue_pause_ms=SSML_CONFIG['dialogue_pause_ms'],
+        paragraph_pause_ms=SSML_CONFIG['paragraph_pause_ms']
+    )
+
+def synthesize_speech(text, voice, speed, fmt=None, backend=None, fallback=True, preprocessor=None):
+    """Return cached audio for (text, voice, speed, format), synthesizing it on a miss.
+    
+    With a preprocessor the text is converted to SSML first (plain text for
+    backends that cannot read SSML) and the audio is cached by what was
+    actually spoken, so a lexicon edit only misses where it changed something.
+    When the backend is unavailable (throttled, out of quota, unreachable) and
+    fallback is allowed, another backend able to produce the same format
+    renders it instead; without an explicit format any format is accepted.
+    """
+    backend = backend or tts_router.select(voice)
+    pinned_format = fmt
+    fmt = output_format(backend, fmt)
+    
+    spoken = text
+    if preprocessor is not None:
+        spoken = preprocessor.convert(text)
+        if not backend.ssml:
+            spoken = ssml.to_plain(spoken)
+    
+    audio_id = audio_key(spoken, voice, speed, fmt, backend.name)
+    if audio_cache.get(audio_id):
+        return {'audio_id': audio_id, 'format': fmt, 'backend': backend.name, 'cached': True}
+    
+    def render():
+        # Re-check inside the single flight: a previous leader may have just stored it
+        if audio_cache.path(audio_id) is None:
+            audio_cache.store(audio_id, fmt, backend.synthesize(spoken, voice, speed, fmt))
+        return audio_id
+    
+    try:
+        synthesis_inflight.do(audio_id, render)
+    except TTSUnavailable as e:
+        other = tts_router.fallback_for(backend, voice, pinned_format) if fallback else None
+        if other is None:
+            raise
+        logger.warning(f"{str(e)}; rendering with {other.name} instead")
+        return synthesize_speech(text, voice, speed, pinned_format, other, fallback=False, preprocessor=preprocessor)
+    return {'audio_id': audio_id, 'format': fmt, 'backend': backend.name, 'cached': False}
+
+def synthesize_text(text, voice, speed, fmt=None, backend=None, fallback=True, preprocessor=None):
+    """Synthesize text in sentence groups and join them into one cached file.
+    
+    Each group is cached on its own, so after an edit to the text or to the
+    lexicon only the groups that changed are synthesized again.
+    """
+    backend = backend or tts_router.select(voice)
+    chunks = chunk_text(text, AUDIO_CONFIG['stream_chunk_tokens'])
+    if len(chunks) <= 1:
+        audio = synthesize_speech(text, voice, speed, fmt, backend, fallback, preprocessor)
+        return dict(audio, parts=[audio['audio_id']], parts_rendered=0 if audio['cached'] else 1)
+    
+    if fallback and not backend.available():
+        backend = tts_router.fallback_for(backend, voice, fmt) or backend
+    # Every group must come out in the same format to be joined
+    fmt = output_format(backend, fmt)
+    parts = map_chunks(
+        lambda chunk: synthesize_speech(chunk.text, voice, speed, fmt, backend, fallback, preprocessor),
+        chunks,
+        max(AUDIO_CONFIG['stream_concurrency'], backend.workers)
+    )
+    
+    part_ids = [part['audio_id'] for part in parts]
+    audio_id = audio_key('\n'.join(part_ids), voice, speed, fmt, 'joined')
+    cached = audio_cache.get(audio_id) is not None
+    if not cached:
+        audio_cache.store(audio_id, fmt, joined_audio([audio_cache.path(part_id) for part_id in part_ids], fmt))
+    return {
+        'audio_id': audio_id,
+        'format': fmt,
+        'backend': parts[0]['backend'],
+        'cached': cached,
+        'parts': part_ids,
+        'parts_rendered': sum(1 for part in parts if not part['cached'])
     }
 
-    rewritten = text
-    adjustments = tone_adjustments.get(tone, tone_adjustments['neutral'])
+def joined_audio(paths, fmt):
+    """Byte chunks of the audio files in paths, played back to back"""
+    if fmt != 'wav':
+        # MP3/OGG frames from consecutive files concatenate into one playable file
+        for path in paths:
+            with open(path, 'rb') as f:
+                while True:
+                    block = f.read(64 * 1024)
+                    if not block:
+                        break
+                    yield block
+        return
+    parts = [audio_post.read_wav(path) for path in paths]
+    rate, channels = parts[0][1], parts[0][0].shape[1]
+    if any(r != rate or samples.shape[1] != channels for samples, r in parts):
+        raise ValueError("Sentence groups were rendered with different sample formats")
+    yield local_tts.streaming_wav_header(rate, channels, data_bytes=sum(samples.nbytes for samples, _ in parts))
+    for samples, _ in parts:
+        for start in range(0, len(samples), post_config.block_frames):
+            yield samples[start:start + post_config.block_frames].tobytes()
+
+def load_export_index(export_id):
+    if not export_id.isalnum():
+        return None
+    path = os.path.join(EXPORT_CONFIG['export_dir'], f'{export_id}.json')
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+def run_export_job(params, job):
+    """Render every chapter in parallel, then stream them into one file on disk"""
+    export_id = params['export_id']
+    if load_export_index(export_id) is not None:
+        return {'export_id': export_id, 'chapters_rendered': 0, 'chapters_cached': len(params['chapters'])}
+    
+    chapters = params['chapters']
+    fmt = params['format']
+    # Jobs queued before backends were selectable carry no backend name,
+    # and jobs queued before SSML preprocessing carry no lexicon
+    backend = tts_router.select(params['voice'], params.get('backend'))
+    preprocessor = compile_lexicon(params['lexicon']) if params.get('lexicon') is not None else None
+    rendered = []
+    
+    def render(chapter):
+        return synthesize_text(chapter['content'], params['voice'], params['speed'], fmt, backend,
+                               preprocessor=preprocessor)
+    
+    # The local engine renders one chapter per core
+    concurrency = max(EXPORT_CONFIG['concurrency'], backend.workers)
+    with ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(chapters)))) as executor:
+        for audio in executor.map(render, chapters):
+            rendered.append(audio)
+            job.update(progress=0.9 * len(rendered) / len(chapters))
     
-    for original, replacement in adjustments['replacements'].items():
-        rewritten = rewritten.replace(original, replacement)
+    os.makedirs(EXPORT_CONFIG['export_dir'], exist_ok=True)
+    file_name = f'{export_id}.{fmt}'
+    temp_path = os.path.join(EXPORT_CONFIG['export_dir'], file_name + '.part')
+    index = []
+    post_stats = None
     
-    return rewritten
+    if fmt == 'wav' and post_config.enabled:
+        # One loudness for the whole book, silences trimmed, sentence groups and
+        # chapters joined with their pauses
+        placements, post_stats = audio_post.join_wavs(
+            [[audio_cache.path(part_id) for part_id in audio['parts']] for audio in rendered],
+            temp_path, post_config
+        )
+        rate, frame_bytes = post_stats['sample_rate'], 2 * post_stats['channels']
+        for chapter, audio, placement in zip(chapters, rendered, placements):
+            index.append({
+                'title': chapter['title'],
+                'audio_id': audio['audio_id'],
+                'start_seconds': round(placement['start_frame'] / rate, 3),
+                'duration_seconds': round(placement['frames'] / rate, 3),
+                'byte_offset': 44 + placement['start_frame'] * frame_bytes
+            })
+    elif fmt == 'wav':
+        # Watson and the local engine render at different rates, so the
+        # header and chapter offsets come from the chapters themselves
+        paths = [audio_cache.path(audio['audio_id']) for audio in rendered]
+        formats = []
+        for path in paths:
+            with wave.open(path, 'rb') as wav:
+                formats.append((wav.getframerate(), wav.getnchannels(), wav.getsampwidth()))
+        if len(set(formats)) > 1:
+            raise ValueError(f"Chapters were rendered with different sample formats: {sorted(set(formats))}")
+        rate, channels, width = formats[0]
+        with wave.open(temp_path, 'wb') as out:
+            out.setnchannels(channels)
+            out.setsampwidth(width)
+            out.setframerate(rate)
+            for chapter, audio, path in zip(chapters, rendered, paths):
+                start = out.tell()
+                for frames in local_tts.iter_wav_frames(path):
+                    out.writeframesraw(frames)
+                index.append({
+                    'title': chapter['title'],
+                    'audio_id': audio['audio_id'],
+                    'start_seconds': round(start / rate, 3),
+                    'duration_seconds': round((out.tell() - start) / rate, 3),
+                    'byte_offset': 44 + start * channels * width
+                })
+    else:
+        offset = 0
+        with open(temp_path, 'wb') as out:
+            for chapter, audio in zip(chapters, rendered):
+                with open(audio_cache.path(audio['audio_id']), 'rb') as f:
+                    shutil.copyfileobj(f, out, 64 * 1024)
+                size = out.tell() - offset
+                index.append({
+                    'title': chapter['title'],
+                    'audio_id': audio['audio_id'],
+                    'byte_offset': offset,
+                    'byte_length': size
+                })
+                offset += size
+    
+    os.replace(temp_path, os.path.join(EXPORT_CONFIG['export_dir'], file_name))
+    with open(os.path.join(EXPORT_CONFIG['export_dir'], f'{export_id}.json'), 'w') as f:
+        json.dump({
+            'export_id': export_id,
+            'title': params['title'],
+            'file': file_name,
+            'format': fmt,
+            'voice': params['voice'],
+            'speed': params['speed'],
+            'post_processing': post_stats,
+            'chapters': index
+        }, f, indent=2)
+    
+    cached = sum(1 for audio in rendered if audio['cached'])
+    return {
+        'export_id': export_id,
+        'chapters_rendered': len(rendered) - cached,
+        'chapters_cached': cached
+    }
 
-def simulate_watson_tts(text, voice, speed):
-    """Simulate IBM Watson TTS (replace with actual API call)"""
-    # In production, this would call the actual Watson TTS API
-    # and return a URL to the generated audio file
-    return f"/api/audio/simulated_{voice}_{len(text)}.mp3"
+export_jobs = JobQueue(EXPORT_CONFIG['jobs_db'], workers=EXPORT_CONFIG['workers'])
+export_jobs.register('export-book', run_export_job)
+
+def cache_samples():
+    stats = audio_cache.stats()
+    return [
+        ({'cache': 'audio', 'result': 'hit'}, stats['hits']),
+        ({'cache': 'audio', 'result': 'miss'}, stats['misses'])
+    ]
+
+def coalescing_samples():
+    samples = []
+    for name, inflight in (('rewrite', rewrite_inflight), ('synthesis', synthesis_inflight)):
+        stats = inflight.stats()
+        samples.append(({'call': name, 'result': 'executed'}, stats['executed']))
+        samples.append(({'call': name, 'result': 'coalesced'}, stats['coalesced']))
+    return samples
+
+registry.callback('audiobook_cache_lookups_total', 'Cache lookups by cache and result', 'counter', cache_samples)
+registry.callback('audiobook_coalesced_calls_total', 'Upstream calls run vs. coalesced', 'counter', coalescing_samples)
+registry.callback('audiobook_cache_bytes', 'Bytes held in the audio cache', 'gauge',
+                  lambda: [({'cache': 'audio'}, audio_cache.stats()['bytes'])])
+registry.callback('audiobook_jobs', 'Background jobs by kind and status', 'gauge',
+                  lambda: [({'queue': kind, 'status': status}, count)
+                           for (kind, status), count in export_jobs.stats_by_kind().items()])
 
 def call_watsonx_api(text, tone):
     """Make actual API call to IBM Watsonx (requires valid credentials)"""
+    chunks = chunk_text(text, WATSONX_CONFIG['chunk_tokens'])
+    if len(chunks) <= 1:
+        return call_watsonx_chunk(text, tone)
+    
+    # Long texts are rewritten chunk by chunk in parallel and stitched back in order
+    rewritten = map_chunks(
+        lambda chunk: call_watsonx_chunk(chunk.text, tone),
+        chunks,
+        WATSONX_CONFIG['chunk_concurrency']
+    )
+    return stitch(rewritten)
+
+def call_watsonx_chunk(text, tone):
+    """Rewrite one chunk that fits within the model's token budget"""
     headers = {
         'Authorization': f'Bearer {WATSONX_CONFIG["api_key"]}',
         'Content-Type': 'application/json'
     }
     
-    prompt = f"{TONE_PROMPTS[tone]}\n\nText: {text}\n\nRewritten text:"
+    prompt = f"{TONE_PROMPTS.get(tone, TONE_PROMPTS['neutral'])}\n\nText: {text}\n\nRewritten text:"
     
     payload = {
         'model_id': 'ibm/granite-13b-chat-v2',
         'input': prompt,
         'parameters': {
-            'max_new_tokens': len(text) * 2,
+            'max_new_tokens': min(estimate_tokens(text) * 2, WATSONX_CONFIG['max_new_tokens']),
             'temperature': 0.7
         },
         'project_id': WATSONX_CONFIG['project_id']
     }
     
-    response = requests.post(
+    response = http_pool.post(
         f"{WATSONX_CONFIG['url']}/ml/v1-beta/generation/text",
         headers=headers,
         json=payload
     )
     
     if response.status_code == 200:
-        return response.json()['results'][0]['generated_text']
+        with stage('parse'):
+            return response.json()['results'][0]['generated_text']
     else:
         raise Exception(f"Watsonx API error: {response.text}")
 
-def call_watson_tts_api(text, voice, speed):
-    """Make actual API call to IBM Watson TTS (requires valid credentials)"""
-    import base64
-    
-    headers = {
-        'Authorization': f'Basic {base64.b64encode(f"apikey:{WATSON_TTS_CONFIG["api_key"]}".encode()).decode()}',
-        'Content-Type': 'application/json',
-        'Accept': 'audio/mp3'
-    }
-    
-    payload = {
-        'text': text,
-        'voice': WATSON_VOICES[voice],
-        'accept': 'audio/mp3'
-    }
-    
-    response = requests.post(
-        f"{WATSON_TTS_CONFIG['url']}/v1/synthesize",
-        headers=headers,
-        json=payload
-    )
-    
-    if response.status_code == 200:
-        return response.content
-    else:
-        raise Exception(f"Watson TTS API error: {response.text}")
-
 if __name__ == '__main__':
     print("🎭 Advanced AI Audiobook Creator Backend")
     print("🔗 Frontend: http://localhost:5000")
     print("📡 API: http://localhost:5000/api/")
     print("⚙️ Configure IBM Watson credentials in config.py")
+    # Only the reloader's serving child picks up queued exports; the watcher
+    # process and spawned TTS workers (__mp_main__) never reach this point
+    if is_running_from_reloader():
+        export_jobs.resume()
     app.run(debug=True, port=5000)
\ No newline at end of file
@@ -7,11 +7,25 @@ Provides enhanced text processing and AI capabilities using IBM Granite model
 import os
 import json
 import logging
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, Response, request, jsonify, stream_with_context
 from flask_cors import CORS
-import requests
+from werkzeug.serving import is_running_from_reloader
 from datetime import datetime
-import re
+import time
+
+from http_pool import http_pool
+from response_cache import ResponseCache, make_cache_key
+from singleflight import SingleFlight
+from job_queue import JobQueue
+from text_chunker import chunk_text, estimate_tokens, map_chunks, stitch
+from micro_batcher import MicroBatcher
+from metrics import add_tokens, instrument_flask, registry, stage, traced
+from static_assets import StaticAssets
+from rate_limiter import set_client, upstream_limiter
+from text_metrics import analyze_stream, analyze_text
+from chapter_parser import ChapterSegmenter, SCRIPT_CHAPTER, build_detectors, split_chapters, split_stream
+from project_store import ProjectNotFound, VersionConflict, process_chapters, project_store, request_text
+from manuscript_ingest import ManuscriptIngest
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -19,6 +33,8 @@ logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 CORS(app)
+instrument_flask(app)
+page_assets = StaticAssets(os.path.dirname(os.path.abspath(__file__)), ['standalone_fixed.html'])
 
 # IBM Granite Configuration
 class GraniteConfig:
@@ -28,19 +44,107 @@ class GraniteConfig:
         self.model_id = os.getenv('IBM_GRANITE_MODEL', 'ibm/granite-13b-chat-v2')
         self.max_tokens = 2048
         self.temperature = 0.7
+        self.book_concurrency = int(os.getenv('GRANITE_BOOK_CONCURRENCY', '8'))
+        self.jobs_db = os.getenv('GRANITE_JOBS_DB', 'granite_jobs.db')
+        self.job_workers = int(os.getenv('GRANITE_JOB_WORKERS', '4'))
+        self.job_timeout = float(os.getenv('GRANITE_JOB_TIMEOUT', '180'))
+        # Input budget per model call; long text is split on sentence boundaries
+        self.chunk_tokens = int(os.getenv('GRANITE_CHUNK_TOKENS', '1024'))
+        self.chunk_overlap = int(os.getenv('GRANITE_CHUNK_OVERLAP', '0'))
+        self.chunk_concurrency = int(os.getenv('GRANITE_CHUNK_CONCURRENCY', '4'))
+        # Short prompts arriving within the window are sent upstream together (0 disables)
+        self.batch_window_ms = float(os.getenv('GRANITE_BATCH_WINDOW_MS', '20'))
+        self.batch_max = int(os.getenv('GRANITE_BATCH_MAX', '8'))
+        self.batch_max_prompt_tokens = int(os.getenv('GRANITE_BATCH_MAX_PROMPT_TOKENS', '512'))
+        # true: one request with an 'inputs' list; false: a pipelined group on pooled connections
+        self.batch_inputs = os.getenv('GRANITE_BATCH_INPUTS', 'false').lower() == 'true'
+        # Manuscript uploads: longer chapters are stored in parts, larger books are refused
+        self.ingest_max_chapter_bytes = int(os.getenv('INGEST_MAX_CHAPTER_BYTES', str(4 * 1024 * 1024)))
+        self.ingest_max_bytes = int(os.getenv('INGEST_MAX_BYTES', str(256 * 1024 * 1024)))
 
 granite_config = GraniteConfig()
 
 class GraniteService:
-    def __init__(self, config):
+    def __init__(self, config, cache=None):
         self.config = config
+        self.cache = cache
+        self.inflight = SingleFlight()
+        self.batcher = None
+        # Without an 'inputs' list the upstream gets the same independent
+        # requests either way, and waiting for a batch would only add latency
+        if config.batch_inputs and config.batch_window_ms > 0 and config.batch_max > 1:
+            self.batcher = MicroBatcher(self._send_batch, config.batch_window_ms, config.batch_max)
         self.headers = {
             'Authorization': f'Bearer {config.api_key}',
             'Content-Type': 'application/json'
         }
     
-    def generate_text(self, prompt, max_tokens=None, temperature=None):
-        """Generate text using IBM Granite model"""
+    def generate_text(self, prompt, max_tokens=None, temperature=None, timeout=None, batch=False):
+        """Generate text using IBM Granite model, coalescing identical in-flight prompts"""
+        max_tokens = max_tokens or self.config.max_tokens
+        temperature = temperature or self.config.temperature
+        key = make_cache_key('generate', prompt, self.config.model_id, temperature, max_tokens)
+        
+        if (batch and self.batcher is not None and timeout is None
+                and estimate_tokens(prompt) <= self.config.batch_max_prompt_tokens):
+            # Only prompts with the same generation parameters share a batch
+            send = lambda: self.batcher.submit((max_tokens, temperature), prompt).result()
+        else:
+            send = lambda: self._generate_upstream(prompt, max_tokens, temperature, timeout)
+        
+        def run():
+            # Counted once per upstream generation, not per coalesced caller
+            result = send()
+            if result['success']:
+                add_tokens(result.get('tokens_used', 0))
+            return result
+        return self.inflight.do(key, run)
+
+    def _send_batch(self, params, prompts):
+        """Send a micro-batch of prompts upstream; returns one result per prompt"""
+        max_tokens, temperature = params
+        if len(prompts) == 1:
+            return [self._generate_upstream(prompts[0], max_tokens, temperature)]
+        
+        try:
+            payload = {
+                'model_id': self.config.model_id,
+                'inputs': prompts,
+                'parameters': {
+                    'max_new_tokens': max_tokens,
+                    'temperature': temperature,
+                    'top_p': 0.9,
+                    'top_k': 50
+                }
+            }
+            
+            response = http_pool.post(
+                f'{self.config.base_url}/text/generation',
+                headers=self.headers,
+                json=payload,
+                timeout=30
+            )
+            
+            if response.status_code != 200:
+                logger.error(f"Granite API batch error: {response.status_code} - {response.text}")
+                return [{'success': False, 'error': f"API error: {response.status_code}"}] * len(prompts)
+            
+            with stage('parse'):
+                results = response.json().get('results', [])
+            if len(results) != len(prompts):
+                raise ValueError(f"expected {len(prompts)} results, got {len(results)}")
+            return [{
+                'success': True,
+                'text': result.get('generated_text', ''),
+                'tokens_used': result.get('token_count', 0)
+            } for result in results]
+        
+        except Exception as e:
+            logger.error(f"Granite batch error: {str(e)}")
+            return [{'success': False, 'error': str(e)}] * len(prompts)
+
+    def _generate_upstream(self, prompt, max_tokens=None, temperature=None, timeout=None):
+        """Send one generation request to the Granite API"""
         try:
             payload = {
                 'model_id': self.config.model_id,
@@ -53,19 +157,20 @@ class GraniteService:
                 }
             }
             
-            response = requests.post(
+            response = http_pool.post(
                 f'{self.config.base_url}/text/generation',
                 headers=self.headers,
                 json=payload,
-                timeout=30
+                timeout=timeout or 30
             )
             
             if response.status_code == 200:
-                result = response.json()
+                with stage('parse'):
+                    result = response.json().get('results', [{}])[0]
                 return {
                     'success': True,
-                    'text': result.get('results', [{}])[0].get('generated_text', ''),
-                    'tokens_used': result.get('results', [{}])[0].get('token_count', 0)
+                    'text': result.get('generated_text', ''),
+                    'tokens_used': result.get('token_count', 0)
                 }
             else:
                 logger.error(f"Granite API error: {response.status_code} - {response.text}")
@@ -81,12 +186,346 @@ class GraniteService:
                 'error': str(e)
             }
 
-granite_service = GraniteService(granite_config)
+    def generate_stream(self, prompt, max_tokens=None, temperature=None, timeout=None):
+        """Yield (text, token_count) fragments from the Granite streaming endpoint"""
+        payload = {
+            'model_id': self.config.model_id,
+            'input': prompt,
+            'parameters': {
+                'max_new_tokens': max_tokens or self.config.max_tokens,
+                'temperature': temperature or self.config.temperature,
+                'top_p': 0.9,
+                'top_k': 50
+            }
+        }
+        
+        response = http_pool.post(
+            f'{self.config.base_url}/text/generation_stream',
+            headers=dict(self.headers, Accept='text/event-stream'),
+            json=payload,
+            timeout=timeout or 30,
+            stream=True
+        )
+        
+        with response:
+            if response.status_code != 200:
+                logger.error(f"Granite stream error: {response.status_code} - {response.text}")
+                raise RuntimeError(f"API error: {response.status_code}")
+            
+            for line in response.iter_lines(decode_unicode=True):
+                if not line or not line.startswith('data:'):
+                    continue
+                data = line[5:].strip()
+                if data == '[DONE]':
+                    break
+                result = json.loads(data).get('results', [{}])[0]
+                text = result.get('generated_text', '')
+                tokens = result.get('generated_token_count', result.get('token_count', 0))
+                if text or tokens:
+                    add_tokens(tokens)
+                    yield text, tokens
+
+    def generate_cached(self, endpoint, prompt, max_tokens=None, temperature=None, batch=False):
+        """Generate text, serving repeats of the same prompt from the response cache"""
+        if self.cache is None:
+            return self.generate_text(prompt, max_tokens, temperature, batch=batch)
+
+        started = time.perf_counter()
+        key = make_cache_key(
+            endpoint, prompt, self.config.model_id,
+            temperature or self.config.temperature,
+            max_tokens or self.config.max_tokens
+        )
+        cached = self.cache.get(key)
+        if cached is not None:
+            return dict(cached, cached=True,
+                        cache_latency_ms=round((time.perf_counter() - started) * 1000, 3))
+
+        result = self.generate_text(prompt, max_tokens, temperature, batch=batch)
+        if result['success']:
+            self.cache.set(key, result)
+        return dict(result, cached=False)
+
+    def generate_chunked(self, endpoint, text, build_prompt, max_tokens=None, batch=False):
+        """Run build_prompt(text) through the model, chunking text that exceeds the input budget"""
+        chunks = chunk_text(text, self.config.chunk_tokens, self.config.chunk_overlap)
+        if len(chunks) <= 1:
+            return dict(self.generate_cached(endpoint, build_prompt(text), max_tokens, batch=batch), chunks=1)
+        
+        def run(chunk):
+            prompt = build_prompt(chunk.text)
+            if chunk.context:
+                prompt = CONTEXT_PREFIX.format(context=chunk.context) + prompt
+            return self.generate_cached(endpoint, prompt, max_tokens)
+        
+        results = map_chunks(run, chunks, self.config.chunk_concurrency)
+        for index, result in enumerate(results):
+            if not result['success']:
+                return {'success': False, 'error': f"Chunk {index + 1}/{len(chunks)}: {result['error']}"}
+        
+        return {
+            'success': True,
+            'text': stitch(result['text'] for result in results),
+            'tokens_used': sum(result.get('tokens_used', 0) for result in results),
+            'cached': all(result['cached'] for result in results),
+            'chunks': len(chunks)
+        }
+
+ENHANCE_PROMPTS = {
+    'improve': """Please improve the following text for audiobook narration. Make it more engaging, clear, and suitable for spoken audio while maintaining the original meaning:
+
+Text: {text}
+
+Enhanced version:""",
+    
+    'summarize': """Create a concise summary of the following text that would work well as an audiobook chapter introduction:
+
+Text: {text}
+
+Summary:""",
+    
+    'expand': """Expand the following text to make it more detailed and engaging for audiobook listeners, adding relevant context and descriptions:
+
+Text: {text}
+
+Expanded version:""",
+    
+    'chapters': """Analyze the following text and suggest better chapter divisions and titles for an audiobook format:
+
+Text: {text}
+
+Suggested chapter structure:"""
+}
+
+ANALYSIS_PROMPT = """Analyze the following text for audiobook production. Provide insights on:
+1. Readability score for audio narration
+2. Estimated speaking time
+3. Suggested improvements for audio format
+4. Chapter structure recommendations
+5. Voice and pacing suggestions
+
+Text: {text}
+
+Analysis:"""
+
+CONTEXT_PREFIX = """Context from the preceding passage (for continuity only, do not include it in your answer):
+{context}
+
+"""
+
+VOICES_PROMPT = """Based on the following text content and genre "{genre}", suggest optimal voice characteristics for audiobook narration:
+
+Text sample: {sample}...
+
+Please suggest:
+1. Voice type (male/female/neutral)
+2. Tone and style
+3. Pacing recommendations
+4. Accent or regional considerations
+5. Emotional delivery notes
+
+Voice recommendations:"""
+
+@traced('prompt_build')
+def build_analysis_prompt(text):
+    return ANALYSIS_PROMPT.format(text=text)
+
+@traced('prompt_build')
+def build_voices_prompt(text, genre):
+    return VOICES_PROMPT.format(genre=genre, sample=text[:500])
+
+@traced('prompt_build')
+def build_enhance_prompt(text, enhancement_type):
+    """Fill the enhancement prompt template for the given type"""
+    template = ENHANCE_PROMPTS.get(enhancement_type, ENHANCE_PROMPTS['improve'])
+    return template.format(text=text)
+
+SCRIPT_PROMPT = """Create a detailed audiobook script about "{topic}" with {chapters} chapters. 
+Style: {style}
+
+Format each chapter as:
+Chapter X: [Title]
+[Content suitable for audio narration]
+
+Make it engaging, informative, and well-structured for audio consumption. Each chapter should be substantial enough for 3-5 minutes of speaking time.
+
+Audiobook Script:"""
+
+@traced('prompt_build')
+def build_script_prompt(topic, chapters, style):
+    return SCRIPT_PROMPT.format(topic=topic, chapters=chapters, style=style)
+
+# Response bodies are built here so the Flask routes and the async serving
+# mode (backend_granite_async.py) return identical payloads
+
+def enhance_response(text, enhancement_type, result):
+    return {
+        'enhanced_text': result['text'].strip(),
+        'original_length': len(text),
+        'enhanced_length': len(result['text']),
+        'tokens_used': result.get('tokens_used', 0),
+        'enhancement_type': enhancement_type,
+        'chunks': result['chunks'],
+        'cached': result['cached'],
+        'cache_latency_ms': result.get('cache_latency_ms')
+    }
+
+def split_book_chapter(chapter):
+    """Chapters may be plain strings or {title, content} objects"""
+    if isinstance(chapter, dict):
+        return chapter.get('title', ''), chapter.get('content', '')
+    return '', str(chapter)
+
+def book_chapter_entry(title, text, result, started):
+    entry = {
+        'title': title,
+        'success': result['success'],
+        'elapsed_ms': round((time.perf_counter() - started) * 1000, 1)
+    }
+    if result['success']:
+        entry.update({
+            'enhanced_text': result['text'].strip(),
+            'original_length': len(text),
+            'enhanced_length': len(result['text']),
+            'tokens_used': result.get('tokens_used', 0),
+            'chunks': result['chunks'],
+            'cached': result['cached']
+        })
+    else:
+        entry['error'] = result['error']
+    return entry
+
+def book_response(results, enhancement_type, concurrency, started):
+    for index, entry in enumerate(results):
+        entry['index'] = index
+    return {
+        'chapters': results,
+        'enhancement_type': enhancement_type,
+        'succeeded': sum(1 for r in results if r['success']),
+        'failed': sum(1 for r in results if not r['success']),
+        'tokens_used': sum(r.get('tokens_used', 0) for r in results),
+        'concurrency': concurrency,
+        'elapsed_ms': round((time.perf_counter() - started) * 1000, 1)
+    }
+
+def analysis_insight(result):
+    return {
+        'analysis': result['text'].strip(),
+        'tokens_used': result.get('tokens_used', 0),
+        'chunks': result['chunks'],
+        'cached': result['cached'],
+        'cache_latency_ms': result.get('cache_latency_ms')
+    }
+
+def analysis_response(metrics, result=None):
+    if result is None:
+        return {'analysis': None, 'metrics': metrics}
+    return dict(analysis_insight(result), metrics=metrics)
+
+def analysis_job_response(metrics, data):
+    """Metrics now, model analysis as a background job the client polls"""
+    refs = ('project_id', 'chapter_id') if data.get('chapter_id') else ('text',)
+    job_id = job_queue.submit('analyze-content', {name: data.get(name) for name in refs})
+    return dict(analysis_response(metrics), analysis_job={
+        'job_id': job_id,
+        'status': 'queued',
+        'status_url': f'/api/jobs/{job_id}'
+    })
+
+def voices_response(genre, result):
+    return {
+        'suggestions': result['text'].strip(),
+        'genre': genre,
+        'tokens_used': result.get('tokens_used', 0),
+        'cached': result['cached'],
+        'cache_latency_ms': result.get('cache_latency_ms')
+    }
+
+def script_response(topic, result):
+    """Parse a generated script into the generate-script response body"""
+    script_text = result['text'].strip()
+    return {
+        'script': script_text,
+        'chapters': parse_script_to_chapters(script_text),
+        'topic': topic,
+        'tokens_used': result.get('tokens_used', 0),
+        'generation_time': datetime.now().isoformat()
+    }
+
+response_cache = ResponseCache()
+granite_service = GraniteService(granite_config, response_cache)
+
+def run_script_job(params, job):
+    """Background handler for generate-script jobs, publishing partial output as it streams"""
+    job.update(partial='', progress=0.05)
+    prompt = build_script_prompt(params['topic'], params['chapters'], params['style'])
+    parser = ChapterStreamParser()
+    pieces = []
+    tokens_used = 0
+    last_update = time.monotonic()
+    
+    for text, tokens in granite_service.generate_stream(
+        prompt, max_tokens=3000, timeout=granite_config.job_timeout
+    ):
+        pieces.append(text)
+        tokens_used += tokens
+        parser.feed(text)
+        if time.monotonic() - last_update >= 0.5:
+            progress = min(0.9, 0.05 + 0.85 * len(parser.chapters) / max(int(params['chapters']), 1))
+            job.update(partial=''.join(pieces), progress=progress)
+            last_update = time.monotonic()
+    
+    job.update(partial=''.join(pieces), progress=0.95)
+    return script_response(params['topic'], {'text': ''.join(pieces), 'tokens_used': tokens_used})
+
+def run_analysis_job(params, job):
+    """Background handler for the model analysis half of analyze-content"""
+    text = request_text(project_store, params)
+    if not text:
+        raise ValueError('No text to analyze')
+    result = granite_service.generate_chunked('analyze-content', text, build_analysis_prompt)
+    if not result['success']:
+        raise RuntimeError(result['error'])
+    return analysis_insight(result)
+
+job_queue = JobQueue(granite_config.jobs_db, workers=granite_config.job_workers)
+job_queue.register('generate-script', run_script_job)
+job_queue.register('analyze-content', run_analysis_job)
+
+def cache_samples():
+    stats = response_cache.stats()
+    return [
+        ({'cache': 'response', 'result': 'hit'}, stats['hits']),
+        ({'cache': 'response', 'result': 'miss'}, stats['misses'])
+    ]
+
+def coalescing_samples():
+    stats = granite_service.inflight.stats()
+    return [({'result': 'executed'}, stats['executed']), ({'result': 'coalesced'}, stats['coalesced'])]
+
+registry.callback('audiobook_cache_lookups_total', 'Cache lookups by cache and result', 'counter', cache_samples)
+registry.callback('audiobook_coalesced_calls_total', 'Generation calls run vs. coalesced', 'counter', coalescing_samples)
+registry.callback('audiobook_jobs', 'Background jobs by kind and status', 'gauge',
+                  lambda: [({'queue': kind, 'status': status}, count)
+                           for (kind, status), count in job_queue.stats_by_kind().items()])
+if granite_service.batcher is not None:
+    registry.callback('audiobook_batches_total', 'Micro-batches sent upstream', 'counter',
+                      lambda: [({}, granite_service.batcher.stats()['batches'])])
+
+@app.before_request
+def identify_client():
+    """Queue this request's upstream calls fairly against other clients"""
+    set_client(request.headers.get('X-Client-Id') or request.remote_addr)
 
 @app.route('/')
 def index():
     """Serve the main application"""
-    return send_from_directory('.', 'standalone_fixed.html')
+    asset = page_assets.get('standalone_fixed.html')
+    if asset is None:
+        return jsonify({'error': 'Page not found'}), 404
+    # Precompressed body; make_conditional answers If-None-Match/If-Modified-Since with 304
+    body, headers = asset.select(request.headers.get('Accept-Encoding'))
+    return Response(body, headers=headers, content_type=asset.mimetype).make_conditional(request)
 
 @app.route('/health')
 def health_check():
@@ -94,7 +533,14 @@ def health_check():
     return jsonify({
         'status': 'healthy',
         'timestamp': datetime.now().isoformat(),
-        'granite_configured': bool(granite_config.api_key)
+        'granite_configured': bool(granite_config.api_key),
+        'http_pool': http_pool.stats(),
+        'response_cache': response_cache.stats(),
+        'coalescing': granite_service.inflight.stats(),
+        'jobs': job_queue.stats(),
+        'rate_limiter': upstream_limiter.stats(),
+        'batching': granite_service.batcher.stats() if granite_service.batcher else None,
+        'projects': project_store.stats()
     })
 
 @app.route('/api/granite/enhance-text', methods=['POST'])
@@ -102,56 +548,61 @@ def enhance_text():
     """Enhance text content using IBM Granite model"""
     try:
         data = request.get_json()
-        text = data.get('text', '')
+        text = request_text(project_store, data)
         enhancement_type = data.get('type', 'improve')
         
         if not text:
             return jsonify({'error': 'No text provided'}), 400
         
-        prompts = {
-            'improve': f"""Please improve the following text for audiobook narration. Make it more engaging, clear, and suitable for spoken audio while maintaining the original meaning:
-
-Text: {text}
-
-Enhanced version:""",
-            
-            'summarize': f"""Create a concise summary of the following text that would work well as an audiobook chapter introduction:
-
-Text: {text}
-
-Summary:""",
-            
-            'expand': f"""Expand the following text to make it more detailed and engaging for audiobook listeners, adding relevant context and descriptions:
-
-Text: {text}
-
-Expanded version:""",
-            
-            'chapters': f"""Analyze the following text and suggest better chapter divisions and titles for an audiobook format:
-
-Text: {text}
-
-Suggested chapter structure:"""
-        }
-        
-        prompt = prompts.get(enhancement_type, prompts['improve'])
-        result = granite_service.generate_text(prompt)
+        result = granite_service.generate_chunked(
+            'enhance-text', text, lambda chunk: build_enhance_prompt(chunk, enhancement_type), batch=True
+        )
         
         if result['success']:
-            return jsonify({
-                'enhanced_text': result['text'].strip(),
-                'original_length': len(text),
-                'enhanced_length': len(result['text']),
-                'tokens_used': result.get('tokens_used', 0),
-                'enhancement_type': enhancement_type
-            })
+            return jsonify(enhance_response(text, enhancement_type, result))
         else:
             return jsonify({'error': result['error']}), 500
             
+    except ProjectNotFound:
+        return jsonify({'error': 'Chapter not found'}), 404
     except Exception as e:
         logger.error(f"Text enhancement error: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/granite/enhance-book', methods=['POST'])
+def enhance_book():
+    """Enhance every chapter of a book in parallel, returning results in order"""
+    try:
+        data = request.get_json()
+        chapters = data.get('chapters', [])
+        enhancement_type = data.get('type', 'improve')
+        
+        if not chapters:
+            return jsonify({'error': 'No chapters provided'}), 400
+        
+        concurrency = data.get('concurrency', granite_config.book_concurrency)
+        concurrency = max(1, min(int(concurrency), granite_config.book_concurrency, len(chapters)))
+        
+        def enhance_chapter(chapter):
+            title, text = split_book_chapter(chapter)
+            if not text:
+                return {'title': title, 'success': False, 'error': 'No text provided'}
+            
+            started = time.perf_counter()
+            result = granite_service.generate_chunked(
+                'enhance-text', text, lambda chunk: build_enhance_prompt(chunk, enhancement_type)
+            )
+            return book_chapter_entry(title, text, result, started)
+        
+        started = time.perf_counter()
+        results = map_chunks(enhance_chapter, chapters, concurrency)
+        
+        return jsonify(book_response(results, enhancement_type, concurrency, started))
+            
+    except Exception as e:
+        logger.error(f"Book enhancement error: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/granite/generate-script', methods=['POST'])
 def generate_script():
     """Generate an audiobook script using IBM Granite model"""
@@ -164,36 +615,316 @@ def generate_script():
         if not topic:
             return jsonify({'error': 'No topic provided'}), 400
         
-        prompt = f"""Create a detailed audiobook script about "{topic}" with {chapters} chapters. 
-Style: {style}
-
-Format each chapter as:
-Chapter X: [Title]
-[Content suitable for audio narration]
-
-Make it engaging, informative, and well-structured for audio consumption. Each chapter should be substantial enough for 3-5 minutes of speaking time.
-
-Audiobook Script:"""
+        if data.get('async'):
+            job_id = job_queue.submit('generate-script', {
+                'topic': topic, 'chapters': chapters, 'style': style
+            })
+            return jsonify({
+                'job_id': job_id,
+                'status': 'queued',
+                'status_url': f'/api/jobs/{job_id}'
+            }), 202
         
-        result = granite_service.generate_text(prompt, max_tokens=3000)
+        result = granite_service.generate_text(
+            build_script_prompt(topic, chapters, style), max_tokens=3000
+        )
         
         if result['success']:
-            # Parse the generated script into chapters
-            script_text = result['text'].strip()
-            chapters_data = parse_script_to_chapters(script_text)
+            return jsonify(script_response(topic, result))
+        else:
+            return jsonify({'error': result['error']}), 500
             
-            return jsonify({
-                'script': script_text,
-                'chapters': chapters_data,
+    except Exception as e:
+        logger.error(f"Script generation error: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+def sse_event(event, data):
+    """Format one server-sent event"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def sse_response(events):
+    return Response(
+        stream_with_context(events),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@app.route('/api/granite/enhance-text/stream', methods=['POST'])
+def enhance_text_stream():
+    """Stream enhanced text as server-sent events while Granite generates it"""
+    data = request.get_json()
+    try:
+        text = request_text(project_store, data)
+    except ProjectNotFound:
+        return jsonify({'error': 'Chapter not found'}), 404
+    enhancement_type = data.get('type', 'improve')
+    
+    if not text:
+        return jsonify({'error': 'No text provided'}), 400
+    
+    prompt = build_enhance_prompt(text, enhancement_type)
+    
+    def events():
+        started = time.perf_counter()
+        pieces = []
+        tokens_used = 0
+        try:
+            for piece, tokens in granite_service.generate_stream(prompt):
+                if not pieces:
+                    yield sse_event('first_token', {
+                        'latency_ms': round((time.perf_counter() - started) * 1000, 1)
+                    })
+                pieces.append(piece)
+                tokens_used += tokens
+                yield sse_event('token', {'text': piece})
+            
+            enhanced = ''.join(pieces)
+            yield sse_event('done', {
+                'enhanced_text': enhanced.strip(),
+                'original_length': len(text),
+                'enhanced_length': len(enhanced),
+                'tokens_used': tokens_used,
+                'enhancement_type': enhancement_type
+            })
+        except Exception as e:
+            logger.error(f"Text enhancement stream error: {str(e)}")
+            yield sse_event('error', {'error': str(e)})
+    
+    return sse_response(events())
+
+@app.route('/api/granite/generate-script/stream', methods=['POST'])
+def generate_script_stream():
+    """Stream a generated script as server-sent events, emitting each chapter once complete"""
+    data = request.get_json()
+    topic = data.get('topic', '')
+    chapters = data.get('chapters', 5)
+    style = data.get('style', 'educational')
+    
+    if not topic:
+        return jsonify({'error': 'No topic provided'}), 400
+    
+    prompt = build_script_prompt(topic, chapters, style)
+    
+    def events():
+        started = time.perf_counter()
+        parser = ChapterStreamParser()
+        pieces = []
+        tokens_used = 0
+        try:
+            for piece, tokens in granite_service.generate_stream(prompt, max_tokens=3000):
+                if not pieces:
+                    yield sse_event('first_token', {
+                        'latency_ms': round((time.perf_counter() - started) * 1000, 1)
+                    })
+                pieces.append(piece)
+                tokens_used += tokens
+                yield sse_event('token', {'text': piece})
+                for chapter in parser.feed(piece):
+                    yield sse_event('chapter', chapter)
+            
+            for chapter in parser.close():
+                yield sse_event('chapter', chapter)
+            
+            yield sse_event('done', {
+                'script': ''.join(pieces).strip(),
+                'chapters': parser.chapters,
                 'topic': topic,
-                'tokens_used': result.get('tokens_used', 0),
+                'tokens_used': tokens_used,
                 'generation_time': datetime.now().isoformat()
             })
+        except Exception as e:
+            logger.error(f"Script generation stream error: {str(e)}")
+            yield sse_event('error', {'error': str(e)})
+    
+    return sse_response(events())
+
+@app.route('/api/jobs/<job_id>')
+def get_job(job_id):
+    """Report status, partial output and timing of a background job"""
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job)
+
+def project_chapters_from(data):
+    """Chapters for a new project: an explicit list, or text split on headings"""
+    if data.get('chapters'):
+        return [
+            {'title': title or f'Chapter {i + 1}', 'content': text}
+            for i, (title, text) in enumerate(map(split_book_chapter, data['chapters']))
+        ]
+    encoded = data.get('text', '').encode('utf-8')
+    return [
+        {'title': segment['title'], 'content': encoded[segment['start']:segment['end']].decode('utf-8').strip()}
+        for segment in split_chapters(encoded)
+    ]
+
+@app.route('/api/projects', methods=['POST'])
+def create_project():
+    """Store a book once so later requests only send chapter ids and edits"""
+    try:
+        data = request.get_json()
+        chapters = project_chapters_from(data)
+        if not chapters:
+            return jsonify({'error': 'No text provided'}), 400
+        
+        book_id = project_store.create_book(data.get('title', 'Untitled'), chapters)
+        return jsonify(project_store.get_book(book_id)), 201
+        
+    except Exception as e:
+        logger.error(f"Project creation error: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/projects/upload', methods=['POST'])
+def upload_project():
+    """Create a project from a TXT, Markdown or EPUB manuscript, read and stored chapter by chapter.
+    
+    Accepts a multipart upload (field 'file', options as form fields) or the
+    manuscript as the raw request body (options in the query string).
+    """
+    try:
+        started = time.perf_counter()
+        upload = request.files.get('file') if request.mimetype == 'multipart/form-data' else None
+        if upload is not None:
+            # Werkzeug spools multipart files past 500 KB to disk, so this stream is file-backed
+            stream, filename, content_type, options = upload.stream, upload.filename, upload.mimetype, request.form
         else:
-            return jsonify({'error': result['error']}), 500
-            
+            stream, filename, content_type, options = (
+                request.stream, request.args.get('filename'), request.content_type, request.args
+            )
+        
+        names = [d for d in options.get('detectors', '').split(',') if d]
+        detectors = None
+        if names or 'min_blank_lines' in options:
+            detectors = build_detectors(names, int(options.get('min_blank_lines', 3)))
+        ingest = ManuscriptIngest(
+            project_store,
+            title=options.get('title'),
+            fmt=options.get('format'),
+            filename=filename,
+            content_type=content_type,
+            encoding=options.get('encoding'),
+            detectors=detectors,
+            max_chapter_bytes=granite_config.ingest_max_chapter_bytes,
+            max_bytes=granite_config.ingest_max_bytes
+        )
+        with stage('ingest'):
+            book_id = ingest.run(stream)
+        
+        result = ingest.result(book_id)
+        result['elapsed_ms'] = round((time.perf_counter() - started) * 1000, 2)
+        return jsonify(result), 201
+        
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
-        logger.error(f"Script generation error: {str(e)}")
+        logger.error(f"Manuscript upload error: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/projects/<book_id>', methods=['GET', 'PATCH', 'DELETE'])
+def project(book_id):
+    """Read a project, apply chapter-level changes to it, or delete it"""
+    try:
+        if request.method == 'DELETE':
+            if not project_store.delete_book(book_id):
+                return jsonify({'error': 'Project not found'}), 404
+            return jsonify({'deleted': book_id})
+        
+        if request.method == 'PATCH':
+            data = request.get_json()
+            result = project_store.apply_changes(book_id, data.get('changes', []), data.get('base_version'))
+            return jsonify(result)
+        
+        book = project_store.get_book(book_id, content=request.args.get('content') == '1')
+        if book is None:
+            return jsonify({'error': 'Project not found'}), 404
+        return jsonify(book)
+        
+    except ProjectNotFound:
+        return jsonify({'error': 'Project not found'}), 404
+    except VersionConflict as e:
+        return jsonify({'error': str(e)}), 409
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logger.error(f"Project error: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/projects/<book_id>/chapters/<chapter_id>')
+def project_chapter(book_id, chapter_id):
+    chapter = project_store.get_chapter(book_id, chapter_id)
+    if chapter is None:
+        return jsonify({'error': 'Chapter not found'}), 404
+    return jsonify(chapter)
+
+@app.route('/api/projects/<book_id>/enhance', methods=['POST'])
+def enhance_project(book_id):
+    """Enhance only the chapters whose text changed since their last enhancement"""
+    try:
+        data = request.get_json() or {}
+        enhancement_type = data.get('type', 'improve')
+        
+        def enhance_chapter(chapter):
+            started = time.perf_counter()
+            result = granite_service.generate_chunked(
+                'enhance-text', chapter['content'],
+                lambda chunk: build_enhance_prompt(chunk, enhancement_type)
+            )
+            entry = book_chapter_entry(chapter['title'], chapter['content'], result, started)
+            return entry, entry['success']
+        
+        started = time.perf_counter()
+        processed = process_chapters(
+            project_store, book_id, 'enhance', enhancement_type, enhance_chapter, granite_config.book_concurrency,
+            data.get('chapter_ids')
+        )
+        results = [
+            dict(entry, id=chapter['id'], title=chapter['title'], reused=reused)
+            for chapter, entry, reused in processed
+        ]
+        response = book_response(results, enhancement_type, granite_config.book_concurrency, started)
+        response['reused'] = sum(1 for r in results if r['reused'])
+        return jsonify(response)
+        
+    except ProjectNotFound:
+        return jsonify({'error': 'Project not found'}), 404
+    except Exception as e:
+        logger.error(f"Project enhancement error: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/projects/<book_id>/analyze', methods=['POST'])
+def analyze_project(book_id):
+    """Per-chapter metrics (and optional model analysis) for changed chapters only"""
+    try:
+        data = request.get_json() or {}
+        include_llm = data.get('include_llm', False)
+        
+        def analyze_chapter(chapter):
+            metrics = analyze_text(chapter['content'], data.get('voices'), data.get('speeds'))
+            if not include_llm:
+                return analysis_response(metrics), True
+            result = granite_service.generate_chunked('analyze-content', chapter['content'], build_analysis_prompt)
+            if not result['success']:
+                return {'error': result['error'], 'metrics': metrics}, False
+            return analysis_response(metrics, result), True
+        
+        key = json.dumps([include_llm, data.get('voices'), data.get('speeds')])
+        processed = process_chapters(
+            project_store, book_id, 'analysis', key, analyze_chapter, granite_config.book_concurrency,
+            data.get('chapter_ids')
+        )
+        return jsonify({
+            'chapters': [
+                dict(value, id=chapter['id'], title=chapter['title'], reused=reused)
+                for chapter, value, reused in processed
+            ],
+            'reused': sum(1 for _, _, reused in processed if reused)
+        })
+        
+    except ProjectNotFound:
+        return jsonify({'error': 'Project not found'}), 404
+    except Exception as e:
+        logger.error(f"Project analysis error: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/granite/analyze-content', methods=['POST'])
@@ -201,47 +932,76 @@ def analyze_content():
     """Analyze content for audiobook suitability using IBM Granite model"""
     try:
         data = request.get_json()
-        text = data.get('text', '')
+        text = request_text(project_store, data)
         
         if not text:
             return jsonify({'error': 'No text provided'}), 400
         
-        prompt = f"""Analyze the following text for audiobook production. Provide insights on:
-1. Readability score for audio narration
-2. Estimated speaking time
-3. Suggested improvements for audio format
-4. Chapter structure recommendations
-5. Voice and pacing suggestions
-
-Text: {text}
-
-Analysis:"""
-        
-        result = granite_service.generate_text(prompt)
+        metrics = analyze_text(text, data.get('voices'), data.get('speeds'))
         
-        if result['success']:
-            analysis = result['text'].strip()
+        # The model analysis is opt-in and never holds up the local metrics
+        if data.get('include_llm'):
+            return jsonify(analysis_job_response(metrics, data)), 202
+        return jsonify(analysis_response(metrics))
             
-            # Calculate basic metrics
-            word_count = len(text.split())
-            estimated_minutes = round(word_count / 150)  # ~150 WPM average
-            character_count = len(text)
+    except ProjectNotFound:
+        return jsonify({'error': 'Chapter not found'}), 404
+    except Exception as e:
+        logger.error(f"Content analysis error: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/text-metrics', methods=['POST'])
+def text_metrics():
+    """Word, sentence, readability, speaking-time and dialogue metrics computed locally"""
+    try:
+        if request.is_json:
+            data = request.get_json()
+            text = request_text(project_store, data)
+            if not text:
+                return jsonify({'error': 'No text provided'}), 400
+            return jsonify(analyze_text(text, data.get('voices'), data.get('speeds')))
+        
+        # Raw manuscripts (e.g. text/plain uploads) are read incrementally
+        voices = [v for v in request.args.get('voices', '').split(',') if v]
+        speeds = [float(s) for s in request.args.get('speeds', '').split(',') if s]
+        return jsonify(analyze_stream(request.stream, voices, speeds))
             
-            return jsonify({
-                'analysis': analysis,
-                'metrics': {
-                    'word_count': word_count,
-                    'character_count': character_count,
-                    'estimated_minutes': estimated_minutes,
-                    'estimated_hours': round(estimated_minutes / 60, 1)
-                },
-                'tokens_used': result.get('tokens_used', 0)
-            })
+    except ProjectNotFound:
+        return jsonify({'error': 'Chapter not found'}), 404
+    except Exception as e:
+        logger.error(f"Text metrics error: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/split-chapters', methods=['POST'])
+def split_chapters_endpoint():
+    """Chapter boundaries as UTF-8 byte offsets, found in one pass without a model call"""
+    try:
+        started = time.perf_counter()
+        if request.is_json:
+            data = request.get_json()
+            text = data.get('text', '')
+            if not text:
+                return jsonify({'error': 'No text provided'}), 400
+            detectors = build_detectors(data.get('detectors'), int(data.get('min_blank_lines', 3)))
+            encoded = text.encode('utf-8')
+            chapters, total = split_chapters(encoded, detectors), len(encoded)
         else:
-            return jsonify({'error': result['error']}), 500
-            
+            # Raw manuscripts (e.g. text/plain uploads) are read incrementally
+            names = [d for d in request.args.get('detectors', '').split(',') if d]
+            detectors = build_detectors(names, int(request.args.get('min_blank_lines', 3)))
+            chapters, total = split_stream(request.stream, detectors)
+        
+        return jsonify({
+            'chapters': chapters,
+            'encoding': 'utf-8',
+            'bytes': total,
+            'elapsed_ms': round((time.perf_counter() - started) * 1000, 2)
+        })
+    
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
-        logger.error(f"Content analysis error: {str(e)}")
+        logger.error(f"Chapter split error: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/granite/suggest-voices', methods=['POST'])
@@ -249,57 +1009,72 @@ def suggest_voices():
     """Suggest voice characteristics using IBM Granite model"""
     try:
         data = request.get_json()
-        text = data.get('text', '')
+        text = request_text(project_store, data)
         genre = data.get('genre', 'general')
         
-        prompt = f"""Based on the following text content and genre "{genre}", suggest optimal voice characteristics for audiobook narration:
-
-Text sample: {text[:500]}...
-
-Please suggest:
-1. Voice type (male/female/neutral)
-2. Tone and style
-3. Pacing recommendations
-4. Accent or regional considerations
-5. Emotional delivery notes
-
-Voice recommendations:"""
-        
-        result = granite_service.generate_text(prompt, max_tokens=1000)
+        result = granite_service.generate_cached(
+            'suggest-voices', build_voices_prompt(text, genre), max_tokens=1000, batch=True
+        )
         
         if result['success']:
-            return jsonify({
-                'suggestions': result['text'].strip(),
-                'genre': genre,
-                'tokens_used': result.get('tokens_used', 0)
-            })
+            return jsonify(voices_response(genre, result))
         else:
             return jsonify({'error': result['error']}), 500
             
+    except ProjectNotFound:
+        return jsonify({'error': 'Chapter not found'}), 404
     except Exception as e:
         logger.error(f"Voice suggestion error: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+def script_chapter(segment, content):
+    return {
+        'number': segment['number'],
+        'title': f"Chapter {segment['number']}: {segment['name']}",
+        'content': content.decode('utf-8', 'replace').strip(),
+        'status': 'pending'
+    }
+
+@traced('parse')
 def parse_script_to_chapters(script_text):
     """Parse generated script into chapter structure"""
-    chapters = []
-    chapter_pattern = r'Chapter\s+(\d+):\s*([^\n]+)\n(.*?)(?=Chapter\s+\d+:|$)'
+    data = script_text.encode('utf-8')
+    return [
+        script_chapter(segment, data[segment['start']:segment['end']])
+        for segment in split_chapters(data, [SCRIPT_CHAPTER])
+        if segment['number'] is not None
+    ]
+
+class ChapterStreamParser:
+    """Incremental counterpart of parse_script_to_chapters for streamed text"""
+    
+    def __init__(self):
+        self.chapters = []
+        self._segmenter = ChapterSegmenter([SCRIPT_CHAPTER])
+        self._data = bytearray()
+        self._base = 0
     
-    matches = re.finditer(chapter_pattern, script_text, re.DOTALL | re.IGNORECASE)
+    def feed(self, text):
+        """Consume more text, returning chapters completed by it"""
+        data = text.encode('utf-8')
+        self._data += data
+        return self._collect(self._segmenter.feed(data))
     
-    for match in matches:
-        chapter_num = match.group(1)
-        title = match.group(2).strip()
-        content = match.group(3).strip()
-        
-        chapters.append({
-            'number': int(chapter_num),
-            'title': f"Chapter {chapter_num}: {title}",
-            'content': content,
-            'status': 'pending'
-        })
+    def close(self):
+        """Flush the final chapter once the stream has ended"""
+        return self._collect(self._segmenter.close())
     
-    return chapters
+    def _collect(self, segments):
+        completed = []
+        for segment in segments:
+            if segment['number'] is not None:
+                content = self._data[segment['start'] - self._base:segment['end'] - self._base]
+                completed.append(script_chapter(segment, bytes(content)))
+            # Text before the next heading is no longer needed
+            del self._data[:segment['end'] - self._base]
+            self._base = segment['end']
+        self.chapters.extend(completed)
+        return completed
 
 @app.errorhandler(404)
 def not_found(error):
@@ -326,4 +1101,8 @@ if __name__ == '__main__':
     print("   IBM_GRANITE_URL=your_endpoint_url")
     print("   IBM_GRANITE_MODEL=ibm/granite-13b-chat-v2")
     
+    # The reloader runs this block in a watcher process and again in the
+    # child that serves; only the serving child may pick up queued jobs
+    if is_running_from_reloader():
+        job_queue.resume()
     app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
@@ -0,0 +1,462 @@
+#!/usr/bin/env python3
+"""
+AI Audiobook Creator - IBM Granite async serving mode
+Serves the Granite routes on Quart/Hypercorn with a non-blocking httpx client,
+so slow LLM calls wait on the event loop instead of pinning a thread.
+Routes without an async port (streaming, jobs) fall through to the Flask app.
+"""
+
+import os
+import asyncio
+import logging
+import argparse
+import time
+
+import httpx
+from quart import Quart, g, request, jsonify
+from asgiref.wsgi import WsgiToAsgi
+from werkzeug.exceptions import HTTPException
+
+import backend_granite as granite
+from http_pool import http_pool
+from rate_limiter import THROTTLE_STATUSES, parse_retry_after, set_client, upstream_limiter
+from response_cache import make_cache_key
+from text_chunker import chunk_text, stitch
+from text_metrics import analyze_text
+from project_store import ProjectNotFound, project_store, request_text
+from metrics import (TracedJSONProvider, add_tokens, finish_request, record_stage, stage,
+                     start_trace, upstream_in_flight, upstream_requests)
+
+logger = logging.getLogger(__name__)
+
+app = Quart(__name__, static_folder=None)
+app.json = TracedJSONProvider(app)
+
+
+class AsyncGraniteService:
+    """asyncio counterpart of GraniteService sharing its config and response cache"""
+
+    def __init__(self, config, cache):
+        self.config = config
+        self.cache = cache
+        self.max_connections = int(os.getenv('GRANITE_ASYNC_MAX_CONNECTIONS', '1000'))
+        self.headers = {'Content-Type': 'application/json'}
+        if config.api_key:
+            # h11 rejects the trailing space of an empty 'Bearer ' value
+            self.headers['Authorization'] = f'Bearer {config.api_key}'
+        self._client = None
+        self._inflight = {}
+        self.in_flight = 0
+        self.calls = 0
+        self.coalesced = 0
+
+    def client(self):
+        # Created lazily so it binds to the worker's running event loop
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                headers=self.headers,
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_connections
+                ),
+                timeout=httpx.Timeout(
+                    http_pool.config.read_timeout, connect=http_pool.config.connect_timeout
+                )
+            )
+        return self._client
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def _post(self, url, payload, timeout):
+        """POST with the same retry policy as the shared HTTP pool: only connect
+        errors and 429/503 responses carrying Retry-After are sent again"""
+        retries = http_pool.config.max_retries
+        host = httpx.URL(url).netloc.decode('ascii')
+        for attempt in range(retries + 1):
+            waiting = time.perf_counter()
+            await upstream_limiter.acquire_async()
+            record_stage('upstream_queue', time.perf_counter() - waiting)
+            upstream_in_flight.inc(host=host)
+            response = None
+            outcome = {}
+            try:
+                with stage('upstream'):
+                    response = await self.client().post(url, json=payload, timeout=timeout)
+                outcome = {
+                    'status': response.status_code,
+                    'retry_after': parse_retry_after(response.headers.get('Retry-After'))
+                }
+                upstream_requests.inc(host=host, status=response.status_code)
+            except httpx.TransportError as e:
+                upstream_requests.inc(host=host, status='error')
+                # Past the connect phase upstream may already be doing the work
+                if attempt == retries or not isinstance(e, (httpx.ConnectError, httpx.ConnectTimeout)):
+                    raise
+            finally:
+                # Also on cancellation (client disconnects), or the slot would leak
+                upstream_in_flight.dec(host=host)
+                upstream_limiter.release(**outcome)
+            if response is None:
+                await asyncio.sleep(http_pool.config.backoff_factor * 2 ** attempt)
+                continue
+            if (response.status_code not in THROTTLE_STATUSES or outcome['retry_after'] is None
+                    or attempt == retries):
+                return response
+            # No sleep here: the limiter itself holds calls back for Retry-After
+
+    async def generate_text(self, prompt, max_tokens=None, temperature=None, timeout=None):
+        """Generate text, coalescing identical in-flight prompts onto one upstream call"""
+        key = make_cache_key(
+            'generate', prompt, self.config.model_id,
+            temperature or self.config.temperature,
+            max_tokens or self.config.max_tokens
+        )
+        self.calls += 1
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            # The call runs in its own task and every caller awaits it shielded,
+            # so a cancelled caller (even the first) never cancels the others
+            task = asyncio.ensure_future(self._generate_upstream(prompt, max_tokens, temperature, timeout))
+            self._inflight[key] = task
+
+            def forget(done):
+                if self._inflight.get(key) is done:
+                    del self._inflight[key]
+
+            task.add_done_callback(forget)
+        return await asyncio.shield(task)
+
+    async def _generate_upstream(self, prompt, max_tokens=None, temperature=None, timeout=None):
+        payload = {
+            'model_id': self.config.model_id,
+            'input': prompt,
+            'parameters': {
+                'max_new_tokens': max_tokens or self.config.max_tokens,
+                'temperature': temperature or self.config.temperature,
+                'top_p': 0.9,
+                'top_k': 50
+            }
+        }
+        self.in_flight += 1
+        try:
+            response = await self._post(
+                f'{self.config.base_url}/text/generation', payload, timeout or 30
+            )
+            if response.status_code == 200:
+                with stage('parse'):
+                    result = response.json().get('results', [{}])[0]
+                add_tokens(result.get('token_count', 0))
+                return {
+                    'success': True,
+                    'text': result.get('generated_text', ''),
+                    'tokens_used': result.get('token_count', 0)
+                }
+            logger.error(f"Granite API error: {response.status_code} - {response.text}")
+            return {'success': False, 'error': f"API error: {response.status_code}"}
+        except Exception as e:
+            logger.error(f"Granite service error: {str(e)}")
+            return {'success': False, 'error': str(e)}
+        finally:
+            self.in_flight -= 1
+
+    async def generate_cached(self, endpoint, prompt, max_tokens=None, temperature=None):
+        started = time.perf_counter()
+        key = make_cache_key(
+            endpoint, prompt, self.config.model_id,
+            temperature or self.config.temperature,
+            max_tokens or self.config.max_tokens
+        )
+        cached = self.cache.get(key)
+        if cached is not None:
+            return dict(cached, cached=True,
+                        cache_latency_ms=round((time.perf_counter() - started) * 1000, 3))
+
+        result = await self.generate_text(prompt, max_tokens, temperature)
+        if result['success']:
+            self.cache.set(key, result)
+        return dict(result, cached=False)
+
+    async def generate_chunked(self, endpoint, text, build_prompt, max_tokens=None):
+        chunks = chunk_text(text, self.config.chunk_tokens, self.config.chunk_overlap)
+        if len(chunks) <= 1:
+            return dict(await self.generate_cached(endpoint, build_prompt(text), max_tokens), chunks=1)
+
+        def prompt_for(chunk):
+            prompt = build_prompt(chunk.text)
+            if chunk.context:
+                prompt = granite.CONTEXT_PREFIX.format(context=chunk.context) + prompt
+            return prompt
+
+        results = await asyncio.gather(
+            *(self.generate_cached(endpoint, prompt_for(chunk), max_tokens) for chunk in chunks)
+        )
+        for index, result in enumerate(results):
+            if not result['success']:
+                return {'success': False, 'error': f"Chunk {index + 1}/{len(chunks)}: {result['error']}"}
+
+        return {
+            'success': True,
+            'text': stitch(result['text'] for result in results),
+            'tokens_used': sum(result.get('tokens_used', 0) for result in results),
+            'cached': all(result['cached'] for result in results),
+            'chunks': len(chunks)
+        }
+
+    def stats(self):
+        return {
+            'in_flight': self.in_flight,
+            'calls': self.calls,
+            'coalesced': self.coalesced,
+            'max_connections': self.max_connections
+        }
+
+
+async_service = AsyncGraniteService(granite.granite_config, granite.response_cache)
+
+# The limiter defaults suit the threaded server; here the connection pool is
+# the real bound, so start and cap the limit there unless set explicitly
+if 'UPSTREAM_CONCURRENCY' not in os.environ:
+    upstream_limiter.config.initial_limit = upstream_limiter.limit = float(async_service.max_connections)
+if 'UPSTREAM_MAX_CONCURRENCY' not in os.environ:
+    upstream_limiter.config.max_limit = float(async_service.max_connections)
+
+
+@app.after_request
+async def add_cors_headers(response):
+    response.headers['Access-Control-Allow-Origin'] = '*'
+    response.headers['Access-Control-Allow-Headers'] = 'Content-Type'
+    response.headers['Access-Control-Allow-Methods'] = 'GET, POST, OPTIONS'
+    return response
+
+
+@app.after_request
+async def end_trace(response):
+    trace = g.get('trace')
+    if trace is not None:
+        finish_request(trace, request.method, response.status_code)
+        response.headers['Server-Timing'] = trace.server_timing()
+    return response
+
+
+@app.before_request
+async def identify_client():
+    set_client(request.headers.get('X-Client-Id') or request.remote_addr)
+    # /metrics and the remaining routes are served (and traced) by the Flask fallback
+    g.trace = start_trace(request.url_rule.rule if request.url_rule else 'unmatched')
+
+
+@app.before_serving
+async def resume_jobs():
+    # Each worker offers its queue; the atomic claim runs every job only once
+    granite.job_queue.resume()
+
+
+@app.after_serving
+async def close_client():
+    await async_service.aclose()
+
+
+@app.route('/health')
+async def health_check():
+    """Health check endpoint"""
+    return jsonify({
+        'status': 'healthy',
+        'mode': 'async',
+        'timestamp': granite.datetime.now().isoformat(),
+        'granite_configured': bool(granite.granite_config.api_key),
+        'upstream': async_service.stats(),
+        'response_cache': granite.response_cache.stats(),
+        'jobs': granite.job_queue.stats(),
+        'rate_limiter': upstream_limiter.stats()
+    })
+
+
+@app.route('/api/granite/enhance-text', methods=['POST'])
+async def enhance_text():
+    try:
+        data = await request.get_json()
+        text = await asyncio.to_thread(request_text, project_store, data)
+        enhancement_type = data.get('type', 'improve')
+
+        if not text:
+            return jsonify({'error': 'No text provided'}), 400
+
+        result = await async_service.generate_chunked(
+            'enhance-text', text, lambda chunk: granite.build_enhance_prompt(chunk, enhancement_type)
+        )
+        if result['success']:
+            return jsonify(granite.enhance_response(text, enhancement_type, result))
+        return jsonify({'error': result['error']}), 500
+
+    except ProjectNotFound:
+        return jsonify({'error': 'Chapter not found'}), 404
+    except Exception as e:
+        logger.error(f"Text enhancement error: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/api/granite/enhance-book', methods=['POST'])
+async def enhance_book():
+    try:
+        data = await request.get_json()
+        chapters = data.get('chapters', [])
+        enhancement_type = data.get('type', 'improve')
+
+        if not chapters:
+            return jsonify({'error': 'No chapters provided'}), 400
+
+        concurrency = data.get('concurrency', granite.granite_config.book_concurrency)
+        concurrency = max(1, min(int(concurrency), granite.granite_config.book_concurrency, len(chapters)))
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def enhance_chapter(chapter):
+            title, text = granite.split_book_chapter(chapter)
+            if not text:
+                return {'title': title, 'success': False, 'error': 'No text provided'}
+            async with semaphore:
+                started = time.perf_counter()
+                result = await async_service.generate_chunked(
+                    'enhance-text', text,
+                    lambda chunk: granite.build_enhance_prompt(chunk, enhancement_type)
+                )
+            return granite.book_chapter_entry(title, text, result, started)
+
+        started = time.perf_counter()
+        results = await asyncio.gather(*(enhance_chapter(chapter) for chapter in chapters))
+        return jsonify(granite.book_response(list(results), enhancement_type, concurrency, started))
+
+    except Exception as e:
+        logger.error(f"Book enhancement error: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/api/granite/generate-script', methods=['POST'])
+async def generate_script():
+    try:
+        data = await request.get_json()
+        topic = data.get('topic', '')
+        chapters = data.get('chapters', 5)
+        style = data.get('style', 'educational')
+
+        if not topic:
+            return jsonify({'error': 'No topic provided'}), 400
+
+        if data.get('async'):
+            job_id = granite.job_queue.submit('generate-script', {
+                'topic': topic, 'chapters': chapters, 'style': style
+            })
+            return jsonify({
+                'job_id': job_id,
+                'status': 'queued',
+                'status_url': f'/api/jobs/{job_id}'
+            }), 202
+
+        result = await async_service.generate_text(
+            granite.build_script_prompt(topic, chapters, style), max_tokens=3000
+        )
+        if result['success']:
+            return jsonify(granite.script_response(topic, result))
+        return jsonify({'error': result['error']}), 500
+
+    except Exception as e:
+        logger.error(f"Script generation error: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/api/granite/analyze-content', methods=['POST'])
+async def analyze_content():
+    try:
+        data = await request.get_json()
+        text = await asyncio.to_thread(request_text, project_store, data)
+
+        if not text:
+            return jsonify({'error': 'No text provided'}), 400
+
+        metrics = await asyncio.to_thread(analyze_text, text, data.get('voices'), data.get('speeds'))
+
+        # The model analysis is opt-in and runs as a job on the shared queue
+        if data.get('include_llm'):
+            response = await asyncio.to_thread(granite.analysis_job_response, metrics, data)
+            return jsonify(response), 202
+        return jsonify(granite.analysis_response(metrics))
+
+    except ProjectNotFound:
+        return jsonify({'error': 'Chapter not found'}), 404
+    except Exception as e:
+        logger.error(f"Content analysis error: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/api/granite/suggest-voices', methods=['POST'])
+async def suggest_voices():
+    try:
+        data = await request.get_json()
+        text = await asyncio.to_thread(request_text, project_store, data)
+        genre = data.get('genre', 'general')
+
+        result = await async_service.generate_cached(
+            'suggest-voices', granite.build_voices_prompt(text, genre), max_tokens=1000
+        )
+        if result['success']:
+            return jsonify(granite.voices_response(genre, result))
+        return jsonify({'error': result['error']}), 500
+
+    except ProjectNotFound:
+        return jsonify({'error': 'Chapter not found'}), 404
+    except Exception as e:
+        logger.error(f"Voice suggestion error: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+
+flask_fallback = WsgiToAsgi(granite.app)
+
+
+def handled_async(scope):
+    """True when the Quart app has a route for this request"""
+    try:
+        app.url_map.bind('localhost').match(scope['path'], method=scope['method'])
+        return True
+    except HTTPException:
+        return False
+
+
+async def asgi_app(scope, receive, send):
+    """Entry point: async routes go to Quart, everything else to the Flask app"""
+    if scope['type'] != 'http' or handled_async(scope):
+        await app(scope, receive, send)
+    else:
+        await flask_fallback(scope, receive, send)
+
+
+if __name__ == '__main__':
+    from hypercorn.config import Config
+    from hypercorn.run import run
+
+    parser = argparse.ArgumentParser(description='Serve the Granite backend on an async stack')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--workers', type=int, default=int(os.getenv('GRANITE_ASYNC_WORKERS', '1')))
+    parser.add_argument('--backlog', type=int, default=2048)
+    args = parser.parse_args()
+
+    config = Config()
+    config.bind = [f'{args.host}:{args.port}']
+    config.workers = args.workers
+    config.backlog = args.backlog
+    config.application_path = 'backend_granite_async:asgi_app'
+    config.accesslog = None
+
+    print("\n🤖 AI Audiobook Creator with IBM Granite Integration (async mode)")
+    print("=" * 50)
+    print(f"Granite Model: {granite.granite_config.model_id}")
+    print(f"Workers: {args.workers}")
+    print(f"Max upstream connections per worker: {async_service.max_connections}")
+    print("=" * 50)
+    print(f"🌐 Server starting on http://localhost:{args.port}")
+
+    run(config)
@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+"""
+Offline benchmark for the audiobook backends
+Starts mock_upstream.py, backend_granite.py and backend-server.py as local
+processes pointed at the mock, drives each endpoint at the given concurrency
+levels and prints latency percentiles, throughput and upstream call counts
+as JSON. With --baseline, exits non-zero when p95 latency or throughput
+regresses by more than --max-regression:
+
+    python benchmark.py --concurrency 1,10,50 --requests 200 --output bench.json
+    python benchmark.py --baseline bench.json
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import socket
+import asyncio
+import argparse
+import tempfile
+import subprocess
+import importlib.util
+
+import httpx
+
+from load_test import run_load
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+SAMPLE_TEXT = ("The lighthouse keeper climbed the stairs at dusk. \"Another storm,\" she said, "
+               "watching the grey water fold over the rocks. Down in the village the lamps came on one by one.")
+
+# name -> (backend, path, body, field varied per request)
+SCENARIOS = {
+    'enhance-text': ('granite', '/api/granite/enhance-text', {'text': SAMPLE_TEXT, 'type': 'improve'}, 'text'),
+    'analyze-content': ('granite', '/api/granite/analyze-content', {'text': SAMPLE_TEXT}, 'text'),
+    'suggest-voices': ('granite', '/api/granite/suggest-voices', {'text': SAMPLE_TEXT, 'genre': 'mystery'}, 'text'),
+    'generate-script': ('granite', '/api/granite/generate-script', {'topic': 'A lighthouse keeper', 'chapters': 5}, 'topic'),
+    'rewrite-text': ('speech', '/api/rewrite-text', {'text': SAMPLE_TEXT, 'tone': 'suspenseful'}, 'text'),
+    'generate-speech': ('speech', '/api/generate-speech', {'text': SAMPLE_TEXT, 'voice': 'lisa'}, 'text')
+}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def serve_backend(name, port):
+    """Run one backend on a threaded WSGI server (used in the child processes)"""
+    from werkzeug.serving import make_server
+
+    sys.path.insert(0, HERE)
+    if name == 'granite':
+        import backend_granite as module
+    else:
+        spec = importlib.util.spec_from_file_location('backend_server', os.path.join(HERE, 'backend-server.py'))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+    make_server('127.0.0.1', port, module.app, threaded=True).serve_forever()
+
+
+def wait_ready(url, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if httpx.get(url, timeout=2).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up within {timeout}s")
+
+
+def start_servers(args, workdir):
+    """Launch the mock and both backends; returns (urls, processes)"""
+    ports = {name: free_port() for name in ('mock', 'granite', 'speech')}
+    mock_url = f"http://127.0.0.1:{ports['mock']}"
+    env = dict(
+        os.environ,
+        PYTHONPATH=os.pathsep.join(filter(None, [HERE, os.environ.get('PYTHONPATH')])),
+        IBM_GRANITE_URL=mock_url, IBM_GRANITE_API_KEY='benchmark',
+        WATSONX_URL=mock_url, WATSONX_API_KEY='benchmark', WATSONX_PROJECT_ID='benchmark',
+        WATSON_TTS_URL=mock_url, WATSON_TTS_API_KEY='benchmark'
+    )
+    mock_args = [
+        sys.executable, os.path.join(HERE, 'mock_upstream.py'), '--port', str(ports['mock']),
+        '--latency-ms', str(args.latency_ms), '--jitter-ms', str(args.jitter_ms),
+        '--error-rate', str(args.error_rate), '--tokens-per-second', str(args.tokens_per_second),
+        '--output-tokens', str(args.output_tokens), '--seed', '1'
+    ]
+    processes = [subprocess.Popen(mock_args, cwd=workdir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)]
+    for name in ('granite', 'speech'):
+        processes.append(subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), '--serve', name, '--port', str(ports[name])],
+            cwd=workdir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        ))
+
+    urls = {'mock': mock_url, 'granite': f"http://127.0.0.1:{ports['granite']}",
+            'speech': f"http://127.0.0.1:{ports['speech']}"}
+    wait_ready(f"{mock_url}/stats")
+    wait_ready(f"{urls['granite']}/health")
+    wait_ready(f"{urls['speech']}/health")
+    return urls, processes
+
+
+async def run_benchmark(urls, scenarios, levels, requests, vary):
+    results = []
+    async with httpx.AsyncClient(timeout=10) as client:
+        for name in scenarios:
+            backend, path, body, vary_field = SCENARIOS[name]
+            for concurrency in levels:
+                if vary:
+                    # Unique per run, so one level never hits the caches filled by another
+                    body = dict(body, **{vary_field: f"{SCENARIOS[name][2][vary_field]} [run {concurrency}]"})
+                await client.post(f"{urls['mock']}/stats/reset")
+                summary = await run_load(
+                    urls[backend] + path, body, requests, concurrency, vary=vary, vary_field=vary_field
+                )
+                upstream = (await client.get(f"{urls['mock']}/stats")).json()
+                summary.update({
+                    'scenario': name,
+                    'upstream': {
+                        'calls': upstream['total_calls'],
+                        'errors': upstream['total_errors'],
+                        'calls_per_request': round(upstream['total_calls'] / requests, 3),
+                        'max_in_flight': upstream['max_in_flight'],
+                        'endpoints': upstream['endpoints']
+                    }
+                })
+                results.append(summary)
+    return results
+
+
+def find_regressions(results, baseline, max_regression):
+    """Compare p95 latency and throughput against a previous run"""
+    previous = {(r['scenario'], r['concurrency']): r for r in baseline.get('results', [])}
+    regressions = []
+    for result in results:
+        before = previous.get((result['scenario'], result['concurrency']))
+        if before is None:
+            continue
+        p95, old_p95 = result['latency_ms']['p95'], before['latency_ms']['p95']
+        if p95 and old_p95 and p95 > old_p95 * (1 + max_regression):
+            regressions.append(f"{result['scenario']} @{result['concurrency']}: p95 {old_p95} -> {p95} ms")
+        rps, old_rps = result['throughput_rps'], before['throughput_rps']
+        if rps is not None and old_rps and rps < old_rps * (1 - max_regression):
+            regressions.append(f"{result['scenario']} @{result['concurrency']}: throughput {old_rps} -> {rps} rps")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline benchmark with a mock IBM upstream')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help='comma-separated: ' + ', '.join(SCENARIOS))
+    parser.add_argument('--concurrency', default='1,10,50', help='comma-separated concurrency levels')
+    parser.add_argument('--requests', type=int, default=200, help='requests per scenario and level')
+    parser.add_argument('--cached', action='store_true', help='repeat identical bodies (measures caching)')
+    parser.add_argument('--latency-ms', type=float, default=100)
+    parser.add_argument('--jitter-ms', type=float, default=20)
+    parser.add_argument('--error-rate', type=float, default=0)
+    parser.add_argument('--tokens-per-second', type=float, default=0)
+    parser.add_argument('--output-tokens', type=int, default=64)
+    parser.add_argument('--output', help='also write the JSON report to this file')
+    parser.add_argument('--baseline', help='previous JSON report to compare against')
+    parser.add_argument('--max-regression', type=float, default=0.2)
+    parser.add_argument('--serve', choices=['granite', 'speech'], help=argparse.SUPPRESS)
+    parser.add_argument('--port', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve_backend(args.serve, args.port)
+        return 0
+
+    scenarios = [name for name in args.scenarios.split(',') if name]
+    unknown = [name for name in scenarios if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(unknown)}")
+    levels = [int(level) for level in args.concurrency.split(',') if level]
+
+    # Job, cache, project and audio files of the run go to a scratch directory
+    workdir = tempfile.mkdtemp(prefix='audiobook-bench-')
+    processes = []
+    try:
+        urls, processes = start_servers(args, workdir)
+        results = asyncio.run(run_benchmark(urls, scenarios, levels, args.requests, not args.cached))
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        'config': {
+            'requests': args.requests,
+            'concurrency': levels,
+            'cached': args.cached,
+            'latency_ms': args.latency_ms,
+            'jitter_ms': args.jitter_ms,
+            'error_rate': args.error_rate,
+            'tokens_per_second': args.tokens_per_second,
+            'output_tokens': args.output_tokens
+        },
+        'results': results
+    }
+
+    status = 0
+    if args.baseline:
+        with open(args.baseline) as f:
+            report['regressions'] = find_regressions(results, json.load(f), args.max_regression)
+        status = 1 if report['regressions'] else 0
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
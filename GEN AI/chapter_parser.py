@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+"""
+Linear-time chapter segmentation
+Scans UTF-8 text once with pluggable heading detectors (Chapter N, Part N,
+roman numerals, markdown headings, runs of blank lines) and returns the
+byte offsets of each chapter rather than copies of its content
+"""
+
+import re
+
+NUMBER_WORDS = {
+    word: value for value, word in enumerate(
+        'one two three four five six seven eight nine ten eleven twelve thirteen fourteen '
+        'fifteen sixteen seventeen eighteen nineteen twenty'.split(), start=1
+    )
+}
+ROMAN_VALUES = {'I': 1, 'V': 5, 'X': 10, 'L': 50, 'C': 100, 'D': 500, 'M': 1000}
+ROMAN = re.compile(r'M{0,3}(CM|CD|D?C{0,3})(XC|XL|L?X{0,3})(IX|IV|V?I{0,3})$')
+
+# Separators between the chapter number and its name: colon, period, hyphen, en/em dash
+_SEPARATOR = rb'(?:[:.-]|\xe2\x80\x93|\xe2\x80\x94)'
+_NUMBER = rb'(?P<number>\d+|[ivxlcdm]+|' + b'|'.join(w.encode() for w in NUMBER_WORDS) + rb')\b'
+_NAME = rb'(?:[ \t]*' + _SEPARATOR + rb'?[ \t]*(?P<name>[^\r\n]{0,120}?))?'
+
+NON_SPACE = re.compile(rb'\S')
+
+# Roman numerals above this are words ("MIX", "CD", "MI"), not chapter numbers
+MAX_ROMAN = 100
+
+# Text is scanned a block of complete lines at a time; trailing blank lines
+# wait for the next block so a run of them is never split
+MAX_LINE = 1 << 20
+
+
+def roman_to_int(numeral):
+    numeral = numeral.upper()
+    if not numeral or not ROMAN.match(numeral):
+        return None
+    total = 0
+    for current, following in zip(numeral, numeral[1:] + ' '):
+        value = ROMAN_VALUES[current]
+        total += -value if following != ' ' and ROMAN_VALUES[following] > value else value
+    return total
+
+
+def parse_number(token):
+    """Chapter number from digits, a roman numeral or a number word"""
+    if token is None:
+        return None
+    token = token.decode('ascii', 'ignore')
+    if token.isdigit():
+        return int(token)
+    return NUMBER_WORDS.get(token.lower()) or roman_to_int(token)
+
+
+class HeadingDetector:
+    """Recognizes whole heading lines with a bytes pattern.
+
+    The pattern may define `number` and `name` groups; matches whose
+    number group does not parse are ignored.
+    """
+
+    def __init__(self, kind, pattern, flags=re.IGNORECASE):
+        self.kind = kind
+        self.regex = re.compile(rb'^(?:' + pattern + rb')[ \t]*\r?$', flags | re.MULTILINE)
+
+    def find(self, block, pos, endpos):
+        """Yield (heading_start, content_start, info) for headings in block[pos:endpos]"""
+        groups = self.regex.groupindex
+        for match in self.regex.finditer(block, pos, endpos):
+            number = None
+            if 'number' in groups and match.group('number') is not None:
+                number = parse_number(match.group('number'))
+                if number is None:
+                    continue
+            name = match.group('name') if 'name' in groups else None
+            end = match.end()
+            if block[end:end + 1] == b'\n':
+                end += 1
+            yield match.start(), end, {
+                'kind': self.kind,
+                'number': number,
+                'heading': match.group(0).decode('utf-8', 'replace').strip(),
+                'name': name.decode('utf-8', 'replace').strip() or None if name else None
+            }
+
+
+class RomanHeadingDetector(HeadingDetector):
+    """Roman numeral headings: "IV", "IV." or "IV. The Storm".
+
+    "I" or "MIX" alone on a line is usually prose, so numbers above
+    MAX_ROMAN are ignored and a bare numeral (no period, no title) only
+    counts when it opens a paragraph: a blank line or the start of the
+    text comes before it.
+    """
+
+    def find(self, block, pos, endpos):
+        for start, end, info in super().find(block, pos, endpos):
+            if info['number'] > MAX_ROMAN:
+                continue
+            if info['name'] is None and not info['heading'].endswith('.') and start > 0:
+                previous = block.rfind(b'\n', 0, start - 1) + 1
+                if block[previous:start].strip():
+                    continue
+            yield start, end, info
+
+
+class BlankLineDetector:
+    """Treats min_lines or more consecutive blank lines as a section break"""
+
+    kind = 'break'
+
+    def __init__(self, min_lines=3):
+        self.regex = re.compile(rb'(?:^[ \t]*\r?\n){%d,}' % min_lines, re.MULTILINE)
+
+    def find(self, block, pos, endpos):
+        for match in self.regex.finditer(block, pos, endpos):
+            yield match.start(), match.end(), {'kind': self.kind, 'number': None, 'heading': None, 'name': None}
+
+
+CHAPTER = HeadingDetector('chapter', rb'[ \t]*chapter[ \t]+' + _NUMBER + _NAME)
+PART = HeadingDetector('part', rb'[ \t]*part[ \t]+' + _NUMBER + _NAME)
+ROMAN_HEADING = RomanHeadingDetector(
+    'roman', rb'[ \t]*(?P<number>[IVXLCDM]+)\.?(?:[ \t]*' + _SEPARATOR + rb'[ \t]*(?P<name>[^\r\n]{1,120}?))?', flags=0
+)
+MARKDOWN = HeadingDetector('markdown', rb'[ \t]{0,3}#{1,3}[ \t]+(?P<name>[^\r\n]+?)[ \t]*#*')
+
+# Headings in generated scripts: "Chapter N: Title" on its own line
+SCRIPT_CHAPTER = HeadingDetector('chapter', rb'[ \t]*chapter[ \t]+(?P<number>\d+):[ \t]*(?P<name>[^\r\n]*\S)')
+
+DETECTORS = {
+    'markdown': MARKDOWN,
+    'chapter': CHAPTER,
+    'part': PART,
+    'roman': ROMAN_HEADING
+}
+
+
+def build_detectors(names=None, min_blank_lines=3):
+    """Detectors by name, in priority order; 'blank_lines' adds section breaks"""
+    names = list(names) if names else list(DETECTORS) + ['blank_lines']
+    detectors = []
+    for name in names:
+        if name == 'blank_lines':
+            if min_blank_lines:
+                detectors.append(BlankLineDetector(min_blank_lines))
+        elif name in DETECTORS:
+            detectors.append(DETECTORS[name])
+        else:
+            raise ValueError(f"Unknown chapter detector: {name}")
+    return detectors
+
+
+def display_title(segment):
+    if segment['kind'] == 'preamble':
+        return 'Introduction'
+    if segment['heading'] is None:
+        return f"Section {segment['index'] + 1}"
+    return segment['heading'].lstrip('#').strip()
+
+
+class ChapterSegmenter:
+    """Streaming segmenter: feed() UTF-8 bytes, collect segments, then close()"""
+
+    def __init__(self, detectors=None):
+        self.detectors = detectors if detectors is not None else build_detectors()
+        self.segments = []
+        self._pending = b''
+        self._base = 0
+        self._open = {'kind': 'preamble', 'number': None, 'heading': None, 'name': None, 'offset': 0, 'start': 0}
+        self._has_content = False
+        self._context = b''
+
+    def feed(self, data):
+        """Consume more bytes, returning the segments completed by them"""
+        buffer = self._pending + data
+        last = len(buffer.rstrip())
+        if last == 0:
+            self._pending = buffer
+            return []
+        newline = buffer.find(b'\n', last)
+        if newline != -1:
+            cut = newline + 1
+        else:
+            cut = buffer.rfind(b'\n', 0, last) + 1
+            if not cut and len(buffer) > MAX_LINE:
+                # Not a heading line; no need to hold it
+                cut = len(buffer)
+        completed = self._scan(buffer, cut)
+        self._base += cut
+        self._pending = buffer[cut:]
+        return completed
+
+    def close(self):
+        """Flush the remaining text and the final segment"""
+        buffer, self._pending = self._pending, b''
+        completed = self._scan(buffer, len(buffer))
+        self._base += len(buffer)
+        completed.extend(self._finish(self._base))
+        return completed
+
+    def split(self):
+        """End the open segment at the text scanned so far and continue it in a new one.
+
+        Lets a caller that buffers the open segment's bytes cap that buffer;
+        the continuation is marked with continued=True.
+        """
+        if not self._has_content:
+            return []
+        completed = self._finish(self._base)
+        self._open = dict(self._open, offset=self._base, start=self._base, continued=True)
+        self._has_content = False
+        return completed
+
+    def _scan(self, block, endpos):
+        # A one-line prefix tells detectors whether the line before this
+        # block was blank; none at the start of the text
+        skip = len(self._context)
+        text = self._context + block
+        found = []
+        for order, detector in enumerate(self.detectors):
+            found.extend((start - skip, order, end - skip, info)
+                         for start, end, info in detector.find(text, skip, skip + endpos))
+        found.sort(key=lambda item: (item[0], item[1]))
+        if endpos:
+            last = block.rfind(b'\n', 0, endpos - 1) + 1
+            self._context = b'\n' if not block[last:endpos].strip() else b'-\n'
+
+        completed = []
+        position = 0
+        for start, _, end, info in found:
+            if start < position:
+                continue    # overlaps a heading already taken
+            if not self._has_content and NON_SPACE.search(block, position, start):
+                self._has_content = True
+            if info['kind'] == 'break' and not self._has_content:
+                # Blank lines right after a heading don't start a new section
+                position = end
+                continue
+            completed.extend(self._finish(self._base + start))
+            self._open = dict(info, offset=self._base + start, start=self._base + end)
+            self._has_content = False
+            position = end
+        if not self._has_content and NON_SPACE.search(block, position, endpos):
+            self._has_content = True
+        return completed
+
+    def _finish(self, end):
+        segment = dict(self._open, end=end)
+        if not self._has_content:
+            return []
+        segment['index'] = len(self.segments)
+        segment['title'] = display_title(segment)
+        self.segments.append(segment)
+        return [segment]
+
+
+def split_chapters(data, detectors=None):
+    """Segments of a whole UTF-8 text, with byte offsets"""
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    segmenter = ChapterSegmenter(detectors)
+    segmenter.feed(data)
+    segmenter.close()
+    return segmenter.segments
+
+
+def split_stream(stream, detectors=None, block_size=65536):
+    """Segments of a binary file-like object, read block by block"""
+    segmenter = ChapterSegmenter(detectors)
+    total = 0
+    while True:
+        data = stream.read(block_size)
+        if not data:
+            break
+        total += len(data)
+        segmenter.feed(data)
+    segmenter.close()
+    return segmenter.segments, total
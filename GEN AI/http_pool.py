@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+"""
+Shared HTTP session layer for outbound IBM API calls
+Keeps pooled keep-alive connections per host, applies connect/read timeouts
+and retries only calls that cannot have run upstream twice: connect errors,
+and 429/503 responses that say when to come back (Retry-After)
+"""
+
+import os
+import time
+import logging
+import threading
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from rate_limiter import THROTTLE_STATUSES, parse_retry_after, upstream_limiter
+from metrics import record_stage, registry, stage, upstream_in_flight, upstream_requests
+
+logger = logging.getLogger(__name__)
+
+def parse_host_pool_sizes(value):
+    """Parse 'host=size,host=size' into a dict of per-host pool sizes"""
+    sizes = {}
+    for item in (value or '').split(','):
+        if '=' not in item:
+            continue
+        host, size = item.split('=', 1)
+        try:
+            sizes[host.strip().lower()] = int(size)
+        except ValueError:
+            logger.warning(f"Ignoring invalid pool size for {host}: {size}")
+    return sizes
+
+
+class HttpPoolConfig:
+    def __init__(self):
+        self.pool_connections = int(os.getenv('HTTP_POOL_CONNECTIONS', '10'))
+        self.pool_maxsize = int(os.getenv('HTTP_POOL_MAXSIZE', '20'))
+        self.host_pool_sizes = parse_host_pool_sizes(os.getenv('HTTP_POOL_HOST_SIZES', ''))
+        self.connect_timeout = float(os.getenv('HTTP_CONNECT_TIMEOUT', '5'))
+        self.read_timeout = float(os.getenv('HTTP_READ_TIMEOUT', '30'))
+        self.max_retries = int(os.getenv('HTTP_MAX_RETRIES', '3'))
+        self.backoff_factor = float(os.getenv('HTTP_BACKOFF_FACTOR', '0.5'))
+
+
+def upstream_outcome(response):
+    """Summarize a response for the adaptive limiter, including retried 429/503s"""
+    retries = getattr(response.raw, 'retries', None)
+    history = getattr(retries, 'history', ()) or ()
+    return {
+        'status': response.status_code,
+        'retry_after': parse_retry_after(response.headers.get('Retry-After')),
+        'throttled': any(attempt.status in THROTTLE_STATUSES for attempt in history)
+    }
+
+
+class ThrottleRetry(Retry):
+    """Retry policy for generation and synthesis POSTs.
+
+    A 5xx or a read error may arrive after upstream already did (and
+    billed) the work, so those are not retried; a connect error or a
+    429/503 with Retry-After means the call was never processed.
+    """
+    RETRY_AFTER_STATUS_CODES = frozenset(THROTTLE_STATUSES)
+
+
+class HttpPool:
+    """Thread-safe registry of keep-alive sessions, one adapter per host"""
+
+    def __init__(self, config=None, limiter=None):
+        self.config = config or HttpPoolConfig()
+        self.limiter = limiter
+        self.session = requests.Session()
+        self._adapters = {}
+        self._lock = threading.Lock()
+
+    def _retry(self):
+        return ThrottleRetry(
+            total=self.config.max_retries,
+            connect=self.config.max_retries,
+            read=0,
+            other=0,
+            status=self.config.max_retries,
+            backoff_factor=self.config.backoff_factor,
+            # LLM and TTS calls are POSTs; only the throttle statuses above retry them
+            allowed_methods=frozenset(['GET', 'POST']),
+            respect_retry_after_header=True,
+            raise_on_status=False
+        )
+
+    def _adapter_for(self, url):
+        """Mount (once) and return the pooled adapter for the URL's host"""
+        parts = urlsplit(url)
+        prefix = f'{parts.scheme}://{parts.netloc}'.lower()
+        adapter = self._adapters.get(prefix)
+        if adapter is not None:
+            return adapter
+
+        with self._lock:
+            adapter = self._adapters.get(prefix)
+            if adapter is None:
+                maxsize = self.config.host_pool_sizes.get(
+                    parts.hostname or '', self.config.pool_maxsize
+                )
+                adapter = HTTPAdapter(
+                    pool_connections=self.config.pool_connections,
+                    pool_maxsize=maxsize,
+                    max_retries=self._retry(),
+                    pool_block=False
+                )
+                self.session.mount(prefix, adapter)
+                self._adapters[prefix] = adapter
+                logger.info(f"HTTP pool for {prefix} created (maxsize={maxsize})")
+        return adapter
+
+    def request(self, method, url, timeout=None, stream=False, **kwargs):
+        """Send a request through the shared session with pool timeouts.
+
+        The limiter slot and in-flight gauge are held until the response is
+        done: on return, or for stream=True once the caller closes it.
+        """
+        self._adapter_for(url)
+        if timeout is None:
+            timeout = (self.config.connect_timeout, self.config.read_timeout)
+        elif not isinstance(timeout, tuple):
+            timeout = (self.config.connect_timeout, timeout)
+        if self.limiter is not None:
+            waiting = time.perf_counter()
+            self.limiter.acquire()
+            record_stage('upstream_queue', time.perf_counter() - waiting)
+
+        host = urlsplit(url).netloc
+        upstream_in_flight.inc(host=host)
+        outcome = {}
+        once = threading.Lock()
+
+        def finish():
+            if once.acquire(blocking=False):
+                upstream_in_flight.dec(host=host)
+                if self.limiter is not None:
+                    self.limiter.release(**outcome)
+
+        try:
+            with stage('upstream'):
+                response = self.session.request(method, url, timeout=timeout, stream=stream, **kwargs)
+        except BaseException:
+            upstream_requests.inc(host=host, status='error')
+            finish()
+            raise
+        upstream_requests.inc(host=host, status=response.status_code)
+        outcome.update(upstream_outcome(response))
+        if not stream:
+            finish()
+            return response
+
+        close = response.close
+
+        def close_and_release():
+            try:
+                close()
+            finally:
+                finish()
+
+        response.close = close_and_release
+        return response
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def stats(self):
+        """Per-host pool hit/miss counters (a miss opens a new connection)"""
+        hosts = {}
+        with self._lock:
+            adapters = list(self._adapters.items())
+
+        for prefix, adapter in adapters:
+            requests_made = 0
+            connections = 0
+            pools = adapter.poolmanager.pools
+            for key in list(pools.keys()):
+                pool = pools.get(key)
+                if pool is None:
+                    continue
+                requests_made += pool.num_requests
+                connections += pool.num_connections
+            hosts[prefix] = {
+                'requests': requests_made,
+                'pool_hits': max(requests_made - connections, 0),
+                'pool_misses': connections,
+                'pool_maxsize': adapter._pool_maxsize
+            }
+
+        return {
+            'hosts': hosts,
+            'pool_hits': sum(h['pool_hits'] for h in hosts.values()),
+            'pool_misses': sum(h['pool_misses'] for h in hosts.values()),
+            'connect_timeout': self.config.connect_timeout,
+            'read_timeout': self.config.read_timeout,
+            'max_retries': self.config.max_retries
+        }
+
+
+http_pool = HttpPool(limiter=upstream_limiter)
+
+
+def _limiter_samples():
+    stats = upstream_limiter.stats()
+    return [({'value': name}, stats[name]) for name in ('limit', 'in_flight', 'queue_depth')]
+
+
+registry.callback('audiobook_upstream_limiter', 'Adaptive upstream limiter state', 'gauge', _limiter_samples)
+registry.callback(
+    'audiobook_upstream_throttled_total', 'Upstream responses that throttled (429/503)', 'counter',
+    lambda: [({}, upstream_limiter.stats()['throttled'])]
+)
@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+"""
+Persistent background job queue
+Jobs are stored in SQLite and run on a local worker pool; queued or
+interrupted jobs are picked up again when the server restarts. Several
+processes may share one database: a job is claimed atomically, and a
+running job is only taken over once its owner stops renewing its lease
+"""
+
+import json
+import time
+import uuid
+import sqlite3
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+QUEUED = 'queued'
+RUNNING = 'running'
+COMPLETED = 'completed'
+FAILED = 'failed'
+
+
+class JobContext:
+    """Handle passed to job handlers for reporting progress"""
+
+    def __init__(self, queue, job_id):
+        self.queue = queue
+        self.job_id = job_id
+
+    def update(self, partial=None, progress=None):
+        self.queue._update(self.job_id, partial=partial, progress=progress)
+
+
+class JobQueue:
+    def __init__(self, db_path, workers=4, lease=60):
+        self._db = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS jobs ('
+            'id TEXT PRIMARY KEY, kind TEXT NOT NULL, params TEXT NOT NULL, '
+            'status TEXT NOT NULL, progress REAL NOT NULL DEFAULT 0, partial TEXT, '
+            'result TEXT, error TEXT, created REAL NOT NULL, started REAL, finished REAL, '
+            'owner TEXT, heartbeat REAL)'
+        )
+        columns = {row[1] for row in self._db.execute('PRAGMA table_info(jobs)')}
+        for column in ('owner TEXT', 'heartbeat REAL'):
+            if column.split()[0] not in columns:
+                self._db.execute(f'ALTER TABLE jobs ADD COLUMN {column}')
+        self._db.commit()
+        self.lease = lease
+        self.owner = uuid.uuid4().hex
+        self._lock = threading.Lock()
+        self._handlers = {}
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='job')
+        self._renewer = None
+
+    def register(self, kind, handler):
+        """Register handler(params, job) -> result dict for a job kind"""
+        self._handlers[kind] = handler
+
+    def submit(self, kind, params):
+        if kind not in self._handlers:
+            raise ValueError(f"Unknown job type: {kind}")
+
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            self._db.execute(
+                'INSERT INTO jobs (id, kind, params, status, created) VALUES (?, ?, ?, ?, ?)',
+                (job_id, kind, json.dumps(params), QUEUED, time.time())
+            )
+            self._db.commit()
+        self._executor.submit(self._run, job_id)
+        return job_id
+
+    def resume(self):
+        """Pick up queued jobs and running jobs whose owner stopped renewing them.
+
+        Call once from each serving process (not at import time: reloader
+        watchers and worker-pool children import the app too). It also starts
+        renewing the leases of the jobs this process runs.
+        """
+        self._start_renewer()
+        with self._lock:
+            queued = [job_id for (job_id,) in self._db.execute(
+                'SELECT id FROM jobs WHERE status = ? ORDER BY created', (QUEUED,)
+            )]
+
+        job_ids = queued + self._requeue_expired()
+        for job_id in job_ids:
+            self._executor.submit(self._run, job_id)
+        if job_ids:
+            logger.info(f"Resumed {len(job_ids)} pending jobs")
+        return len(job_ids)
+
+    def _requeue_expired(self):
+        """Return running jobs with an expired lease to the queue"""
+        expired = time.time() - self.lease
+        requeued = []
+        with self._lock:
+            rows = self._db.execute(
+                'SELECT id FROM jobs WHERE status = ? AND (heartbeat IS NULL OR heartbeat < ?) '
+                'ORDER BY created', (RUNNING, expired)
+            ).fetchall()
+            for (job_id,) in rows:
+                # Re-checked per row: another process may have taken it over meanwhile
+                cursor = self._db.execute(
+                    'UPDATE jobs SET status = ?, started = NULL, owner = NULL, heartbeat = NULL '
+                    'WHERE id = ? AND status = ? AND (heartbeat IS NULL OR heartbeat < ?)',
+                    (QUEUED, job_id, RUNNING, expired)
+                )
+                if cursor.rowcount:
+                    requeued.append(job_id)
+            self._db.commit()
+        return requeued
+
+    def _start_renewer(self):
+        with self._lock:
+            if self._renewer is None:
+                self._renewer = threading.Thread(target=self._renew_leases, name='job-leases', daemon=True)
+                self._renewer.start()
+
+    def _renew_leases(self):
+        while True:
+            time.sleep(self.lease / 3)
+            try:
+                with self._lock:
+                    self._db.execute(
+                        'UPDATE jobs SET heartbeat = ? WHERE owner = ? AND status = ?',
+                        (time.time(), self.owner, RUNNING)
+                    )
+                    self._db.commit()
+                # Jobs of a process that died after startup
+                for job_id in self._requeue_expired():
+                    logger.info(f"Job {job_id} lost its worker; re-queued")
+                    self._executor.submit(self._run, job_id)
+            except sqlite3.Error as e:
+                logger.error(f"Job lease renewal failed: {str(e)}")
+
+    def get(self, job_id):
+        with self._lock:
+            row = self._db.execute(
+                'SELECT id, kind, params, status, progress, partial, result, error, '
+                'created, started, finished FROM jobs WHERE id = ?', (job_id,)
+            ).fetchone()
+        if row is None:
+            return None
+
+        created, started, finished = row[8], row[9], row[10]
+        end = finished or time.time()
+        return {
+            'job_id': row[0],
+            'type': row[1],
+            'params': json.loads(row[2]),
+            'status': row[3],
+            'progress': row[4],
+            'partial_output': row[5],
+            'result': json.loads(row[6]) if row[6] else None,
+            'error': row[7],
+            'timing': {
+                'created': created,
+                'started': started,
+                'finished': finished,
+                'queued_seconds': round((started or end) - created, 3),
+                'run_seconds': round(end - started, 3) if started else None
+            }
+        }
+
+    def stats(self):
+        with self._lock:
+            rows = self._db.execute('SELECT status, COUNT(*) FROM jobs GROUP BY status').fetchall()
+        return dict(rows)
+
+    def stats_by_kind(self):
+        """Job counts as {(kind, status): count}"""
+        with self._lock:
+            rows = self._db.execute(
+                'SELECT kind, status, COUNT(*) FROM jobs GROUP BY kind, status'
+            ).fetchall()
+        return {(kind, status): count for kind, status, count in rows}
+
+    def _update(self, job_id, **fields):
+        fields = {k: v for k, v in fields.items() if v is not None}
+        if not fields:
+            return
+        assignments = ', '.join(f'{name} = ?' for name in fields)
+        with self._lock:
+            self._db.execute(
+                f'UPDATE jobs SET {assignments} WHERE id = ?', (*fields.values(), job_id)
+            )
+            self._db.commit()
+
+    def _claim(self, job_id):
+        """Atomically move a queued job to running; False if another worker got it first"""
+        now = time.time()
+        with self._lock:
+            cursor = self._db.execute(
+                'UPDATE jobs SET status = ?, started = ?, owner = ?, heartbeat = ? '
+                'WHERE id = ? AND status = ?',
+                (RUNNING, now, self.owner, now, job_id, QUEUED)
+            )
+            self._db.commit()
+        return cursor.rowcount == 1
+
+    def _run(self, job_id):
+        if not self._claim(job_id):
+            return
+        self._start_renewer()
+
+        job = self.get(job_id)
+        try:
+            result = self._handlers[job['type']](job['params'], JobContext(self, job_id))
+            self._update(job_id, status=COMPLETED, progress=1.0,
+                         result=json.dumps(result), finished=time.time())
+        except Exception as e:
+            logger.error(f"Job {job_id} ({job['type']}) failed: {str(e)}")
+            self._update(job_id, status=FAILED, error=str(e), finished=time.time())
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Simple local load generator
+Fires JSON POST requests at a fixed concurrency and reports throughput and
+latency percentiles, e.g. to compare the Flask dev server with async mode:
+
+    python load_test.py --url http://localhost:5000/api/granite/suggest-voices \
+        --body '{"text": "sample", "genre": "fantasy"}' --requests 2000 --concurrency 200
+"""
+
+import json
+import time
+import asyncio
+import argparse
+
+import httpx
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+async def run_load(url, body, total, concurrency, timeout=60, vary=False, vary_field='text'):
+    """Send total requests with at most concurrency in flight; return a summary dict"""
+    latencies = []
+    statuses = {}
+    errors = 0
+    counter = iter(range(total))
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=timeout) as client:
+        async def worker():
+            nonlocal errors
+            for index in counter:
+                payload = dict(body)
+                if vary:
+                    # Distinct payloads defeat response caching and coalescing
+                    payload[vary_field] = f"{payload.get(vary_field, '')} #{index}"
+                started = time.perf_counter()
+                try:
+                    response = await client.post(url, json=payload)
+                    statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+                except httpx.HTTPError:
+                    errors += 1
+                    continue
+                latencies.append((time.perf_counter() - started) * 1000)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        'url': url,
+        'requests': total,
+        'concurrency': concurrency,
+        'elapsed_seconds': round(elapsed, 3),
+        'throughput_rps': round(len(latencies) / elapsed, 1) if elapsed else None,
+        'statuses': {str(code): count for code, count in sorted(statuses.items())},
+        'errors': errors,
+        'latency_ms': {
+            'p50': round(percentile(latencies, 0.50), 1) if latencies else None,
+            'p95': round(percentile(latencies, 0.95), 1) if latencies else None,
+            'p99': round(percentile(latencies, 0.99), 1) if latencies else None,
+            'max': round(latencies[-1], 1) if latencies else None
+        }
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Local load generator for the audiobook backends')
+    parser.add_argument('--url', default='http://localhost:5000/api/granite/suggest-voices')
+    parser.add_argument('--body', default='{"text": "A quiet village by the sea.", "genre": "general"}')
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--vary', action='store_true', help='make every request body unique')
+    args = parser.parse_args()
+
+    summary = asyncio.run(run_load(
+        args.url, json.loads(args.body), args.requests, args.concurrency, vary=args.vary
+    ))
+    print(json.dumps(summary, indent=2))
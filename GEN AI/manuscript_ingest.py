@@ -0,0 +1,398 @@
+#!/usr/bin/env python3
+"""
+Streaming manuscript ingest
+Reads TXT, Markdown or EPUB uploads block by block, normalizes encoding and
+whitespace on the fly and writes each chapter to the project store as soon
+as it is complete. Only the chapter being assembled is held in memory, and
+chapters longer than max_chapter_bytes are stored in parts, so a 50 MB
+manuscript ingests in bounded memory
+"""
+
+import re
+import codecs
+import zipfile
+import posixpath
+import tempfile
+import unicodedata
+import xml.etree.ElementTree as ET
+from html.parser import HTMLParser
+from urllib.parse import unquote
+
+from chapter_parser import ChapterSegmenter, build_detectors
+
+BLOCK_SIZE = 64 * 1024
+SNIFF_BYTES = 4096
+# EPUBs are zip files, read from a spooled copy of the upload
+SPOOL_BYTES = 8 * 1024 * 1024
+# Longest unfinished line held while waiting for its newline
+MAX_PENDING = 1 << 20
+
+FORMATS = ('txt', 'md', 'epub')
+EXTENSIONS = {'.txt': 'txt', '.text': 'txt', '.md': 'md', '.markdown': 'md', '.epub': 'epub'}
+CONTENT_TYPES = {'text/plain': 'txt', 'text/markdown': 'md', 'text/x-markdown': 'md', 'application/epub+zip': 'epub'}
+
+SPACES = re.compile(r'[ \t\u00a0\u2000-\u200a\u202f\u205f\u3000]+')
+INVISIBLE = re.compile(r'[\x00-\x08\x0b-\x1f\x7f\u00ad\u200b-\u200d\u2060\ufeff]')
+MD_IMAGE = re.compile(r'!\[[^\]]*\]\([^)]*\)')
+MD_LINK = re.compile(r'\[([^\]]+)\]\([^)]*\)')
+MD_QUOTE = re.compile(r'^(?:>\s?)+')
+
+CONTAINER_NS = '{urn:oasis:names:tc:opendocument:xmlns:container}'
+OPF_NS = {'opf': 'http://www.idpf.org/2007/opf', 'dc': 'http://purl.org/dc/elements/1.1/'}
+
+
+def sniff_encoding(head):
+    """Encoding of a manuscript from its first bytes: a BOM, else UTF-8 if it decodes, else Windows-1252"""
+    if head.startswith(codecs.BOM_UTF8):
+        return 'utf-8-sig'
+    if head.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+        return 'utf-16'
+    try:
+        # Incremental, so a character cut at the end of the sample is not an error
+        codecs.getincrementaldecoder('utf-8')().decode(head)
+        return 'utf-8'
+    except UnicodeDecodeError:
+        return 'cp1252'
+
+
+def detect_format(requested=None, filename=None, content_type=None, head=b''):
+    if requested:
+        if requested not in FORMATS:
+            raise ValueError(f"Unsupported format: {requested}")
+        return requested
+    if filename:
+        extension = posixpath.splitext(filename.lower())[1]
+        if extension in EXTENSIONS:
+            return EXTENSIONS[extension]
+    if content_type:
+        mimetype = content_type.split(';')[0].strip().lower()
+        if mimetype in CONTENT_TYPES:
+            return CONTENT_TYPES[mimetype]
+    return 'epub' if head.startswith(b'PK\x03\x04') else 'txt'
+
+
+class TextNormalizer:
+    """Incremental line normalizer: str in, clean UTF-8 lines out.
+
+    Unifies line endings, applies NFC, drops invisible and control
+    characters, collapses runs of spaces and trims each line. Markdown
+    images are dropped and links reduced to their text; headings and
+    emphasis stay for chapter detection and SSML. A line longer than
+    MAX_PENDING is emitted in pieces, cut at whitespace.
+    """
+
+    def __init__(self, markdown=False):
+        self.markdown = markdown
+        self._pending = []          # pieces of the unfinished line
+        self._pending_length = 0
+        self._continued = False     # the unfinished line was partly emitted already
+
+    def feed(self, text, final=False):
+        if final:
+            cut = len(text)
+        else:
+            # A trailing \r may be the first half of \r\n
+            cut = max(text.rfind('\n'), text.rfind('\r', 0, len(text) - 1)) + 1
+        held_cr = bool(text) and bool(self._pending) and self._pending[-1].endswith('\r')
+        if not cut and not held_cr and not final:
+            self._pending.append(text)
+            self._pending_length += len(text)
+            return self._overflow()
+
+        self._pending.append(text[:cut])
+        block = ''.join(self._pending)
+        rest = text[cut:]
+        self._pending = [rest] if rest else []
+        self._pending_length = len(rest)
+        lines = block.replace('\r\n', '\n').replace('\r', '\n').split('\n')
+        if final:
+            if lines[-1] == '':
+                lines.pop()
+        else:
+            lines.pop()     # the empty string after the last newline
+        out = []
+        for line in lines:
+            out.append(self._line(line, self._continued) + '\n')
+            self._continued = False
+        return ''.join(out).encode('utf-8') + self._overflow()
+
+    def _overflow(self):
+        """Emit the start of an overlong unfinished line, so memory stays bounded"""
+        if self._pending_length <= MAX_PENDING:
+            return b''
+        text = ''.join(self._pending)
+        # Hold back a trailing \r, which may still pair with a \n
+        limit = len(text) - 1 if text.endswith('\r') else len(text)
+        cut = max(text.rfind(' ', 0, limit), text.rfind('\t', 0, limit)) + 1
+        piece = self._line(text[:cut or limit], self._continued)
+        if cut and piece:
+            # The whitespace at the cut still separates the two pieces
+            piece += ' '
+        rest = text[cut or limit:]
+        self._pending = [rest] if rest else []
+        self._pending_length = len(rest)
+        self._continued = True
+        return piece.encode('utf-8')
+
+    def _line(self, line, continued=False):
+        line = INVISIBLE.sub('', unicodedata.normalize('NFC', line))
+        if self.markdown and not continued:
+            line = MD_LINK.sub(r'\1', MD_IMAGE.sub('', MD_QUOTE.sub('', line.lstrip())))
+        return SPACES.sub(' ', line).strip()
+
+
+class ChapterAssembler:
+    """Splits normalized UTF-8 into chapters, storing each as soon as it completes"""
+
+    def __init__(self, store, book_id, detectors, max_chapter_bytes, title=None):
+        self.store = store
+        self.book_id = book_id
+        self.max_chapter_bytes = max_chapter_bytes
+        self.title = title
+        self.chapters = []
+        self._segmenter = ChapterSegmenter(detectors)
+        self._data = bytearray()
+        self._base = 0
+
+    def feed(self, data):
+        self._data += data
+        self._store(self._segmenter.feed(data))
+        if len(self._data) > self.max_chapter_bytes:
+            self._store(self._segmenter.split())
+
+    def close(self):
+        self._store(self._segmenter.close())
+        return self.chapters
+
+    def _store(self, segments):
+        for segment in segments:
+            content = bytes(self._data[segment['start'] - self._base:segment['end'] - self._base])
+            del self._data[:segment['end'] - self._base]
+            self._base = segment['end']
+            text = content.decode('utf-8', 'replace').strip()
+            if not text:
+                continue
+            title = self.title or segment['title']
+            if segment.get('continued'):
+                title += ' (continued)'
+            chapter_id = self.store.append_chapter(self.book_id, title, text)
+            self.chapters.append({'id': chapter_id, 'title': title, 'bytes': len(content)})
+
+
+class XHTMLText(HTMLParser):
+    """Text of an (X)HTML document fed in pieces, with block elements as paragraph breaks"""
+
+    BLOCKS = {'p', 'div', 'section', 'article', 'blockquote', 'li', 'ul', 'ol', 'tr', 'table',
+              'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'hr', 'pre', 'figure', 'aside'}
+    SKIP = {'script', 'style', 'head', 'svg', 'math'}
+    HEADINGS = {'h1', 'h2', 'h3'}
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.heading = None
+        self.document_title = None
+        self._parts = []
+        self._skip = 0
+        self._in_title = False
+        self._heading_parts = None
+        self._at_break = True
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.SKIP:
+            self._skip += 1
+        elif tag == 'title':
+            self._in_title = True
+        elif tag == 'br':
+            self._parts.append('\n')
+        elif tag in self.BLOCKS:
+            self._paragraph()
+            if tag in self.HEADINGS and self.heading is None and self._heading_parts is None:
+                self._heading_parts = []
+
+    def handle_endtag(self, tag):
+        if tag in self.SKIP:
+            self._skip = max(self._skip - 1, 0)
+        elif tag == 'title':
+            self._in_title = False
+        elif tag in self.BLOCKS:
+            self._paragraph()
+            if tag in self.HEADINGS and self._heading_parts is not None:
+                self.heading = SPACES.sub(' ', ''.join(self._heading_parts)).strip() or None
+                self._heading_parts = None
+
+    def handle_data(self, data):
+        if self._in_title:
+            self.document_title = ((self.document_title or '') + data).strip() or None
+        elif self._heading_parts is not None:
+            # The first heading becomes the chapter title rather than chapter text
+            self._heading_parts.append(data)
+        elif not self._skip and not (self._at_break and data.isspace()):
+            self._parts.append(data)
+            self._at_break = False
+
+    def _paragraph(self):
+        # Nested and adjacent blocks make one paragraph break, not several
+        if not self._at_break:
+            self._parts.append('\n\n')
+            self._at_break = True
+
+    def take(self):
+        """Text collected since the last call"""
+        text = ''.join(self._parts)
+        self._parts = []
+        return text
+
+
+def epub_spine(archive):
+    """(book title, [document paths in reading order]) from the EPUB package"""
+    try:
+        container = ET.fromstring(archive.read('META-INF/container.xml'))
+        rootfile = container.find(f'.//{CONTAINER_NS}rootfile').get('full-path')
+        package = ET.fromstring(archive.read(rootfile))
+    except (KeyError, AttributeError, ET.ParseError) as e:
+        raise ValueError(f"Not a valid EPUB: {str(e)}")
+    base = posixpath.dirname(rootfile)
+    manifest = {item.get('id'): item for item in package.iterfind('opf:manifest/opf:item', OPF_NS)}
+    documents = []
+    for itemref in package.iterfind('opf:spine/opf:itemref', OPF_NS):
+        item = manifest.get(itemref.get('idref'))
+        if item is None or itemref.get('linear') == 'no' or 'html' not in (item.get('media-type') or ''):
+            continue
+        documents.append(posixpath.normpath(posixpath.join(base, unquote(item.get('href')))))
+    return package.findtext('opf:metadata/dc:title', namespaces=OPF_NS), documents
+
+
+class ManuscriptIngest:
+    """Ingest one manuscript into a new project"""
+
+    def __init__(self, store, title=None, fmt=None, filename=None, content_type=None, encoding=None,
+                 detectors=None, max_chapter_bytes=4 * 1024 * 1024, max_bytes=256 * 1024 * 1024):
+        self.store = store
+        self.title = title
+        self.format = fmt
+        self.filename = filename
+        self.content_type = content_type
+        self.encoding = encoding
+        self.detectors = detectors
+        self.max_chapter_bytes = max_chapter_bytes
+        self.max_bytes = max_bytes
+        self.book_title = None
+        self.bytes_read = 0
+        self.text_bytes = 0
+        self.chapters = []
+
+    def run(self, stream):
+        """Read stream to the end; returns the new book id. Nothing is kept if it fails"""
+        head = stream.read(SNIFF_BYTES)
+        self.format = detect_format(self.format, self.filename, self.content_type, head)
+        default_title = posixpath.splitext(posixpath.basename(self.filename or ''))[0] or 'Untitled'
+        self.book_title = self.title or default_title
+        book_id = self.store.create_book(self.book_title, [])
+        try:
+            if self.format == 'epub':
+                self._epub(book_id, head, stream)
+            else:
+                self._text(book_id, head, stream)
+        except BaseException:
+            self.store.delete_book(book_id)
+            raise
+        if not self.chapters:
+            self.store.delete_book(book_id)
+            raise ValueError("No text found in the manuscript")
+        return book_id
+
+    def _blocks(self, head, stream):
+        data = head
+        while data:
+            self.bytes_read += len(data)
+            if self.bytes_read > self.max_bytes:
+                raise ValueError(f"Manuscript exceeds {self.max_bytes} bytes")
+            yield data
+            data = stream.read(BLOCK_SIZE)
+
+    def _emit(self, assembler, data):
+        self.text_bytes += len(data)
+        if self.text_bytes > self.max_bytes:
+            raise ValueError(f"Manuscript text exceeds {self.max_bytes} bytes")
+        assembler.feed(data)
+
+    def _text(self, book_id, head, stream):
+        self.encoding = self.encoding or sniff_encoding(head)
+        try:
+            decoder = codecs.getincrementaldecoder(self.encoding)(errors='replace')
+        except LookupError:
+            raise ValueError(f"Unknown encoding: {self.encoding}")
+        normalizer = TextNormalizer(markdown=self.format == 'md')
+        detectors = self.detectors
+        if detectors is None and self.format == 'md':
+            detectors = build_detectors(['markdown', 'chapter', 'part'])
+        assembler = ChapterAssembler(self.store, book_id, detectors, self.max_chapter_bytes)
+        for data in self._blocks(head, stream):
+            self._emit(assembler, normalizer.feed(decoder.decode(data)))
+        self._emit(assembler, normalizer.feed(decoder.decode(b'', final=True), final=True))
+        self.chapters = assembler.close()
+
+    def _epub(self, book_id, head, stream):
+        self.encoding = 'utf-8'
+        with tempfile.SpooledTemporaryFile(max_size=SPOOL_BYTES) as spool:
+            for data in self._blocks(head, stream):
+                spool.write(data)
+            spool.seek(0)
+            try:
+                archive = zipfile.ZipFile(spool)
+            except zipfile.BadZipFile as e:
+                raise ValueError(f"Not a valid EPUB: {str(e)}")
+            with archive:
+                book_title, documents = epub_spine(archive)
+                if book_title and not self.title:
+                    self.book_title = book_title
+                    self.store.rename_book(book_id, book_title)
+                for path in documents:
+                    self._epub_document(book_id, archive, path)
+
+    def _epub_document(self, book_id, archive, path):
+        """Store one spine document as a chapter titled by its first heading"""
+        try:
+            member = archive.open(path)
+        except KeyError:
+            raise ValueError(f"Not a valid EPUB: {path} is missing")
+        parser = XHTMLText()
+        normalizer = TextNormalizer()
+        pending = bytearray()
+        # The title is only known once the heading has been parsed, so text is
+        # held back until then (or until the chapter cap forces a flush)
+        assembler = None
+        with member:
+            head = member.read(SNIFF_BYTES)
+            decoder = codecs.getincrementaldecoder(sniff_encoding(head))(errors='replace')
+            data = head
+            while True:
+                final = not data
+                parser.feed(decoder.decode(data, final=final))
+                if final:
+                    parser.close()
+                text = normalizer.feed(parser.take(), final=final)
+                if assembler is None:
+                    pending += text
+                    if parser.heading is None and not final and len(pending) <= self.max_chapter_bytes:
+                        data = member.read(BLOCK_SIZE)
+                        continue
+                    title = parser.heading or parser.document_title or f'Chapter {len(self.chapters) + 1}'
+                    assembler = ChapterAssembler(self.store, book_id, [], self.max_chapter_bytes, title)
+                    text, pending = bytes(pending), None
+                self._emit(assembler, text)
+                if final:
+                    break
+                data = member.read(BLOCK_SIZE)
+        self.chapters.extend(assembler.close())
+
+    def result(self, book_id):
+        return {
+            'id': book_id,
+            'title': self.book_title,
+            'format': self.format,
+            'encoding': self.encoding,
+            'bytes_read': self.bytes_read,
+            'text_bytes': self.text_bytes,
+            'chapters': self.chapters
+        }
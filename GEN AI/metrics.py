@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+"""
+Prometheus-style metrics and per-request stage tracing
+A small dependency-free registry (counters, gauges, histograms, callback
+metrics) rendered in the Prometheus text format, plus a per-request trace
+that splits time into stages such as prompt_build, upstream_queue,
+upstream, parse and serialize
+"""
+
+import time
+import threading
+import contextvars
+from contextlib import contextmanager
+from functools import wraps
+
+from flask import Response, g, request
+from flask.json.provider import DefaultJSONProvider
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values)) + list((extra or {}).items())
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labels)
+
+    def header(self):
+        return [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return self.header() + [f'{self.name}{_format_labels(self.labels, k)} {_format_value(v)}' for k, v in items]
+
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(buckets) + (float('inf'),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][index] += 1
+                    break
+            entry[1] += value
+            entry[2] += 1
+
+    def render(self):
+        with self._lock:
+            items = sorted((k, (list(v[0]), v[1], v[2])) for k, v in self._values.items())
+        lines = self.header()
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labels, key, {'le': _format_value(bound)})
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            lines.append(f'{self.name}_sum{_format_labels(self.labels, key)} {round(total, 6)}')
+            lines.append(f'{self.name}_count{_format_labels(self.labels, key)} {count}')
+        return lines
+
+
+class CallbackMetric(_Metric):
+    """Reads its samples from fn() -> [(labels dict, value)] at scrape time"""
+
+    def __init__(self, name, help_text, kind, fn):
+        super().__init__(name, help_text)
+        self.kind = kind
+        self.fn = fn
+
+    def render(self):
+        lines = self.header()
+        for labels, value in self.fn():
+            lines.append(f'{self.name}{_format_labels(labels.keys(), labels.values())} {_format_value(value)}')
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            # Re-registering (e.g. a module imported twice) returns the existing metric
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, help_text, labels=()):
+        return self._register(Counter(name, help_text, labels))
+
+    def gauge(self, name, help_text, labels=()):
+        return self._register(Gauge(name, help_text, labels))
+
+    def histogram(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, help_text, labels, buckets))
+
+    def callback(self, name, help_text, kind, fn):
+        with self._lock:
+            self._metrics[name] = CallbackMetric(name, help_text, kind, fn)
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            try:
+                lines.extend(metric.render())
+            except Exception:
+                # A failing callback must not take the whole scrape down
+                continue
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+http_requests = registry.counter(
+    'audiobook_http_requests_total', 'HTTP requests handled', ['route', 'method', 'status'])
+http_duration = registry.histogram(
+    'audiobook_http_request_duration_seconds', 'Time to produce a response', ['route'])
+stage_duration = registry.histogram(
+    'audiobook_stage_duration_seconds', 'Time spent per request stage', ['route', 'stage'])
+upstream_requests = registry.counter(
+    'audiobook_upstream_requests_total', 'Upstream API calls by host and HTTP status', ['host', 'status'])
+upstream_in_flight = registry.gauge(
+    'audiobook_upstream_in_flight', 'Upstream API calls currently in flight', ['host'])
+tokens_used = registry.counter(
+    'audiobook_tokens_total', 'Model tokens used', ['route'])
+batch_size = registry.histogram(
+    'audiobook_batch_size', 'Prompts per micro-batch sent upstream', buckets=BATCH_SIZE_BUCKETS)
+
+
+class Trace:
+    """Stage timings of one request; stages may be recorded from worker threads"""
+
+    def __init__(self, route):
+        self.route = route
+        self.started = time.perf_counter()
+        self.stages = {}
+        self._lock = threading.Lock()
+
+    def add(self, stage, seconds):
+        with self._lock:
+            self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def server_timing(self):
+        with self._lock:
+            stages = list(self.stages.items())
+        total = time.perf_counter() - self.started
+        parts = [f'{name};dur={seconds * 1000:.1f}' for name, seconds in stages]
+        return ', '.join(parts + [f'total;dur={total * 1000:.1f}'])
+
+
+_current_trace = contextvars.ContextVar('trace', default=None)
+
+
+def start_trace(route):
+    trace = Trace(route)
+    _current_trace.set(trace)
+    return trace
+
+
+def current_route():
+    trace = _current_trace.get()
+    return trace.route if trace else 'background'
+
+
+def record_stage(stage, seconds):
+    trace = _current_trace.get()
+    route = trace.route if trace else 'background'
+    stage_duration.observe(seconds, route=route, stage=stage)
+    if trace is not None:
+        trace.add(stage, seconds)
+
+
+@contextmanager
+def stage(name):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(name, time.perf_counter() - started)
+
+
+def traced(name):
+    """Decorator recording every call of a function as a stage"""
+    def decorate(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def add_tokens(count):
+    if count:
+        tokens_used.inc(count, route=current_route())
+
+
+def finish_request(trace, method, status):
+    http_requests.inc(route=trace.route, method=method, status=status)
+    http_duration.observe(time.perf_counter() - trace.started, route=trace.route)
+
+
+class TracedJSONProvider(DefaultJSONProvider):
+    """Flask JSON provider that records response serialization as a stage"""
+
+    def dumps(self, obj, **kwargs):
+        with stage('serialize'):
+            return super().dumps(obj, **kwargs)
+
+
+def instrument_flask(app):
+    """Trace every request of a Flask app and serve GET /metrics"""
+    app.json = TracedJSONProvider(app)
+
+    @app.before_request
+    def begin_trace():
+        g.trace = start_trace(request.url_rule.rule if request.url_rule else 'unmatched')
+
+    @app.after_request
+    def end_trace(response):
+        trace = g.get('trace')
+        if trace is not None:
+            finish_request(trace, request.method, response.status_code)
+            response.headers['Server-Timing'] = trace.server_timing()
+        return response
+
+    @app.route('/metrics')
+    def metrics():
+        return Response(registry.render(), content_type=CONTENT_TYPE)
+
+    return app
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Micro-batching for small upstream requests
+Requests arriving within a short window (or until a batch fills up) are
+sent together, then results are handed back to each waiting caller
+"""
+
+import time
+import contextvars
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from metrics import BATCH_SIZE_BUCKETS, batch_size
+
+logger = logging.getLogger(__name__)
+
+
+class MicroBatcher:
+    def __init__(self, send_batch, window_ms=20, max_batch=8, workers=4):
+        """send_batch(key, items) must return one result per item, in order"""
+        self.send_batch = send_batch
+        self.window = window_ms / 1000.0
+        self.max_batch = max(1, max_batch)
+        self._pending = OrderedDict()      # key -> (first_arrival, [(item, future)], context)
+        self._cond = threading.Condition()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='batch')
+        self._histogram = {bucket: 0 for bucket in BATCH_SIZE_BUCKETS}
+        self._histogram['+Inf'] = 0
+        self.batches = 0
+        self.items = 0
+        self._thread = threading.Thread(target=self._collect, name='micro-batcher', daemon=True)
+        self._thread.start()
+
+    def submit(self, key, item):
+        """Queue item for the next batch with this key; returns a Future"""
+        future = Future()
+        with self._cond:
+            entry = self._pending.get(key)
+            if entry is None:
+                # The batch is sent in the context of its first caller (trace, client id)
+                entry = self._pending[key] = (time.monotonic(), [], contextvars.copy_context())
+            entry[1].append((item, future))
+            if len(entry[1]) >= self.max_batch:
+                self._flush(key)
+            self._cond.notify()
+        return future
+
+    def _flush(self, key):
+        """Hand the pending batch for key to a worker; caller holds the lock"""
+        _, batch, context = self._pending.pop(key)
+        self.batches += 1
+        self.items += len(batch)
+        batch_size.observe(len(batch))
+        for bucket in BATCH_SIZE_BUCKETS:
+            if len(batch) <= bucket:
+                self._histogram[bucket] += 1
+                break
+        else:
+            self._histogram['+Inf'] += 1
+        self._executor.submit(context.run, self._send, key, batch)
+
+    def _send(self, key, batch):
+        try:
+            results = self.send_batch(key, [item for item, _ in batch])
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
+        except Exception as e:
+            logger.error(f"Batch of {len(batch)} failed: {str(e)}")
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+
+    def _collect(self):
+        while True:
+            with self._cond:
+                if not self._pending:
+                    self._cond.wait()
+                    continue
+                now = time.monotonic()
+                due = [key for key, (first, _, _) in self._pending.items() if now - first >= self.window]
+                for key in due:
+                    self._flush(key)
+                if self._pending:
+                    oldest = min(first for first, _, _ in self._pending.values())
+                    self._cond.wait(max(oldest + self.window - now, 0.001))
+
+    def stats(self):
+        with self._cond:
+            return {
+                'batches': self.batches,
+                'items': self.items,
+                'mean_batch_size': round(self.items / self.batches, 2) if self.batches else 0,
+                'window_ms': round(self.window * 1000, 1),
+                'max_batch': self.max_batch,
+                'batch_size_histogram': {str(k): v for k, v in self._histogram.items()}
+            }
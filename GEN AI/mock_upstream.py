@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+"""
+Offline stand-in for the IBM Granite, Watsonx and Watson TTS APIs
+Answers the same endpoints the backends call, with configurable latency,
+error rate and token throughput, and counts every call under GET /stats:
+
+    python mock_upstream.py --port 8900 --latency-ms 200 --tokens-per-second 50
+    set IBM_GRANITE_URL=http://localhost:8900
+"""
+
+import os
+import json
+import time
+import random
+import logging
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import local_tts
+
+logger = logging.getLogger(__name__)
+
+GRANITE_PATH = '/text/generation'
+GRANITE_STREAM_PATH = '/text/generation_stream'
+WATSONX_PATH = '/ml/v1-beta/generation/text'
+TTS_PATH = '/v1/synthesize'
+
+FILLER = ('the narrator pauses as morning light settles over the quiet harbour '
+          'and every listener leans a little closer to hear what happens next').split()
+
+
+class MockConfig:
+    def __init__(self):
+        self.latency_ms = float(os.getenv('MOCK_LATENCY_MS', '100'))
+        self.jitter_ms = float(os.getenv('MOCK_JITTER_MS', '0'))
+        self.error_rate = float(os.getenv('MOCK_ERROR_RATE', '0'))
+        self.error_status = int(os.getenv('MOCK_ERROR_STATUS', '503'))
+        self.retry_after = os.getenv('MOCK_RETRY_AFTER', '')
+        self.tokens_per_second = float(os.getenv('MOCK_TOKENS_PER_SECOND', '0'))   # 0 = instant
+        self.output_tokens = int(os.getenv('MOCK_OUTPUT_TOKENS', '64'))
+        self.seed = os.getenv('MOCK_SEED')
+
+
+class MockStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.endpoints = {}
+            self.in_flight = 0
+            self.max_in_flight = 0
+            self.started = time.time()
+
+    def begin(self, path):
+        with self._lock:
+            entry = self.endpoints.setdefault(path, {'calls': 0, 'errors': 0, 'inputs': 0, 'tokens': 0})
+            entry['calls'] += 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            return entry
+
+    def end(self, entry, error=False, inputs=0, tokens=0):
+        with self._lock:
+            self.in_flight -= 1
+            entry['errors'] += 1 if error else 0
+            entry['inputs'] += inputs
+            entry['tokens'] += tokens
+
+    def snapshot(self):
+        with self._lock:
+            endpoints = {path: dict(entry) for path, entry in self.endpoints.items()}
+            return {
+                'total_calls': sum(e['calls'] for e in endpoints.values()),
+                'total_errors': sum(e['errors'] for e in endpoints.values()),
+                'endpoints': endpoints,
+                'in_flight': self.in_flight,
+                'max_in_flight': self.max_in_flight,
+                'since': self.started
+            }
+
+
+def mock_text(prompt, tokens):
+    """Deterministic filler text; prompts asking for chapters get chapter headings"""
+    words = [FILLER[i % len(FILLER)] for i in range(tokens)]
+    if 'Chapter 1:' in prompt or 'chapters' in prompt.lower():
+        per_chapter = max(1, len(words) // 5)
+        return '\n'.join(
+            f"Chapter {n + 1}: Part {n + 1}\n" + ' '.join(words[n * per_chapter:(n + 1) * per_chapter]) + '.'
+            for n in range(5)
+        )
+    return ' '.join(words).capitalize() + '.'
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    config = MockConfig()
+    stats = MockStats()
+    random = random.Random()
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+    def _send(self, status, body, content_type='application/json', headers=None):
+        if isinstance(body, (dict, list)):
+            body = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_json(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return json.loads(self.rfile.read(length) or b'{}')
+
+    def _delay(self, tokens=0):
+        config = self.config
+        delay = config.latency_ms + self.random.uniform(0, config.jitter_ms)
+        if config.tokens_per_second > 0:
+            delay += 1000 * tokens / config.tokens_per_second
+        time.sleep(delay / 1000)
+
+    def _fail(self):
+        """Inject an upstream error at the configured rate"""
+        if self.random.random() >= self.config.error_rate:
+            return False
+        headers = {'Retry-After': self.config.retry_after} if self.config.retry_after else None
+        self._send(self.config.error_status, {'error': 'injected failure'}, headers=headers)
+        return True
+
+    def do_GET(self):
+        if urlsplit(self.path).path == '/stats':
+            self._send(200, self.stats.snapshot())
+        else:
+            self._send(404, {'error': 'Not found'})
+
+    def do_POST(self):
+        path = urlsplit(self.path).path
+        if path == '/stats/reset':
+            self.stats.reset()
+            self._send(200, {'reset': True})
+            return
+        if path not in (GRANITE_PATH, GRANITE_STREAM_PATH, WATSONX_PATH, TTS_PATH):
+            self._send(404, {'error': 'Not found'})
+            return
+
+        entry = self.stats.begin(path)
+        error, inputs, tokens = False, 0, 0
+        try:
+            body = self._read_json()
+            if self._fail():
+                error = True
+            elif path == GRANITE_STREAM_PATH:
+                inputs, tokens = 1, self._generation_stream(body)
+            elif path == TTS_PATH:
+                inputs, tokens = 1, self._synthesize(body)
+            else:
+                inputs, tokens = self._generation(body)
+        finally:
+            self.stats.end(entry, error, inputs, tokens)
+
+    def _max_tokens(self, body):
+        requested = body.get('parameters', {}).get('max_new_tokens') or self.config.output_tokens
+        return min(int(requested), self.config.output_tokens)
+
+    def _generation(self, body):
+        # Granite accepts either 'input' or a batch of 'inputs'
+        prompts = body['inputs'] if 'inputs' in body else [body.get('input', '')]
+        tokens = self._max_tokens(body)
+        self._delay(tokens)
+        results = [{
+            'generated_text': mock_text(prompt, tokens),
+            'token_count': tokens,
+            'generated_token_count': tokens,
+            'stop_reason': 'max_tokens'
+        } for prompt in prompts]
+        self._send(200, {'model_id': body.get('model_id'), 'results': results})
+        return len(prompts), tokens * len(prompts)
+
+    def _generation_stream(self, body):
+        tokens = self._max_tokens(body)
+        words = mock_text(body.get('input', ''), tokens).split(' ')
+        self._delay()     # time to first token
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        interval = 1 / self.config.tokens_per_second if self.config.tokens_per_second > 0 else 0
+        for index, word in enumerate(words):
+            text = word if index == 0 else ' ' + word
+            event = 'data: ' + json.dumps({'results': [{'generated_text': text, 'generated_token_count': 1}]})
+            self._chunk(f'{event}\n\n'.encode('utf-8'))
+            if interval:
+                time.sleep(interval)
+        self._chunk(b'data: [DONE]\n\n')
+        self.wfile.write(b'0\r\n\r\n')
+        return len(words)
+
+    def _chunk(self, data):
+        self.wfile.write(b'%x\r\n%s\r\n' % (len(data), data))
+        self.wfile.flush()
+
+    def _synthesize(self, body):
+        text = body.get('text', '')
+        accept = self.headers.get('Accept', 'audio/mp3')
+        # Treat one "token" per word so synthesis time scales with the text
+        words = len(text.split())
+        self._delay(words)
+        if 'wav' in accept:
+            query = parse_qs(urlsplit(self.path).query)
+            speed = 1 + float(query.get('rate_percentage', ['0'])[0]) / 100
+            audio = local_tts.synthesize_wav(text, speed)
+        else:
+            # Not decodable audio, only sized like ~1 second per 2.5 words at 32 kbit/s
+            audio = b'\xff\xf3' + bytes(max(16, words * 1600))
+        self._send(200, audio, content_type=accept)
+        return words
+
+
+def serve(host='127.0.0.1', port=8900, config=None):
+    """Start the mock in a background thread; returns the server"""
+    if config is not None:
+        MockHandler.config = config
+    if MockHandler.config.seed is not None:
+        MockHandler.random.seed(MockHandler.config.seed)
+    server = ThreadingHTTPServer((host, port), MockHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='mock-upstream', daemon=True).start()
+    return server
+
+
+if __name__ == '__main__':
+    defaults = MockConfig()
+    parser = argparse.ArgumentParser(description='Mock IBM Granite / Watsonx / Watson TTS server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8900)
+    parser.add_argument('--latency-ms', type=float, default=defaults.latency_ms)
+    parser.add_argument('--jitter-ms', type=float, default=defaults.jitter_ms)
+    parser.add_argument('--error-rate', type=float, default=defaults.error_rate, help='fraction of calls that fail')
+    parser.add_argument('--error-status', type=int, default=defaults.error_status)
+    parser.add_argument('--retry-after', default=defaults.retry_after, help='Retry-After value sent with errors')
+    parser.add_argument('--tokens-per-second', type=float, default=defaults.tokens_per_second)
+    parser.add_argument('--output-tokens', type=int, default=defaults.output_tokens)
+    parser.add_argument('--seed', default=defaults.seed)
+    args = parser.parse_args()
+
+    config = MockConfig()
+    for name in ('latency_ms', 'jitter_ms', 'error_rate', 'error_status', 'retry_after',
+                 'tokens_per_second', 'output_tokens', 'seed'):
+        setattr(config, name, getattr(args, name))
+
+    logging.basicConfig(level=logging.INFO)
+    server = serve(args.host, args.port, config)
+    print(f"Mock upstream listening on http://{args.host}:{server.server_port}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,332 @@
+#!/usr/bin/env python3
+"""
+Persistent book/project store
+Keeps books, their chapters and per-chapter content hashes in SQLite along
+with derived artifacts (enhanced text, analysis, audio ids). Artifacts are
+tied to the hash of the chapter they came from, so after an edit only the
+chapters whose content changed need to be processed again
+"""
+
+import os
+import json
+import time
+import uuid
+import sqlite3
+import hashlib
+import threading
+
+from text_chunker import map_chunks
+
+SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS books ('
+    'id TEXT PRIMARY KEY, title TEXT NOT NULL, version INTEGER NOT NULL, '
+    'created REAL NOT NULL, updated REAL NOT NULL)',
+    'CREATE TABLE IF NOT EXISTS chapters ('
+    'book_id TEXT NOT NULL, id TEXT NOT NULL, position INTEGER NOT NULL, title TEXT NOT NULL, '
+    'content TEXT NOT NULL, hash TEXT NOT NULL, updated REAL NOT NULL, '
+    'PRIMARY KEY (book_id, id))',
+    'CREATE TABLE IF NOT EXISTS artifacts ('
+    'book_id TEXT NOT NULL, chapter_id TEXT NOT NULL, kind TEXT NOT NULL, key TEXT NOT NULL, '
+    'source_hash TEXT NOT NULL, value TEXT NOT NULL, created REAL NOT NULL, '
+    'PRIMARY KEY (book_id, chapter_id, kind, key))',
+    'CREATE TABLE IF NOT EXISTS lexicons ('
+    'book_id TEXT PRIMARY KEY, entries TEXT NOT NULL, updated REAL NOT NULL)'
+)
+
+
+def content_hash(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+class ProjectNotFound(KeyError):
+    pass
+
+
+class VersionConflict(Exception):
+    pass
+
+
+class ProjectStore:
+    def __init__(self, db_path):
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        # Both backends may share one store file
+        self._db.execute('PRAGMA journal_mode=WAL')
+        for statement in SCHEMA:
+            self._db.execute(statement)
+        self._db.commit()
+        self._lock = threading.Lock()
+
+    def create_book(self, title, chapters):
+        """Store a new book from [{title, content}], returning its id"""
+        book_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock, self._db:
+            self._db.execute(
+                'INSERT INTO books (id, title, version, created, updated) VALUES (?, ?, 1, ?, ?)',
+                (book_id, title, now, now)
+            )
+            for position, chapter in enumerate(chapters):
+                self._insert_chapter(book_id, position, chapter.get('title', ''), chapter.get('content', ''), now)
+        return book_id
+
+    def append_chapter(self, book_id, title, content):
+        """Add a chapter after the last one, returning its id"""
+        now = time.time()
+        with self._lock, self._db:
+            if not self._db.execute('SELECT 1 FROM books WHERE id = ?', (book_id,)).fetchone():
+                raise ProjectNotFound(book_id)
+            position = self._db.execute(
+                'SELECT COUNT(*) FROM chapters WHERE book_id = ?', (book_id,)
+            ).fetchone()[0]
+            chapter_id = self._insert_chapter(book_id, position, title, content, now)
+            self._db.execute('UPDATE books SET updated = ? WHERE id = ?', (now, book_id))
+        return chapter_id
+
+    def _insert_chapter(self, book_id, position, title, content, now):
+        chapter_id = uuid.uuid4().hex[:12]
+        self._db.execute(
+            'INSERT INTO chapters (book_id, id, position, title, content, hash, updated) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (book_id, chapter_id, position, title, content, content_hash(content), now)
+        )
+        return chapter_id
+
+    def get_book(self, book_id, content=False):
+        """Book metadata and chapter list (ids, titles, hashes; content on request)"""
+        with self._lock:
+            book = self._db.execute(
+                'SELECT id, title, version, created, updated FROM books WHERE id = ?', (book_id,)
+            ).fetchone()
+            if book is None:
+                return None
+            # Content is only read when asked for, so listing a large book stays cheap
+            rows = self._db.execute(
+                'SELECT id, title, hash, length(content), ' + ('content' if content else 'NULL') + ' FROM chapters '
+                'WHERE book_id = ? ORDER BY position', (book_id,)
+            ).fetchall()
+            artifacts = self._db.execute(
+                'SELECT a.chapter_id, a.kind, a.key FROM artifacts a JOIN chapters c '
+                'ON c.book_id = a.book_id AND c.id = a.chapter_id AND c.hash = a.source_hash '
+                'WHERE a.book_id = ?', (book_id,)
+            ).fetchall()
+
+        fresh = {}
+        for chapter_id, kind, key in artifacts:
+            fresh.setdefault(chapter_id, []).append(f'{kind}:{key}')
+        chapters = []
+        for chapter_id, title, digest, length, text in rows:
+            chapter = {'id': chapter_id, 'title': title, 'hash': digest, 'length': length,
+                       'artifacts': sorted(fresh.get(chapter_id, []))}
+            if content:
+                chapter['content'] = text
+            chapters.append(chapter)
+        return {
+            'id': book[0],
+            'title': book[1],
+            'version': book[2],
+            'created': book[3],
+            'updated': book[4],
+            'chapters': chapters
+        }
+
+    def get_chapters(self, book_id):
+        """[{id, title, content, hash}] in book order"""
+        with self._lock:
+            if not self._db.execute('SELECT 1 FROM books WHERE id = ?', (book_id,)).fetchone():
+                raise ProjectNotFound(book_id)
+            rows = self._db.execute(
+                'SELECT id, title, content, hash FROM chapters WHERE book_id = ? ORDER BY position', (book_id,)
+            ).fetchall()
+        return [{'id': r[0], 'title': r[1], 'content': r[2], 'hash': r[3]} for r in rows]
+
+    def get_chapter(self, book_id, chapter_id):
+        with self._lock:
+            row = self._db.execute(
+                'SELECT id, title, content, hash, position FROM chapters WHERE book_id = ? AND id = ?',
+                (book_id, chapter_id)
+            ).fetchone()
+        if row is None:
+            return None
+        return {'id': row[0], 'title': row[1], 'content': row[2], 'hash': row[3], 'position': row[4]}
+
+    def apply_changes(self, book_id, changes, base_version=None):
+        """Apply chapter-level edits in one transaction.
+
+        Each change is {'op': 'update', 'id', 'title'?, 'content'?, 'patch'?},
+        {'op': 'insert', 'after'?, 'title', 'content'} or {'op': 'delete', 'id'}.
+        A patch {'start', 'end', 'text'} replaces that character range of the
+        chapter, so a one-paragraph edit only uploads the paragraph.
+        """
+        now = time.time()
+        changed, inserted, deleted, unchanged = [], [], [], []
+        with self._lock, self._db:
+            row = self._db.execute('SELECT version FROM books WHERE id = ?', (book_id,)).fetchone()
+            if row is None:
+                raise ProjectNotFound(book_id)
+            if base_version is not None and int(base_version) != row[0]:
+                raise VersionConflict(f"Book is at version {row[0]}, not {base_version}")
+
+            order = [r[0] for r in self._db.execute(
+                'SELECT id FROM chapters WHERE book_id = ? ORDER BY position', (book_id,)
+            )]
+            for change in changes:
+                op = change.get('op', 'update')
+                if op == 'insert':
+                    after = change.get('after')
+                    if after is not None and after not in order:
+                        raise ValueError(f"Unknown chapter: {after}")
+                    chapter_id = self._insert_chapter(
+                        book_id, len(order), change.get('title', ''), change.get('content', ''), now
+                    )
+                    order.insert(order.index(after) + 1 if after is not None else 0, chapter_id)
+                    inserted.append(chapter_id)
+                    continue
+
+                chapter_id = change.get('id')
+                if chapter_id not in order:
+                    raise ValueError(f"Unknown chapter: {chapter_id}")
+                if op == 'delete':
+                    self._db.execute('DELETE FROM chapters WHERE book_id = ? AND id = ?', (book_id, chapter_id))
+                    self._db.execute('DELETE FROM artifacts WHERE book_id = ? AND chapter_id = ?', (book_id, chapter_id))
+                    order.remove(chapter_id)
+                    deleted.append(chapter_id)
+                elif op == 'update':
+                    if self._update_chapter(book_id, chapter_id, change, now):
+                        changed.append(chapter_id)
+                    else:
+                        unchanged.append(chapter_id)
+                else:
+                    raise ValueError(f"Unknown change op: {op}")
+
+            self._db.executemany(
+                'UPDATE chapters SET position = ? WHERE book_id = ? AND id = ?',
+                [(position, book_id, chapter_id) for position, chapter_id in enumerate(order)]
+            )
+            version = row[0] + (1 if changed or inserted or deleted else 0)
+            self._db.execute('UPDATE books SET version = ?, updated = ? WHERE id = ?', (version, now, book_id))
+
+        return {
+            'version': version,
+            'changed': changed,
+            'inserted': inserted,
+            'deleted': deleted,
+            'unchanged': [c for c in unchanged if c not in changed]
+        }
+
+    def _update_chapter(self, book_id, chapter_id, change, now):
+        """Apply one update; True when the chapter's content hash changed"""
+        title, content, digest = self._db.execute(
+            'SELECT title, content, hash FROM chapters WHERE book_id = ? AND id = ?', (book_id, chapter_id)
+        ).fetchone()
+        if 'content' in change:
+            content = change['content']
+        patch = change.get('patch')
+        if patch:
+            start, end = int(patch['start']), int(patch['end'])
+            if not 0 <= start <= end <= len(content):
+                raise ValueError(f"Patch range {start}-{end} outside chapter {chapter_id}")
+            content = content[:start] + patch.get('text', '') + content[end:]
+        title = change.get('title', title)
+        new_digest = content_hash(content)
+        self._db.execute(
+            'UPDATE chapters SET title = ?, content = ?, hash = ?, updated = ? WHERE book_id = ? AND id = ?',
+            (title, content, new_digest, now, book_id, chapter_id)
+        )
+        if new_digest != digest:
+            # Artifacts of the old text can never be served again
+            self._db.execute(
+                'DELETE FROM artifacts WHERE book_id = ? AND chapter_id = ? AND source_hash != ?',
+                (book_id, chapter_id, new_digest)
+            )
+            return True
+        return False
+
+    def get_artifact(self, book_id, chapter_id, kind, key, source_hash):
+        """Artifact value if it was derived from content with source_hash"""
+        with self._lock:
+            row = self._db.execute(
+                'SELECT value FROM artifacts WHERE book_id = ? AND chapter_id = ? AND kind = ? '
+                'AND key = ? AND source_hash = ?', (book_id, chapter_id, kind, key, source_hash)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put_artifact(self, book_id, chapter_id, kind, key, source_hash, value):
+        with self._lock, self._db:
+            self._db.execute(
+                'INSERT OR REPLACE INTO artifacts (book_id, chapter_id, kind, key, source_hash, value, created) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (book_id, chapter_id, kind, key, source_hash, json.dumps(value), time.time())
+            )
+
+    def get_lexicon(self, book_id):
+        """The book's pronunciation lexicon {phrase: pronunciation}, empty when none is set"""
+        with self._lock:
+            if not self._db.execute('SELECT 1 FROM books WHERE id = ?', (book_id,)).fetchone():
+                raise ProjectNotFound(book_id)
+            row = self._db.execute('SELECT entries FROM lexicons WHERE book_id = ?', (book_id,)).fetchone()
+        return json.loads(row[0]) if row else {}
+
+    def put_lexicon(self, book_id, entries):
+        with self._lock, self._db:
+            if not self._db.execute('SELECT 1 FROM books WHERE id = ?', (book_id,)).fetchone():
+                raise ProjectNotFound(book_id)
+            self._db.execute(
+                'INSERT OR REPLACE INTO lexicons (book_id, entries, updated) VALUES (?, ?, ?)',
+                (book_id, json.dumps(entries, ensure_ascii=False), time.time())
+            )
+
+    def rename_book(self, book_id, title):
+        with self._lock, self._db:
+            self._db.execute('UPDATE books SET title = ?, updated = ? WHERE id = ?', (title, time.time(), book_id))
+
+    def delete_book(self, book_id):
+        with self._lock, self._db:
+            found = self._db.execute('DELETE FROM books WHERE id = ?', (book_id,)).rowcount
+            self._db.execute('DELETE FROM chapters WHERE book_id = ?', (book_id,))
+            self._db.execute('DELETE FROM artifacts WHERE book_id = ?', (book_id,))
+            self._db.execute('DELETE FROM lexicons WHERE book_id = ?', (book_id,))
+        return bool(found)
+
+    def stats(self):
+        with self._lock:
+            return {
+                table: self._db.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+                for table in ('books', 'chapters', 'artifacts', 'lexicons')
+            }
+
+
+def request_text(store, data):
+    """A request's text: inline 'text', or the stored chapter named by project_id and chapter_id"""
+    chapter_id = data.get('chapter_id')
+    if not chapter_id:
+        return data.get('text', '')
+    chapter = store.get_chapter(data.get('project_id', ''), chapter_id)
+    if chapter is None:
+        raise ProjectNotFound(chapter_id)
+    return chapter['content']
+
+
+def process_chapters(store, book_id, kind, key, compute, workers, chapter_ids=None, valid=None):
+    """Run compute(chapter) -> (value, ok) for chapters without a fresh artifact.
+
+    Returns [(chapter, value, reused)] in book order, limited to chapter_ids
+    when given; successful values are stored against the chapter's current hash.
+    A stored value that valid(value) rejects (e.g. evicted audio) is recomputed.
+    """
+    def run(chapter):
+        value = store.get_artifact(book_id, chapter['id'], kind, key, chapter['hash'])
+        if value is not None and (valid is None or valid(value)):
+            return chapter, value, True
+        value, ok = compute(chapter)
+        if ok:
+            store.put_artifact(book_id, chapter['id'], kind, key, chapter['hash'], value)
+        return chapter, value, False
+
+    chapters = store.get_chapters(book_id)
+    if chapter_ids is not None:
+        wanted = set(chapter_ids)
+        chapters = [chapter for chapter in chapters if chapter['id'] in wanted]
+    return map_chunks(run, chapters, workers)
+
+
+project_store = ProjectStore(os.getenv('PROJECTS_DB', 'projects.db'))
@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+"""
+Adaptive limiter for outbound LLM/TTS calls
+Combines a token bucket (request rate) with an AIMD concurrency limit that
+halves on 429/503 and grows back slowly on success. Waiting calls are
+queued per client and served round-robin, so one busy client cannot
+starve the others.
+"""
+
+import os
+import time
+import asyncio
+import logging
+import threading
+import contextvars
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+
+logger = logging.getLogger(__name__)
+
+THROTTLE_STATUSES = (429, 503)
+
+current_client = contextvars.ContextVar('upstream_client', default='default')
+
+
+def set_client(client_id):
+    """Attribute outbound calls made from the current context to client_id"""
+    current_client.set(client_id or 'default')
+
+
+def parse_retry_after(value):
+    """Seconds to wait from a Retry-After header (delta-seconds or HTTP date)"""
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+class LimiterTimeout(Exception):
+    pass
+
+
+class LimiterConfig:
+    def __init__(self):
+        self.rate = float(os.getenv('UPSTREAM_RATE', '0'))              # requests/sec, 0 = unlimited
+        self.burst = float(os.getenv('UPSTREAM_BURST', '10'))
+        self.initial_limit = float(os.getenv('UPSTREAM_CONCURRENCY', '16'))
+        self.min_limit = float(os.getenv('UPSTREAM_MIN_CONCURRENCY', '1'))
+        self.max_limit = float(os.getenv('UPSTREAM_MAX_CONCURRENCY', '256'))
+        self.queue_timeout = float(os.getenv('UPSTREAM_QUEUE_TIMEOUT', '60'))
+
+
+class _Waiter:
+    __slots__ = ('client', 'granted', 'callback')
+
+    def __init__(self, client, callback=None):
+        self.client = client
+        self.granted = False
+        self.callback = callback
+
+
+class AdaptiveLimiter:
+    def __init__(self, config=None):
+        self.config = config or LimiterConfig()
+        self.limit = self.config.initial_limit
+        self.tokens = self.config.burst
+        self.in_flight = 0
+        self.blocked_until = 0.0
+        self.granted = 0
+        self.throttled = 0
+        self.timeouts = 0
+        self._last_refill = time.monotonic()
+        self._last_decrease = 0.0
+        self._queues = OrderedDict()
+        self._cond = threading.Condition()
+        self._timer = None
+
+    def _refill(self, now):
+        self.tokens = min(self.config.burst, self.tokens + (now - self._last_refill) * self.config.rate)
+        self._last_refill = now
+
+    def _schedule(self, delay):
+        # One timer re-runs dispatch once tokens refill or Retry-After passes
+        if self._timer is None:
+            self._timer = threading.Timer(max(delay, 0.001), self._on_timer)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _on_timer(self):
+        with self._cond:
+            self._timer = None
+            self._dispatch()
+
+    def _dispatch(self):
+        """Grant queued calls while capacity allows; caller holds the lock"""
+        granted = False
+        now = time.monotonic()
+        while self._queues and self.in_flight < int(self.limit):
+            if now < self.blocked_until:
+                self._schedule(self.blocked_until - now)
+                break
+            if self.config.rate > 0:
+                self._refill(now)
+                if self.tokens < 1:
+                    self._schedule((1 - self.tokens) / self.config.rate)
+                    break
+                self.tokens -= 1
+
+            client, queue = next(iter(self._queues.items()))
+            waiter = queue.popleft()
+            if queue:
+                self._queues.move_to_end(client)
+            else:
+                del self._queues[client]
+
+            self.in_flight += 1
+            self.granted += 1
+            waiter.granted = True
+            granted = True
+            if waiter.callback is not None:
+                waiter.callback()
+
+        if granted:
+            self._cond.notify_all()
+
+    def _enqueue(self, client, callback=None):
+        waiter = _Waiter(client or current_client.get(), callback)
+        self._queues.setdefault(waiter.client, deque()).append(waiter)
+        self._dispatch()
+        return waiter
+
+    def _abandon(self, waiter):
+        queue = self._queues.get(waiter.client)
+        if queue is not None and waiter in queue:
+            queue.remove(waiter)
+            if not queue:
+                del self._queues[waiter.client]
+        self.timeouts += 1
+
+    def acquire(self, client=None):
+        """Block until a call may be sent upstream"""
+        deadline = time.monotonic() + self.config.queue_timeout
+        with self._cond:
+            waiter = self._enqueue(client)
+            while not waiter.granted:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._abandon(waiter)
+                    raise LimiterTimeout('Timed out waiting for upstream capacity')
+                self._cond.wait(remaining)
+
+    async def acquire_async(self, client=None):
+        """asyncio variant of acquire() that waits without holding a thread"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def wake():
+            loop.call_soon_threadsafe(lambda: future.done() or future.set_result(True))
+
+        with self._cond:
+            waiter = self._enqueue(client, wake)
+            if waiter.granted:
+                return
+        try:
+            await asyncio.wait_for(asyncio.shield(future), self.config.queue_timeout)
+        except asyncio.TimeoutError:
+            with self._cond:
+                if waiter.granted:
+                    # Granted just as the wait expired
+                    return
+                self._abandon(waiter)
+            raise LimiterTimeout('Timed out waiting for upstream capacity')
+        except BaseException:
+            # Cancelled: give back a slot granted in the meantime
+            with self._cond:
+                if waiter.granted:
+                    self.in_flight -= 1
+                    self._dispatch()
+                else:
+                    self._abandon(waiter)
+            raise
+
+    def release(self, status=None, retry_after=None, throttled=False):
+        """Return a slot and adapt the limit to how upstream answered"""
+        with self._cond:
+            self.in_flight -= 1
+            now = time.monotonic()
+            if throttled or status in THROTTLE_STATUSES:
+                self.throttled += 1
+                # A burst of 429s from one overload halves the limit once, not per response
+                if now - self._last_decrease >= 1.0:
+                    self.limit = max(self.config.min_limit, self.limit / 2)
+                    self._last_decrease = now
+                if retry_after:
+                    self.blocked_until = max(self.blocked_until, now + retry_after)
+                logger.warning(f"Upstream throttled ({status}); concurrency limit now {int(self.limit)}")
+            elif status is not None and status < 500:
+                # Additive increase: roughly +1 per limit's worth of successes
+                self.limit = min(self.config.max_limit, self.limit + 1 / self.limit)
+            self._dispatch()
+
+    @contextmanager
+    def slot(self, client=None):
+        """Hold one upstream slot; fill the yielded dict with status/retry_after/throttled"""
+        self.acquire(client)
+        outcome = {}
+        try:
+            yield outcome
+        finally:
+            self.release(**outcome)
+
+    def stats(self):
+        with self._cond:
+            return {
+                'limit': int(self.limit),
+                'in_flight': self.in_flight,
+                'queue_depth': sum(len(q) for q in self._queues.values()),
+                'queued_clients': len(self._queues),
+                'rate_per_second': self.config.rate or None,
+                'blocked_for_seconds': round(max(self.blocked_until - time.monotonic(), 0), 3),
+                'granted': self.granted,
+                'throttled': self.throttled,
+                'timeouts': self.timeouts
+            }
+
+
+upstream_limiter = AdaptiveLimiter()
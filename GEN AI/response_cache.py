@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+Content-addressed cache for LLM responses
+In-memory LRU tier in front of an optional SQLite tier with TTL and size eviction
+"""
+
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class CacheConfig:
+    def __init__(self):
+        self.max_entries = int(os.getenv('GRANITE_CACHE_SIZE', '512'))
+        self.ttl = float(os.getenv('GRANITE_CACHE_TTL', '86400'))
+        self.db_path = os.getenv('GRANITE_CACHE_DB', '')
+        self.db_max_bytes = int(os.getenv('GRANITE_CACHE_DB_MAX_BYTES', str(256 * 1024 * 1024)))
+
+
+def make_cache_key(endpoint, prompt, model_id, temperature, max_tokens):
+    """Hash everything that influences the generated text"""
+    material = json.dumps(
+        [endpoint, prompt, model_id, temperature, max_tokens],
+        ensure_ascii=False, separators=(',', ':')
+    )
+    return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    def __init__(self, config=None):
+        self.config = config or CacheConfig()
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        if self.config.db_path:
+            self._db = sqlite3.connect(self.config.db_path, check_same_thread=False)
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS responses ('
+                'key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, '
+                'created REAL NOT NULL, accessed REAL NOT NULL)'
+            )
+            self._db.execute('CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)')
+            self._db.commit()
+
+    def _expired(self, created, now):
+        return self.config.ttl > 0 and now - created > self.config.ttl
+
+    def get(self, key):
+        """Return the cached value for key, or None"""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                created, value = entry
+                if not self._expired(created, now):
+                    self._memory.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._memory[key]
+
+            if self._db is not None:
+                row = self._db.execute(
+                    'SELECT value, created FROM responses WHERE key = ?', (key,)
+                ).fetchone()
+                if row is not None:
+                    if not self._expired(row[1], now):
+                        self._db.execute('UPDATE responses SET accessed = ? WHERE key = ?', (now, key))
+                        self._db.commit()
+                        value = json.loads(row[0])
+                        self._remember(key, row[1], value)
+                        self.hits += 1
+                        self.disk_hits += 1
+                        return value
+                    self._db.execute('DELETE FROM responses WHERE key = ?', (key,))
+                    self._db.commit()
+
+            self.misses += 1
+            return None
+
+    def set(self, key, value):
+        now = time.time()
+        with self._lock:
+            self._remember(key, now, value)
+            if self._db is not None:
+                encoded = json.dumps(value)
+                self._db.execute(
+                    'INSERT OR REPLACE INTO responses (key, value, size, created, accessed) '
+                    'VALUES (?, ?, ?, ?, ?)',
+                    (key, encoded, len(encoded), now, now)
+                )
+                self._evict_disk(now)
+                self._db.commit()
+
+    def _remember(self, key, created, value):
+        self._memory[key] = (created, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.config.max_entries:
+            self._memory.popitem(last=False)
+
+    def _evict_disk(self, now):
+        """Drop expired rows, then least recently used rows over the size cap"""
+        if self.config.ttl > 0:
+            self._db.execute('DELETE FROM responses WHERE created < ?', (now - self.config.ttl,))
+
+        total = self._db.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+        if total <= self.config.db_max_bytes:
+            return
+        for key, size in self._db.execute(
+            'SELECT key, size FROM responses ORDER BY accessed'
+        ).fetchall():
+            self._db.execute('DELETE FROM responses WHERE key = ?', (key,))
+            total -= size
+            if total <= self.config.db_max_bytes:
+                break
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._memory),
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0,
+                'disk_enabled': self._db is not None
+            }
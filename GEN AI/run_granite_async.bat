@@ -0,0 +1,11 @@
+@echo off
+echo Installing Python dependencies for the async Granite server...
+pip install -r requirements_async.txt
+
+echo.
+echo Starting AI Audiobook Creator (IBM Granite, async mode)...
+rem Upstream connections per worker; the upstream limiter is sized to match
+rem unless UPSTREAM_CONCURRENCY / UPSTREAM_MAX_CONCURRENCY are set
+if not defined GRANITE_ASYNC_MAX_CONNECTIONS set GRANITE_ASYNC_MAX_CONNECTIONS=1000
+python backend_granite_async.py --workers 4
+pause
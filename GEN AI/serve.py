@@ -1,24 +1,193 @@
 #!/usr/bin/env python3
-import http.server
-import socketserver
-import webbrowser
+"""
+Static server for the audiobook front end
+Threaded, so one slow client no longer blocks the others. Text assets are
+precompressed at startup (gzip, plus brotli when installed) and every file
+is served with ETag/Last-Modified validators, Cache-Control and byte-range
+support (sample books, generated audio):
+
+    python serve.py --port 8000 --no-browser
+"""
+
 import os
+import argparse
+import mimetypes
+import webbrowser
+import http.server
+from email.utils import formatdate, parsedate_to_datetime
 
+from static_assets import DEFAULT_MAX_AGE, StaticAssets, cache_control
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
 PORT = 8000
+COPY_BLOCK = 64 * 1024
+
+
+def parse_range(header, size):
+    """(start, end) inclusive for a single 'bytes=' range; None to ignore, False if unsatisfiable"""
+    if not header or not header.startswith('bytes=') or ',' in header:
+        return None     # absent, other units or multipart ranges: send the whole file
+    first, _, last = header[6:].strip().partition('-')
+    try:
+        if first:
+            start = int(first)
+            end = min(int(last), size - 1) if last else size - 1
+        else:
+            length = int(last)
+            if length == 0:
+                return False
+            start, end = max(size - length, 0), size - 1
+    except ValueError:
+        return None
+    if start >= size or start > end:
+        return False
+    return start, end
+
+
+def etag_matches(header, etag):
+    if header is None:
+        return False
+    if header.strip() == '*':
+        return True
+    tags = [tag.strip() for tag in header.split(',')]
+    return etag in tags or f'W/{etag}' in tags
+
 
 class Handler(http.server.SimpleHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    assets = None
+    max_age = DEFAULT_MAX_AGE
+
     def __init__(self, *args, **kwargs):
-        super().__init__(*args, directory=os.path.dirname(os.path.abspath(__file__)), **kwargs)
+        super().__init__(*args, directory=ROOT, **kwargs)
 
-print(f"🎧 AI Audiobook Creator")
-print(f"📡 Starting server at http://localhost:{PORT}")
-print(f"🌐 Opening browser...")
+    def do_GET(self):
+        self.serve(send_body=True)
 
-with socketserver.TCPServer(("", PORT), Handler) as httpd:
-    webbrowser.open(f'http://localhost:{PORT}/standalone.html')
-    print(f"✅ Server running. Press Ctrl+C to stop.")
-    try:
-        httpd.serve_forever()
-    except KeyboardInterrupt:
-        print(f"\n🛑 Server stopped.")
-        httpd.shutdown()
\ No newline at end of file
+    def do_HEAD(self):
+        self.serve(send_body=False)
+
+    def serve(self, send_body):
+        path = self.translate_path(self.path)
+        if os.path.isdir(path):
+            # Directory redirects, index.html and listings stay with the base class
+            f = self.send_head()
+            if f:
+                try:
+                    if send_body:
+                        self.copyfile(f, self.wfile)
+                finally:
+                    f.close()
+            return
+        if not os.path.isfile(path):
+            self.send_error(404, 'File not found')
+            return
+
+        asset = self.assets.get(os.path.relpath(path, ROOT)) if self.assets else None
+        if asset is not None and not self.headers.get('Range'):
+            body, headers = asset.select(self.headers.get('Accept-Encoding'))
+            self.respond(body, headers, asset.mimetype, asset.mtime, send_body)
+        else:
+            # Ranges, large, binary or newly generated files stream from disk
+            self.respond_file(path, send_body, f'"{asset.etag}"' if asset else None)
+
+    def not_modified(self, etag, mtime):
+        if self.headers.get('If-None-Match') is not None:
+            return etag_matches(self.headers['If-None-Match'], etag)
+        since = self.headers.get('If-Modified-Since')
+        if since:
+            try:
+                return int(mtime) <= parsedate_to_datetime(since).timestamp()
+            except (TypeError, ValueError):
+                return False
+        return False
+
+    def send_headers(self, status, headers, length=None):
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        if length is not None:
+            self.send_header('Content-Length', str(length))
+        self.end_headers()
+
+    def respond(self, body, headers, mimetype, mtime, send_body):
+        if self.not_modified(headers['ETag'], mtime):
+            self.send_headers(304, headers, 0)
+            return
+        self.send_headers(200, dict(headers, **{'Content-Type': mimetype}), len(body))
+        if send_body:
+            self.wfile.write(body)
+
+    def respond_file(self, path, send_body, etag=None):
+        stat = os.stat(path)
+        etag = etag or f'"{int(stat.st_mtime_ns):x}-{stat.st_size:x}"'
+        headers = {
+            'ETag': etag,
+            'Last-Modified': formatdate(stat.st_mtime, usegmt=True),
+            'Cache-Control': cache_control(path, self.max_age),
+            'Accept-Ranges': 'bytes'
+        }
+        if self.not_modified(etag, stat.st_mtime):
+            self.send_headers(304, headers, 0)
+            return
+
+        mimetype = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        headers['Content-Type'] = mimetype
+        size = stat.st_size
+        byte_range = None
+        if_range = self.headers.get('If-Range')
+        if if_range is None or if_range.strip() == etag:
+            byte_range = parse_range(self.headers.get('Range'), size)
+        if byte_range is False:
+            self.send_headers(416, dict(headers, **{'Content-Range': f'bytes */{size}'}), 0)
+            return
+
+        start, end = byte_range or (0, size - 1)
+        length = end - start + 1 if size else 0
+        if byte_range:
+            headers['Content-Range'] = f'bytes {start}-{end}/{size}'
+        self.send_headers(206 if byte_range else 200, headers, length)
+        if not send_body:
+            return
+        with open(path, 'rb') as f:
+            f.seek(start)
+            remaining = length
+            while remaining > 0:
+                data = f.read(min(COPY_BLOCK, remaining))
+                if not data:
+                    break
+                self.wfile.write(data)
+                remaining -= len(data)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve the audiobook front end')
+    parser.add_argument('--host', default='')
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--max-age', type=int, default=DEFAULT_MAX_AGE, help='Cache-Control max-age for non-HTML assets')
+    parser.add_argument('--page', default='standalone_fixed.html', help='page opened in the browser')
+    parser.add_argument('--no-browser', action='store_true')
+    args = parser.parse_args()
+
+    print(f"🎧 AI Audiobook Creator")
+    Handler.max_age = args.max_age
+    Handler.assets = StaticAssets(ROOT, max_age=args.max_age)
+    stats = Handler.assets.stats()
+    print(f"🗜️  Precompressed {stats['assets']} assets: {stats['bytes']} -> {stats['gzip_bytes']} bytes (gzip)"
+          + (" + brotli" if stats['brotli'] else ""))
+    print(f"📡 Starting server at http://localhost:{args.port}")
+
+    with http.server.ThreadingHTTPServer((args.host, args.port), Handler) as httpd:
+        httpd.daemon_threads = True
+        if not args.no_browser:
+            print(f"🌐 Opening browser...")
+            webbrowser.open(f'http://localhost:{args.port}/{args.page}')
+        print(f"✅ Server running. Press Ctrl+C to stop.")
+        try:
+            httpd.serve_forever()
+        except KeyboardInterrupt:
+            print(f"\n🛑 Server stopped.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+"""
+Single-flight request coalescing
+Concurrent callers with the same key share one upstream call and its result
+"""
+
+import threading
+from concurrent.futures import Future
+
+
+class SingleFlight:
+    def __init__(self):
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.executed = 0
+        self.coalesced = 0
+
+    def do(self, key, fn):
+        """Run fn() for key, or wait for the identical call already running"""
+        with self._lock:
+            self.calls += 1
+            future = self._inflight.get(key)
+            if future is not None:
+                self.coalesced += 1
+                leader = False
+            else:
+                future = Future()
+                self._inflight[key] = future
+                self.executed += 1
+                leader = True
+
+        if not leader:
+            return future.result()
+
+        try:
+            future.set_result(fn())
+        except BaseException as e:
+            future.set_exception(e)
+        finally:
+            with self._lock:
+                del self._inflight[key]
+        return future.result()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'calls': self.calls,
+                'executed': self.executed,
+                'coalesced': self.coalesced,
+                'in_flight': len(self._inflight)
+            }
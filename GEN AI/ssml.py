@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+"""
+SSML preprocessing with pronunciation lexicons
+A lexicon (phrase -> alias or phonetic spelling) and the rules for numbers,
+abbreviations, emphasis and dialogue pauses are compiled once into a single
+regex, so a sentence is converted in one left-to-right pass. Converted
+sentences are memoized by (sentence hash, preprocessor version): after a
+lexicon edit only sentences containing a changed entry produce new SSML,
+and only their audio has to be synthesized again
+"""
+
+import re
+import json
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from html import escape, unescape
+
+from tone_rewriter import compile_phrases
+
+logger = logging.getLogger(__name__)
+
+# Bump when the rules below change the SSML they produce
+RULES_VERSION = 2
+
+DEFAULT_ABBREVIATIONS = {
+    'Mr.': 'Mister',
+    'Mrs.': 'Missus',
+    'Ms.': 'Miz',
+    'Dr.': 'Doctor',
+    'Prof.': 'Professor',
+    'Mt.': 'Mount',
+    'Jr.': 'Junior',
+    'Sr.': 'Senior',
+    'Capt.': 'Captain',
+    'Lt.': 'Lieutenant',
+    'Col.': 'Colonel',
+    'Gen.': 'General',
+    'Sgt.': 'Sergeant',
+    'vs.': 'versus',
+    'etc.': 'et cetera',
+    'e.g.': 'for example',
+    'i.e.': 'that is',
+    'approx.': 'approximately'
+}
+# Abbreviations too ambiguous to expand everywhere: "No." is a word of its
+# own unless a number follows, and "St." may be Saint or Street
+NUMBER_SIGN = r'(?<!\w)No\.(?=[ \t]*\d)'
+
+PHONETIC_ALPHABETS = ('ipa', 'ibm')
+
+SUB_TAG = re.compile(r'<sub alias="([^"]*)">.*?</sub>', re.S)
+TAG = re.compile(r'<[^>]+>')
+
+
+def _digest(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def _bounded(pattern):
+    """Only match whole words, so 'Ann' never fires inside 'Anne'"""
+    return rf'(?<!\w)(?:{pattern})(?!\w)'
+
+
+class Lexicon:
+    """Pronunciations of one project.
+
+    Entries map a phrase to an alias ("Hermione": "her-my-oh-nee") or to a
+    phonetic spelling ({"ipa": "ˈdʒɪf"} or {"ibm": ".1Jif"}). All-lowercase
+    phrases match in any case; phrases with capitals match exactly, so "US"
+    and "us" can be told apart.
+    """
+
+    def __init__(self, entries=None):
+        if not isinstance(entries or {}, dict):
+            raise ValueError("Lexicon must be an object of {phrase: pronunciation}")
+        self.entries = {}
+        for phrase, value in (entries or {}).items():
+            phrase = phrase.strip()
+            if isinstance(value, str):
+                value = {'alias': value}
+            if (not phrase or not isinstance(value, dict) or len(value) != 1
+                    or next(iter(value)) not in ('alias',) + PHONETIC_ALPHABETS
+                    or not isinstance(next(iter(value.values())), str)):
+                raise ValueError(f"Invalid lexicon entry for {phrase!r}")
+            self.entries[phrase] = value
+        self.version = _digest(json.dumps(self.entries, sort_keys=True, ensure_ascii=False))[:16]
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class SSMLCache:
+    """Bounded LRU of converted sentences shared by every preprocessor"""
+
+    def __init__(self, max_entries=20000):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'hits': self.hits, 'misses': self.misses}
+
+
+sentence_cache = SSMLCache()
+
+
+class SSMLPreprocessor:
+    def __init__(self, lexicon=None, abbreviations=None, dialogue_pause_ms=300, paragraph_pause_ms=700,
+                 cache=sentence_cache):
+        self.lexicon = lexicon or Lexicon()
+        self.abbreviations = DEFAULT_ABBREVIATIONS if abbreviations is None else abbreviations
+        self.dialogue_pause = f'<break time="{int(dialogue_pause_ms)}ms"/>'
+        self.paragraph_pause = f'<break time="{int(paragraph_pause_ms)}ms"/>'
+        self.cache = cache
+        self.version = _digest(json.dumps(
+            [RULES_VERSION, self.lexicon.version, self.abbreviations, dialogue_pause_ms, paragraph_pause_ms],
+            sort_keys=True
+        ))[:16]
+
+        self._exact = {}
+        self._folded = {}
+        for phrase, value in self.lexicon.entries.items():
+            if phrase == phrase.lower():
+                self._folded[phrase] = value
+            else:
+                self._exact[phrase] = value
+
+        alternatives = []
+        exact = compile_phrases(self._exact)
+        if exact:
+            alternatives.append(rf'(?P<exact>{_bounded(exact.pattern)})')
+        folded = compile_phrases(self._folded)
+        if folded:
+            alternatives.append(rf'(?P<folded>{_bounded("(?i:" + folded.pattern + ")")})')
+        abbreviated = compile_phrases(self.abbreviations)
+        if abbreviated:
+            alternatives.append(rf'(?P<abbreviation>{_bounded(abbreviated.pattern)})')
+        alternatives += [
+            rf'(?P<number_sign>{NUMBER_SIGN})',
+            r'(?P<ordinal>(?<![\w.,])\d+(?:st|nd|rd|th)(?!\w))',
+            r'(?P<years>(?<![\w.,])\d{4}[-–]\d{4}(?!\w|[.,]\d))',
+            r'(?P<percent>(?<![\w.,])\d+(?:\.\d+)?%)',
+            r'(?P<grouped>(?<![\w.,])\d{1,3}(?:,\d{3})+(?:\.\d+)?(?![\w,]))',
+            r'(?P<emphasis>(?<!\w)\*(?=\S)[^*\n]+?(?<=\S)\*(?!\w)|(?<!\w)_(?=\S)[^_\n]+?(?<=\S)_(?!\w))',
+            # A straight quote opens after whitespace or a bracket and closes before it
+            r'(?P<open_quote>“|(?<![^\s(\[—-])"(?=\S))',
+            r'(?P<close_quote>”|(?<=\S)"(?![^\s,.;:!?)\]—-]))',
+            r'(?P<paragraph>\n[ \t]*\n\s*)'
+        ]
+        self._pattern = re.compile('|'.join(alternatives))
+
+        # Sentence ends, skipping the periods of abbreviations, dotted
+        # lexicon phrases and decimals so "Dr. Who" stays one sentence
+        protected = NUMBER_SIGN + '|'
+        dotted = compile_phrases([p for p in list(self.abbreviations) + list(self._exact) if '.' in p])
+        if dotted:
+            protected += _bounded(dotted.pattern) + '|'
+        dotted = compile_phrases([p for p in self._folded if '.' in p])
+        if dotted:
+            protected += _bounded('(?i:' + dotted.pattern + ')') + '|'
+        self._sentence = re.compile(
+            rf'(?:{protected}\d\.(?=\d)|[^.!?])*(?:[.!?]+["\'”’)\]]*|$)\s*'
+        )
+        logger.info(f"Compiled SSML rules: {len(self.lexicon)} lexicon entries, "
+                    f"{len(self.abbreviations)} abbreviations")
+
+    def sentences(self, text):
+        """Split text into sentences, each keeping its trailing whitespace"""
+        return [m.group(0) for m in self._sentence.finditer(text) if m.group(0)]
+
+    def convert(self, text):
+        """SSML document for text; unchanged sentences come from the cache"""
+        fragments = []
+        for sentence in self.sentences(text):
+            key = (self.version, _digest(sentence))
+            fragment = self.cache.get(key)
+            if fragment is None:
+                fragment = self._markup(sentence, sentence=True)
+                self.cache.put(key, fragment)
+            fragments.append(fragment)
+        return '<speak>' + ''.join(fragments).strip() + '</speak>'
+
+    def _markup(self, text, sentence=False):
+        pieces = []
+        position = 0
+        for match in self._pattern.finditer(text):
+            pieces.append(escape(text[position:match.start()], quote=False))
+            pieces.append(self._rule(match, text, sentence))
+            position = match.end()
+        pieces.append(escape(text[position:], quote=False))
+        return ''.join(pieces)
+
+    def _rule(self, match, text, sentence):
+        kind = match.lastgroup
+        value = match.group(0)
+        if kind in ('exact', 'folded', 'abbreviation'):
+            if kind == 'exact':
+                entry = self._exact[value]
+            elif kind == 'folded':
+                entry = self._folded[value.lower()]
+            else:
+                entry = {'alias': self.abbreviations[value]}
+            if 'alias' in entry:
+                return f'<sub alias="{escape(entry["alias"])}">{escape(value, quote=False)}</sub>'
+            alphabet, spelling = next(iter(entry.items()))
+            return f'<phoneme alphabet="{alphabet}" ph="{escape(spelling)}">{escape(value, quote=False)}</phoneme>'
+        if kind == 'number_sign':
+            return f'<sub alias="Number">{value}</sub>'
+        if kind == 'ordinal':
+            return f'<say-as interpret-as="ordinal">{value[:-2]}</say-as>'
+        if kind == 'years':
+            return f'{value[:4]} to {value[5:]}'
+        if kind == 'percent':
+            return f'{value[:-1]} percent'
+        if kind == 'grouped':
+            digits = value.replace(',', '')
+            return digits if '.' in digits else f'<say-as interpret-as="cardinal">{digits}</say-as>'
+        if kind == 'emphasis':
+            return f'<emphasis level="moderate">{self._markup(value[1:-1])}</emphasis>'
+        if kind == 'open_quote':
+            # A sentence boundary already pauses before dialogue that opens it
+            leading = sentence and not text[:match.start()].strip()
+            return escape(value, quote=False) if leading else self.dialogue_pause + escape(value, quote=False)
+        if kind == 'close_quote':
+            return escape(value, quote=False) + self.dialogue_pause
+        return self.paragraph_pause + '\n'
+
+
+def to_plain(markup):
+    """Text an SSML document speaks, for engines that cannot read SSML"""
+    return unescape(TAG.sub('', SUB_TAG.sub(lambda m: m.group(1), markup)))
+
+
+_preprocessors = OrderedDict()
+_preprocessors_lock = threading.Lock()
+
+
+def get_preprocessor(entries=None, **options):
+    """Compiled preprocessor for a lexicon, reused while the lexicon is unchanged"""
+    lexicon = Lexicon(entries)
+    key = (lexicon.version, json.dumps(options, sort_keys=True))
+    with _preprocessors_lock:
+        preprocessor = _preprocessors.get(key)
+        if preprocessor is not None:
+            _preprocessors.move_to_end(key)
+            return preprocessor
+    preprocessor = SSMLPreprocessor(lexicon, **options)
+    with _preprocessors_lock:
+        _preprocessors[key] = preprocessor
+        while len(_preprocessors) > 32:
+            _preprocessors.popitem(last=False)
+    return preprocessor
+
+
+def load_lexicon(path):
+    """Load {phrase: pronunciation} from a JSON file"""
+    with open(path, encoding='utf-8') as f:
+        entries = json.load(f)
+    Lexicon(entries)
+    return entries
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+Precompressed static assets
+Text assets (HTML, JS, CSS, SVG, TXT...) are read and compressed once with
+gzip (and brotli when the package is installed), then served with strong
+ETags, Last-Modified and Cache-Control. Used by serve.py and by the Flask
+index routes
+"""
+
+import os
+import gzip
+import hashlib
+import mimetypes
+import threading
+from email.utils import formatdate
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE = {'.html', '.htm', '.js', '.mjs', '.jsx', '.css', '.svg', '.txt', '.json', '.md', '.xml'}
+MIN_COMPRESS_BYTES = 512
+MAX_PRECOMPRESS_BYTES = 8 * 1024 * 1024
+SKIP_DIRS = {'node_modules', '__pycache__', 'audio_cache', 'exports'}
+
+# Pages are not fingerprinted, so browsers revalidate them (a cheap 304)
+# while other assets may be reused for STATIC_MAX_AGE seconds
+DEFAULT_MAX_AGE = int(os.getenv('STATIC_MAX_AGE', '604800'))
+PAGE_SUFFIXES = {'.html', '.htm'}
+
+
+def accepted_encodings(header):
+    """Content codings the client accepts (q > 0)"""
+    accepted = set()
+    for part in (header or '').split(','):
+        coding, _, params = part.strip().partition(';')
+        q = 1.0
+        for param in params.split(';'):
+            name, _, value = param.strip().partition('=')
+            if name == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if coding and q > 0:
+            accepted.add(coding.strip().lower())
+    return accepted
+
+
+def cache_control(path, max_age=DEFAULT_MAX_AGE):
+    if os.path.splitext(path)[1].lower() in PAGE_SUFFIXES:
+        return 'no-cache'
+    return f'public, max-age={max_age}'
+
+
+class Asset:
+    """One file held in memory as identity, gzip and (optionally) brotli bodies"""
+
+    def __init__(self, path, max_age=DEFAULT_MAX_AGE):
+        stat = os.stat(path)
+        with open(path, 'rb') as f:
+            data = f.read()
+        self.path = path
+        self.mtime = stat.st_mtime
+        self.size = len(data)
+        self.mimetype = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        if self.mimetype.startswith('text/') or self.mimetype in ('application/javascript', 'image/svg+xml'):
+            self.mimetype += '; charset=utf-8'
+        self.etag = hashlib.sha256(data).hexdigest()[:20]
+        self.cache_control = cache_control(path, max_age)
+        self.last_modified = formatdate(self.mtime, usegmt=True)
+        self.bodies = {'identity': data}
+        if len(data) >= MIN_COMPRESS_BYTES:
+            compressed = gzip.compress(data, compresslevel=9, mtime=0)
+            if len(compressed) < len(data):
+                self.bodies['gzip'] = compressed
+            if brotli is not None:
+                compressed = brotli.compress(data, quality=11)
+                if len(compressed) < len(data):
+                    self.bodies['br'] = compressed
+
+    def select(self, accept_encoding):
+        """(body, headers) of the smallest variant the client accepts"""
+        accepted = accepted_encodings(accept_encoding)
+        encoding = 'identity'
+        for candidate in ('br', 'gzip'):
+            if candidate in self.bodies and candidate in accepted:
+                encoding = candidate
+                break
+        headers = {
+            # Each encoding is a different representation, so it gets its own strong ETag
+            'ETag': f'"{self.etag}"' if encoding == 'identity' else f'"{self.etag}-{encoding}"',
+            'Last-Modified': self.last_modified,
+            'Cache-Control': self.cache_control
+        }
+        if len(self.bodies) > 1:
+            headers['Vary'] = 'Accept-Encoding'
+        if encoding != 'identity':
+            headers['Content-Encoding'] = encoding
+        return self.bodies[encoding], headers
+
+    def stats(self):
+        return {encoding: len(body) for encoding, body in self.bodies.items()}
+
+
+class StaticAssets:
+    """Precompressed text assets under root, reloaded when a file changes on disk"""
+
+    def __init__(self, root, names=None, max_age=DEFAULT_MAX_AGE):
+        self.root = os.path.abspath(root)
+        self.max_age = max_age
+        self._assets = {}
+        self._lock = threading.Lock()
+        for name in names if names is not None else self._discover():
+            self.get(name)
+
+    def _discover(self):
+        for directory, dirs, files in os.walk(self.root):
+            dirs[:] = [d for d in dirs if not d.startswith('.') and d not in SKIP_DIRS]
+            for name in files:
+                path = os.path.join(directory, name)
+                if (os.path.splitext(name)[1].lower() in COMPRESSIBLE
+                        and os.path.getsize(path) <= MAX_PRECOMPRESS_BYTES):
+                    yield os.path.relpath(path, self.root).replace(os.sep, '/')
+
+    def get(self, name):
+        """Asset for a root-relative name, or None when it is not a precompressed asset"""
+        path = os.path.abspath(os.path.join(self.root, name))
+        if not path.startswith(self.root + os.sep) or os.path.splitext(path)[1].lower() not in COMPRESSIBLE:
+            return None
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        if stat.st_size > MAX_PRECOMPRESS_BYTES:
+            return None
+        with self._lock:
+            asset = self._assets.get(path)
+            if asset is None or asset.mtime != stat.st_mtime or asset.size != stat.st_size:
+                asset = self._assets[path] = Asset(path, self.max_age)
+            return asset
+
+    def stats(self):
+        with self._lock:
+            assets = list(self._assets.values())
+        return {
+            'assets': len(assets),
+            'bytes': sum(asset.size for asset in assets),
+            'gzip_bytes': sum(asset.stats().get('gzip', asset.size) for asset in assets),
+            'brotli': brotli is not None
+        }
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Sentence-aware text chunking
+Splits long text on paragraph and sentence boundaries under a token budget
+so each piece fits in one model call, then maps chunks in parallel
+"""
+
+import re
+import contextvars
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+# Roughly four characters per token for English prose
+CHARS_PER_TOKEN = 4
+
+PARAGRAPH_BREAK = re.compile(r'\n\s*\n')
+SENTENCE = re.compile(r'[^.!?]*(?:[.!?]+["\')\]]*|$)\s*')
+
+Chunk = namedtuple('Chunk', ['text', 'context'])
+
+
+def estimate_tokens(text):
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def split_sentences(text):
+    """Split a paragraph into sentences, keeping their trailing punctuation"""
+    return [m.group(0).strip() for m in SENTENCE.finditer(text) if m.group(0).strip()]
+
+
+def _hard_split(sentence, max_chars):
+    """Split a single over-long sentence on word boundaries"""
+    pieces, current = [], ''
+    for word in sentence.split():
+        while len(word) > max_chars:
+            if current:
+                pieces.append(current)
+                current = ''
+            pieces.append(word[:max_chars])
+            word = word[max_chars:]
+        if current and len(current) + 1 + len(word) > max_chars:
+            pieces.append(current)
+            current = word
+        else:
+            current = f'{current} {word}' if current else word
+    if current:
+        pieces.append(current)
+    return pieces
+
+
+def _units(text, max_chars):
+    """Yield (piece, starts_paragraph) units no longer than max_chars"""
+    for paragraph in PARAGRAPH_BREAK.split(text):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        if len(paragraph) <= max_chars:
+            yield paragraph, True
+            continue
+        first = True
+        for sentence in split_sentences(paragraph):
+            for piece in ([sentence] if len(sentence) <= max_chars else _hard_split(sentence, max_chars)):
+                yield piece, first
+                first = False
+
+
+def chunk_text(text, max_tokens, overlap_tokens=0):
+    """Pack text into chunks of at most max_tokens, breaking only at sentence boundaries.
+
+    With overlap_tokens, each chunk after the first carries the tail of the
+    previous chunk as context (never as text to be rewritten).
+    """
+    max_chars = max(max_tokens * CHARS_PER_TOKEN, 1)
+    overlap_chars = overlap_tokens * CHARS_PER_TOKEN
+    chunks = []
+    current = ''
+    previous = ''
+
+    def flush():
+        context = previous[-overlap_chars:].lstrip() if overlap_chars and previous else ''
+        chunks.append(Chunk(current, context))
+
+    for piece, starts_paragraph in _units(text, max_chars):
+        separator = '\n\n' if starts_paragraph else ' '
+        if current and len(current) + len(separator) + len(piece) > max_chars:
+            flush()
+            previous, current = current, piece
+        else:
+            current = f'{current}{separator}{piece}' if current else piece
+    if current:
+        flush()
+    return chunks
+
+
+def map_chunks(fn, chunks, workers):
+    """Apply fn to every chunk in parallel, returning results in chunk order"""
+    if len(chunks) <= 1:
+        return [fn(chunk) for chunk in chunks]
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(chunks)))) as executor:
+        # Each task runs in a copy of the caller's context (e.g. the upstream client id)
+        futures = [executor.submit(contextvars.copy_context().run, fn, chunk) for chunk in chunks]
+        return [future.result() for future in futures]
+
+
+def stitch(pieces):
+    return '\n\n'.join(piece.strip() for piece in pieces if piece and piece.strip())
@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+"""
+Local text metrics for audiobook manuscripts
+Counts words, sentences and syllables, scores readability, estimates
+speaking time per chapter/voice/speed and measures the share of dialogue
+in one streaming pass, without calling a model
+"""
+
+import re
+import time
+import codecs
+from collections import Counter
+from functools import lru_cache
+
+# Average narration pace in words per minute at speed 1.0
+DEFAULT_WPM = 150
+VOICE_WPM = {
+    'default': DEFAULT_WPM,
+    'lisa': 155,
+    'michael': 145,
+    'allison': 160
+}
+
+WORD = re.compile(r"[A-Za-z0-9]+(?:['’][A-Za-z]+)*")
+SENTENCE_END = re.compile(r'[.!?]+(?=[\s"\'”’)\]]|$)')
+QUOTE = re.compile('(["“”])')
+HEADING = re.compile(r'^[ \t]*(?:chapter|part)[ \t]+[\w.:-]+[^\n]*$', re.IGNORECASE | re.MULTILINE)
+
+VOWEL_GROUP = re.compile(r'[aeiouy]+')
+SILENT_ENDING = re.compile(r'(?:[^laeiouy]es|[^laeiouy]ed|[^laeiouy]e)$')
+
+# Text is processed a line-complete block at a time; a block without any
+# newline is cut at whitespace once it grows past this size
+MAX_PENDING = 1 << 16
+
+
+@lru_cache(maxsize=65536)
+def count_syllables(word):
+    """Heuristic English syllable count (vowel groups minus silent endings)"""
+    word = word.lower()
+    if len(word) <= 3:
+        return 1
+    word = SILENT_ENDING.sub(lambda m: m.group(0)[0], word)
+    return max(1, len(VOWEL_GROUP.findall(word)))
+
+
+def flesch_scores(words, sentences, syllables):
+    """Flesch reading ease and Flesch-Kincaid grade level"""
+    if not words:
+        return None, None
+    words_per_sentence = words / max(sentences, 1)
+    syllables_per_word = syllables / words
+    reading_ease = 206.835 - 1.015 * words_per_sentence - 84.6 * syllables_per_word
+    grade_level = 0.39 * words_per_sentence + 11.8 * syllables_per_word - 15.59
+    return round(reading_ease, 1), round(grade_level, 1)
+
+
+def resolve_voices(voices=None):
+    """Map requested voices (names or {name: wpm}) to words-per-minute"""
+    if not voices:
+        return {'default': DEFAULT_WPM}
+    if isinstance(voices, dict):
+        return {name: float(wpm or VOICE_WPM.get(name, DEFAULT_WPM)) for name, wpm in voices.items()}
+    return {name: VOICE_WPM.get(name, DEFAULT_WPM) for name in voices}
+
+
+class _Chapter:
+    __slots__ = ('title', 'words', 'characters')
+
+    def __init__(self, title):
+        self.title = title
+        self.words = 0
+        self.characters = 0
+
+
+class TextMetrics:
+    """Streaming accumulator: feed() text pieces in order, then result()"""
+
+    def __init__(self, voices=None, speeds=None):
+        self.voices = resolve_voices(voices)
+        self.speeds = [float(speed) for speed in (speeds or [1.0])]
+        self.words = Counter()
+        self.sentences = 0
+        self.characters = 0
+        self.dialogue_words = 0
+        self.in_quote = False
+        self.chapters = [_Chapter(None)]
+        self._pending = ''
+        self._started = time.perf_counter()
+
+    def feed(self, text):
+        self._pending += text
+        cut = self._pending.rfind('\n') + 1
+        if not cut and len(self._pending) > MAX_PENDING:
+            cut = max(self._pending.rfind(' '), self._pending.rfind('\t')) + 1
+        if cut:
+            block, self._pending = self._pending[:cut], self._pending[cut:]
+            self._process(block)
+
+    def _process(self, block):
+        position = 0
+        for match in HEADING.finditer(block):
+            self._scan(block[position:match.start()])
+            self.chapters.append(_Chapter(match.group(0).strip()))
+            self.characters += match.end() - match.start()
+            position = match.end()
+        self._scan(block[position:])
+
+    def _scan(self, text):
+        if not text:
+            return
+        chapter = self.chapters[-1]
+        self.characters += len(text)
+        chapter.characters += len(text)
+        self.sentences += len(SENTENCE_END.findall(text))
+
+        # Pieces alternate between quote marks and the text between them
+        for piece in QUOTE.split(text):
+            if piece == '“':
+                self.in_quote = True
+            elif piece == '”':
+                self.in_quote = False
+            elif piece == '"':
+                self.in_quote = not self.in_quote
+            elif piece:
+                words = WORD.findall(piece)
+                self.words.update(words)
+                chapter.words += len(words)
+                if self.in_quote:
+                    self.dialogue_words += len(words)
+
+    def _minutes(self, words):
+        return {
+            voice: {str(speed): round(words / (wpm * speed), 2) for speed in self.speeds}
+            for voice, wpm in self.voices.items()
+        }
+
+    def result(self):
+        if self._pending:
+            self._process(self._pending)
+            self._pending = ''
+
+        word_count = sum(self.words.values())
+        syllables = sum(count_syllables(word.lower()) * n for word, n in self.words.items())
+        sentences = self.sentences or (1 if word_count else 0)
+        reading_ease, grade_level = flesch_scores(word_count, sentences, syllables)
+
+        chapters = [c for c in self.chapters if c.words or c.title]
+        if len(chapters) > 1 and chapters[0].title is None:
+            chapters[0].title = 'Preface'
+        elif chapters and chapters[0].title is None:
+            chapters[0].title = 'Full Text'
+
+        base_minutes = word_count / DEFAULT_WPM
+        return {
+            'word_count': word_count,
+            'unique_words': len({word.lower() for word in self.words}),
+            'character_count': self.characters,
+            'sentence_count': sentences,
+            'syllable_count': syllables,
+            'avg_words_per_sentence': round(word_count / sentences, 2) if sentences else 0,
+            'avg_syllables_per_word': round(syllables / word_count, 3) if word_count else 0,
+            'flesch_reading_ease': reading_ease,
+            'flesch_kincaid_grade': grade_level,
+            'dialogue_words': self.dialogue_words,
+            'dialogue_ratio': round(self.dialogue_words / word_count, 3) if word_count else 0,
+            'estimated_minutes': round(base_minutes),
+            'estimated_hours': round(base_minutes / 60, 1),
+            'speaking_minutes': self._minutes(word_count),
+            'chapters': [{
+                'title': chapter.title,
+                'word_count': chapter.words,
+                'character_count': chapter.characters,
+                'speaking_minutes': self._minutes(chapter.words)
+            } for chapter in chapters],
+            'elapsed_ms': round((time.perf_counter() - self._started) * 1000, 2)
+        }
+
+
+def analyze_text(text, voices=None, speeds=None):
+    metrics = TextMetrics(voices, speeds)
+    metrics.feed(text)
+    return metrics.result()
+
+
+def analyze_stream(stream, voices=None, speeds=None, block_size=65536, encoding='utf-8'):
+    """Compute metrics from a binary file-like object without reading it whole"""
+    metrics = TextMetrics(voices, speeds)
+    decoder = codecs.getincrementaldecoder(encoding)(errors='replace')
+    while True:
+        data = stream.read(block_size)
+        if not data:
+            break
+        metrics.feed(decoder.decode(data))
+    metrics.feed(decoder.decode(b'', final=True))
+    return metrics.result()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Offline tone rewriter
+Each tone's phrase dictionary is compiled once into a trie-shaped regex,
+so a whole text is rewritten in a single left-to-right pass that always
+prefers the longest matching phrase
+"""
+
+import re
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TONE_RULES = {
+    'neutral': {
+        'majestically': 'prominently',
+        'ancient': 'old',
+        'mysterious': 'unexplained',
+        'emerged': 'appeared',
+        'loomed': 'stood'
+    },
+    'suspenseful': {
+        'stood majestically': 'loomed ominously',
+        'ancient stones': 'crumbling stones that seemed to whisper dark secrets',
+        'emerged': 'crept out like a shadow',
+        'moved with purpose': 'moved with sinister, calculated intent',
+        'discovery': 'shocking, spine-chilling revelation',
+        'mysterious events': 'dark, terrifying incidents that defy explanation',
+        'brave enough': 'foolish enough to dare venture',
+        'within its walls': 'trapped within its haunted walls',
+        'figure': 'shadowy figure'
+    },
+    'inspiring': {
+        'stood majestically': 'stood as a magnificent beacon of resilience and hope',
+        'weathered by': 'strengthened and refined by',
+        'countless stories': 'countless tales of triumph, courage, and human spirit',
+        'emerged': 'stepped forth confidently with renewed purpose',
+        'discovery': 'life-changing, magnificent discovery',
+        'change everything': 'transform lives and inspire generations to come',
+        'brave enough': 'courageous and determined enough',
+        'revelations': 'profound, life-changing insights',
+        'mysterious': 'wondrous and awe-inspiring',
+        'ancient': 'timeless and revered'
+    }
+}
+
+
+def _trie_pattern(node):
+    """Regex for a character trie; greedy optional groups make longer phrases win"""
+    branches = [
+        re.escape(char) + _trie_pattern(child)
+        for char, child in sorted(node.items()) if char != ''
+    ]
+    if not branches:
+        return ''
+    if len(branches) == 1 and '' not in node:
+        return branches[0]
+    group = '(?:' + '|'.join(branches) + ')'
+    return group + '?' if '' in node else group
+
+
+def compile_phrases(phrases):
+    """Compile an iterable of phrases into one longest-match regex"""
+    trie = {}
+    for phrase in phrases:
+        if not phrase:
+            continue
+        node = trie
+        for char in phrase:
+            node = node.setdefault(char, {})
+        node[''] = {}
+    return re.compile(_trie_pattern(trie)) if trie else None
+
+
+def load_tone_rules(path):
+    """Load {tone: {phrase: replacement}} from a JSON file"""
+    with open(path, encoding='utf-8') as f:
+        rules = json.load(f)
+    # Accept the older {tone: {'replacements': {...}}} layout as well
+    return {
+        tone: entry.get('replacements', entry) if isinstance(entry, dict) else {}
+        for tone, entry in rules.items()
+    }
+
+
+class ToneRewriter:
+    def __init__(self, rules=None, default_tone='neutral'):
+        self.default_tone = default_tone
+        self._tones = {}
+        for tone, replacements in (rules or DEFAULT_TONE_RULES).items():
+            self._tones[tone] = (compile_phrases(replacements), dict(replacements))
+        logger.info(
+            f"Compiled tone rules: "
+            + ', '.join(f'{tone}={len(mapping)}' for tone, (_, mapping) in self._tones.items())
+        )
+
+    def tones(self):
+        return list(self._tones)
+
+    def rewrite(self, text, tone):
+        """Rewrite text in one pass; unknown tones fall back to the default tone"""
+        pattern, mapping = self._tones.get(tone) or self._tones.get(self.default_tone, (None, {}))
+        if pattern is None:
+            return text
+        return pattern.sub(lambda match: mapping[match.group(0)], text)
@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+"""
+Pluggable text-to-speech backends
+WatsonTTS calls IBM Watson over the shared HTTP pool; LocalTTS renders
+offline in a process pool sized to the available cores. TTSRouter picks a
+backend per request or per voice and, in auto mode, skips Watson while it is
+throttled, out of quota or timing out
+"""
+
+import os
+import time
+import base64
+import logging
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import requests
+
+import local_tts
+from audio_cache import AUDIO_MIMETYPES
+from rate_limiter import THROTTLE_STATUSES, parse_retry_after
+
+logger = logging.getLogger(__name__)
+
+PLACEHOLDER_KEY = 'your_api_key_here'
+
+
+def available_cores():
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0)) or 1
+    return os.cpu_count() or 1
+
+
+class ResponseBody:
+    """Iterate a streamed response body, closing it (and so returning its
+    upstream slot) when exhausted, on close(), or when garbage collected,
+    even if iteration never started"""
+
+    def __init__(self, response):
+        self.response = response
+        self._chunks = response.iter_content(chunk_size=64 * 1024)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            return next(self._chunks)
+        except BaseException:
+            self.close()
+            raise
+
+    def close(self):
+        if self.response is not None:
+            response, self.response = self.response, None
+            response.close()
+
+    def __del__(self):
+        self.close()
+
+
+class TTSUnavailable(Exception):
+    """The backend cannot serve right now (throttled, out of quota, unreachable)"""
+
+
+class WatsonTTS:
+    name = 'watson'
+    formats = tuple(AUDIO_MIMETYPES)
+    workers = 0
+    ssml = True
+
+    def __init__(self, api_key, url, voices, http_pool, cooldown=60):
+        self.api_key = api_key
+        self.url = url
+        self.voices = voices
+        self.http_pool = http_pool
+        self.cooldown = cooldown
+        self.unavailable_until = 0.0
+        self.failures = 0
+
+    def configured(self):
+        return self.api_key not in ('', None, PLACEHOLDER_KEY)
+
+    def available(self):
+        return self.configured() and time.time() >= self.unavailable_until
+
+    def _back_off(self, seconds=None):
+        self.failures += 1
+        self.unavailable_until = time.time() + (seconds or self.cooldown)
+
+    def synthesize(self, text, voice, speed, fmt='mp3'):
+        """Iterator over the audio bytes, so callers can stream them to disk or the client.
+
+        text may be plain or an SSML <speak> document.
+        """
+        credentials = base64.b64encode(f"apikey:{self.api_key}".encode()).decode()
+        accept = AUDIO_MIMETYPES.get(fmt, 'audio/mp3')
+        headers = {
+            'Authorization': f'Basic {credentials}',
+            'Content-Type': 'application/json',
+            'Accept': accept
+        }
+        params = {
+            'voice': self.voices[voice],
+            'accept': accept,
+            'rate_percentage': round((float(speed) - 1.0) * 100)
+        }
+
+        try:
+            response = self.http_pool.post(
+                f"{self.url}/v1/synthesize",
+                headers=headers,
+                params=params,
+                json={'text': text},
+                stream=True
+            )
+        except (requests.exceptions.Timeout, requests.exceptions.ConnectionError) as e:
+            self._back_off()
+            raise TTSUnavailable(f"Watson TTS unreachable: {str(e)}")
+
+        if response.status_code == 200:
+            return ResponseBody(response)
+        message = response.text
+        response.close()
+        if response.status_code in THROTTLE_STATUSES or 'quota' in message.lower():
+            self._back_off(parse_retry_after(response.headers.get('Retry-After')))
+            raise TTSUnavailable(f"Watson TTS unavailable ({response.status_code}): {message}")
+        raise Exception(f"Watson TTS API error: {message}")
+
+    def stats(self):
+        return {
+            'configured': self.configured(),
+            'available': self.available(),
+            'voices': sorted(self.voices),
+            'failures': self.failures,
+            'retry_in_seconds': max(round(self.unavailable_until - time.time(), 1), 0)
+        }
+
+
+class LocalTTS:
+    """Offline engine: the deterministic tone generator, one process per core"""
+
+    name = 'local'
+    formats = ('wav',)
+    ssml = False
+
+    def __init__(self, voices, workers=None):
+        self.voices = voices        # voice -> pitch factor
+        self.workers = available_cores() if workers is None else workers
+        self._executor = None
+        self._lock = threading.Lock()
+        self.rendered = 0
+        self.in_flight = 0
+
+    def configured(self):
+        return True
+
+    def available(self):
+        return True
+
+    def _pool(self):
+        with self._lock:
+            if self._executor is None:
+                # Created on first use so importing the backend never forks
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            return self._executor
+
+    def _render(self, text, speed, pitch):
+        if self.workers <= 0:
+            return local_tts.synthesize_wav(text, speed, pitch)
+        try:
+            return self._pool().submit(local_tts.synthesize_wav, text, speed, pitch).result()
+        except BrokenProcessPool:
+            # A worker died (e.g. killed by the OS); start a fresh pool and retry once
+            logger.error("Local TTS process pool broke, restarting it")
+            with self._lock:
+                self._executor = None
+            return self._pool().submit(local_tts.synthesize_wav, text, speed, pitch).result()
+
+    def synthesize(self, text, voice, speed, fmt='wav'):
+        with self._lock:
+            self.in_flight += 1
+        try:
+            audio = self._render(text, speed, self.voices[voice])
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+                self.rendered += 1
+        return [audio]
+
+    def stats(self):
+        return {
+            'configured': True,
+            'available': True,
+            'voices': sorted(self.voices),
+            'workers': self.workers,
+            'in_flight': self.in_flight,
+            'rendered': self.rendered
+        }
+
+
+class TTSRouter:
+    """Chooses a backend from the request, the voice mapping or availability"""
+
+    def __init__(self, backends, default='auto', voice_backends=None, fallback=True):
+        self.backends = {backend.name: backend for backend in backends}   # priority order
+        self.default = default
+        self.voice_backends = voice_backends or {}
+        self.fallback = fallback
+        self.fallbacks = 0
+
+    def voices(self):
+        return {name: sorted(backend.voices) for name, backend in self.backends.items()}
+
+    def select(self, voice, requested=None):
+        """Backend for voice; raises ValueError for unknown or unusable choices"""
+        name = requested or self.voice_backends.get(voice) or self.default
+        if name == 'auto':
+            for backend in self.backends.values():
+                if voice in backend.voices and backend.available():
+                    return backend
+            raise ValueError(f"Unknown voice: {voice}")
+        backend = self.backends.get(name)
+        if backend is None:
+            raise ValueError(f"Unknown TTS backend: {name}")
+        if voice not in backend.voices:
+            raise ValueError(f"Unknown voice for {name}: {voice}")
+        if not backend.configured():
+            raise ValueError(f"TTS backend {name} is not configured")
+        return backend
+
+    def fallback_for(self, backend, voice, fmt=None):
+        """Another backend able to render voice (in fmt) while backend is unavailable"""
+        if not self.fallback:
+            return None
+        for candidate in self.backends.values():
+            if (candidate is not backend and voice in candidate.voices and candidate.available()
+                    and (fmt is None or fmt in candidate.formats)):
+                self.fallbacks += 1
+                return candidate
+        return None
+
+    def stats(self):
+        return {
+            'default': self.default,
+            'voice_backends': self.voice_backends,
+            'fallbacks': self.fallbacks,
+            'backends': {name: backend.stats() for name, backend in self.backends.items()}
+        }
+
+
+def parse_voice_backends(value):
+    """'michael=local,lisa=watson' -> {'michael': 'local', 'lisa': 'watson'}"""
+    mapping = {}
+    for pair in (value or '').split(','):
+        voice, _, backend = pair.partition('=')
+        if voice.strip() and backend.strip():
+            mapping[voice.strip()] = backend.strip()
+    return mapping